@@ -0,0 +1,93 @@
+import abc
+import json
+import os
+import tempfile
+import threading
+
+
+class AbstractArtifactStore(abc.ABC):
+    @abc.abstractmethod
+    def get(self, key):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def put(self, key, artifact):
+        raise NotImplementedError
+
+
+class FakeArtifactStore(AbstractArtifactStore):
+    def __init__(self):
+        self.storage = {}
+
+    def get(self, key):
+        return self.storage.get(key)
+
+    def put(self, key, artifact):
+        self.storage[key] = artifact
+
+
+class DiskArtifactStore(AbstractArtifactStore):
+    """ Stores JSON-serializable artifacts (e.g. serialized BDDs) as one file per key in a directory.
+    Reading a file marks it as recently used. When the files exceed max_bytes in total, the least recently used
+    files are removed. Unreadable files are treated as missing. """
+
+    suffix = ".json"
+
+    def __init__(self, directory, max_bytes=2**28):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + self.suffix)
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                artifact = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return artifact
+
+    def put(self, key, artifact):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(artifact, f)
+            os.replace(tmp_path, self._path(key))
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self.cleanup()
+
+    def size(self):
+        return sum(size for _, _, size in self._files())
+
+    def cleanup(self):
+        """ Removes least recently used files until the total size is within max_bytes. """
+        with self._lock:
+            files = sorted(self._files())
+            total = sum(size for _, _, size in files)
+            for _, path, size in files:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+
+    def _files(self):
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(self.suffix):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                files.append((stat.st_mtime_ns, entry.path, stat.st_size))
+        return files
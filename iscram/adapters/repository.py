@@ -50,10 +50,14 @@ class LRUCacheRepository(AbstractRepository):
         return result
 
     def _put(self, key, data):
+        previous = self._storage.get(key)
+        if previous is not None and previous is not data:
+            previous.release_bdd()
         self._storage[key] = data
         self._storage.move_to_end(key)
         if len(self._storage) > self.capacity:
-            self._storage.popitem(last=False)
+            _, evicted = self._storage.popitem(last=False)
+            evicted.release_bdd()
 
     @classmethod
     def _make_key(cls, sg: SystemGraph, resource_identifier: str = None):
@@ -73,5 +77,5 @@ class LRUCacheRepository(AbstractRepository):
 
     def delete(self, key):
         if key in self._storage:
-            del self._storage[key]
+            self._storage.pop(key).release_bdd()
 
@@ -1,8 +1,23 @@
+from collections import deque
+from functools import reduce
+import time
+
 import dd.cudd as _bdd
+import numpy as np
 
 
 fmt_bdd = {"or": " | ", "and": " & "}
 
+# Sizing of CUDD managers: an estimate per system graph node, clamped to a range.
+BDD_MEMORY_PER_NODE = 2**16
+BDD_MEMORY_MIN = 2**24
+BDD_MEMORY_MAX = int(2**30 * 0.3)
+
+# Variable ordering strategies accepted by build_bdd.
+ORDERING_STRATEGIES = ("DFS", "BFS", "WEIGHT", "SIFTING")
+DEFAULT_ORDERING = "SIFTING"
+SIFTING_INITIAL_SWAPS = 1000
+
 
 def build_sg_graph_dict(sg):
     """ Builds a dictionary of dependencies for each node, where each node can have either component
@@ -58,15 +73,223 @@ def prep_for_bdd(sg):
     return r_expr, discovered
 
 
-def build_bdd(sg):
-    """ Main function to produce a BDD from a system graph. Returns the BDD and root node as a tuple."""
-    r_expr, nodes_as_discovered = prep_for_bdd(sg)
+def dependencies(g, u):
+    """ Component then supplier dependencies of u, in the order used by recursive_build_expr. """
+    return g[u].get("component", []) + g[u].get("supplier", [])
+
+
+def dfs_orders(g, root):
+    """ Iterative DFS from root over dependencies. Returns the nodes in order of discovery (the same first-visit order
+    as recursive_build_expr) and in post-order (every node after all of its dependencies). Only nodes that can reach
+    root are visited. """
+    discovered = [root]
+    post_order = []
+    seen = {root}
+    stack = [(root, iter(dependencies(g, root)))]
+    while stack:
+        u, children = stack[-1]
+        for c in children:
+            if c not in seen:
+                seen.add(c)
+                discovered.append(c)
+                stack.append((c, iter(dependencies(g, c))))
+                break
+        else:
+            stack.pop()
+            post_order.append(u)
+
+    return discovered, post_order
+
+
+def combine_bdds(fs, logic):
+    if logic == "and":
+        return reduce(lambda a, b: a & b, fs)
+    return reduce(lambda a, b: a | b, fs)
+
+
+def combine_uncertain_bdds(fs, es, logic):
+    """ As combine_bdds, where dependency i only exists if es[i] holds (None if it always exists).
+    An "or" holds if an existing dependency holds. An "and" holds if every existing dependency holds and at least one
+    dependency exists: (&(~e | f)) & (|e). """
+    if all(e is None for e in es):
+        return combine_bdds(fs, logic)
+    if logic == "and":
+        holds = reduce(lambda a, b: a & b, [f if e is None else ~e | f for f, e in zip(fs, es)])
+        if any(e is None for e in es):
+            return holds
+        return holds & reduce(lambda a, b: a | b, es)
+    return reduce(lambda a, b: a | b, [f if e is None else e & f for f, e in zip(fs, es)])
+
+
+def edge_variable(src, dst):
+    """ Name of the (fictive) BDD variable for the existence of the edge src -> dst. """
+    return "@{}@{}".format(src, dst)
+
+
+def apply_build_bdd(sg, g, bdd, post_order, edge_existence=None, node_functions=None):
+    """ Builds the BDD of each node in post_order with apply operations on the manager, following the same
+    structure as recursive_build_expr: ( node | component_deps | supplier_deps ). Each node's BDD is built once and
+    reused by every node depending on it, so shared subgraphs are not re-expanded. Returns the BDD of the last node.
+    Dependencies over an edge (src, dst) in edge_existence only count if the edge's existence function holds.
+    A node in node_functions stands for the given function instead of its own variable. """
+    edge_existence = edge_existence or {}
+    node_functions = node_functions or {}
+
+    def existence(src, dst):
+        return edge_existence.get((src, dst))
+
+    node_bdds = {}
+    f = bdd.false
+    for u in post_order:
+        f = node_functions[u] if u in node_functions else bdd.var(u)
+        comp = g[u].get("component", [])
+        if len(comp) > 0:
+            f = f | combine_uncertain_bdds([node_bdds[c] for c in comp], [existence(c, u) for c in comp],
+                                           sg.nodes[u].logic["component"])
+        sup = g[u].get("supplier", [])
+        if len(sup) > 0:
+            f = f | combine_uncertain_bdds([node_bdds[s] for s in sup], [existence(s, u) for s in sup],
+                                           sg.nodes[u].logic.get("supplier", "and"))
+        node_bdds[u] = f
+
+    return f
+
+
+def bfs_order(g, root):
+    """ Nodes in breadth-first order of discovery from root over dependencies. """
+    order = [root]
+    seen = {root}
+    queue = deque([root])
+    while queue:
+        u = queue.popleft()
+        for c in dependencies(g, u):
+            if c not in seen:
+                seen.add(c)
+                order.append(c)
+                queue.append(c)
+    return order
+
+
+def weight_order(g, root):
+    """ Depth-first order in which the dependencies of each node are visited heaviest first. A node's weight is its
+    fan-in (the number of nodes depending on it), then the size of its dependency cone. Shared nodes are therefore
+    placed near the top, and subgraphs are kept contiguous as in the plain DFS order. """
+    _, post_order = dfs_orders(g, root)
+    fan_in = {u: 0 for u in post_order}
+    cones = {}
+    for u in post_order:
+        cone = {u}
+        for c in dependencies(g, u):
+            fan_in[c] += 1
+            cone |= cones[c]
+        cones[u] = cone
+
+    def heaviest_first(u):
+        return sorted(dependencies(g, u), key=lambda c: (-fan_in[c], -len(cones[c])))
+
+    order = [root]
+    seen = {root}
+    stack = [iter(heaviest_first(root))]
+    while stack:
+        for c in stack[-1]:
+            if c not in seen:
+                seen.add(c)
+                order.append(c)
+                stack.append(iter(heaviest_first(c)))
+                break
+        else:
+            stack.pop()
+    return order
+
+
+def sift(bdd, time_budget=None):
+    """ Reorders by sifting. With a time budget (seconds), sifting runs in rounds bounded by a number of variable swaps,
+    sized from the measured speed of the previous round, until the budget is spent or a round brings no improvement. """
+    if time_budget is None:
+        bdd.reorder()
+        return
+
+    max_swaps = bdd.configure()["max_swaps"]
+    swaps = SIFTING_INITIAL_SWAPS
+    deadline = time.perf_counter() + time_budget
+    size = len(bdd)
+    try:
+        while True:
+            start = time.perf_counter()
+            if start >= deadline:
+                break
+            bdd.configure(max_swaps=swaps)
+            bdd.reorder()
+            elapsed = time.perf_counter() - start
+            if len(bdd) >= size:
+                break
+            size = len(bdd)
+            swaps = max(1, int(swaps / max(elapsed, 1e-6) * (deadline - time.perf_counter())))
+    finally:
+        bdd.configure(max_swaps=max_swaps)
+
+
+def bdd_variable_order(bdd, f):
+    """ The variables of f from top to bottom in the current order of the manager. """
+    return sorted(bdd.support(f), key=bdd.level_of_var)
+
+
+def estimate_bdd_memory(sg):
+    """ Memory estimate in bytes for a CUDD manager holding the BDD of sg. """
+    return min(max(len(sg.nodes) * BDD_MEMORY_PER_NODE, BDD_MEMORY_MIN), BDD_MEMORY_MAX)
+
 
-    bdd = _bdd.BDD(memory_estimate=(int(2**30 * 0.3)))
-    bdd.configure(reordering=True)
-    bdd.declare(*nodes_as_discovered)
-    r = bdd.add_expr(r_expr)
-    bdd.reorder()
+def build_bdd(sg, bdd=None, ordering=DEFAULT_ORDERING, initial_order=None, time_budget=None, uncertain_edges=None):
+    """ Main function to produce a BDD from a system graph. Returns the BDD and root node as a tuple.
+    If no BDD manager is given, a new one sized to the graph is created.
+    Variables are declared in the order given by the ordering strategy:
+        - DFS: order of discovery from the indicator
+        - BFS: breadth-first order from the indicator
+        - WEIGHT: DFS visiting shared and larger subgraphs first
+        - SIFTING: DFS, improved by sifting (within time_budget seconds, if given)
+    If initial_order is given (e.g. the order of a related graph), it is used instead and no sifting is done.
+    Variables already declared in the manager keep their levels.
+    Each edge (src, dst) in uncertain_edges gets an existence variable (see edge_variable), declared just before src.
+    """
+    if ordering not in ORDERING_STRATEGIES:
+        raise ValueError("Unknown variable ordering: {}".format(ordering))
+
+    g = build_sg_graph_dict(sg)
+    nodes_as_discovered, post_order = dfs_orders(g, "indicator")
+
+    if initial_order is not None:
+        order = [u for u in initial_order if u in g]
+        ordered = set(order)
+        order += [u for u in nodes_as_discovered if u not in ordered]
+    elif ordering == "BFS":
+        order = bfs_order(g, "indicator")
+    elif ordering == "WEIGHT":
+        order = weight_order(g, "indicator")
+    else:
+        order = nodes_as_discovered
+
+    if uncertain_edges:
+        uncertain_edges = {(src, dst) for src, dst in uncertain_edges if src in dependencies(g, dst)}
+        before = {}
+        for src, dst in sorted(uncertain_edges):
+            before.setdefault(src, []).append(edge_variable(src, dst))
+        order = [v for u in order for v in before.get(u, []) + [u]]
+    else:
+        uncertain_edges = frozenset()
+
+    do_sifting = ordering == "SIFTING" and initial_order is None
+
+    if bdd is None:
+        bdd = _bdd.BDD(memory_estimate=estimate_bdd_memory(sg))
+    # Without a time budget, sifting also runs dynamically while building, as it always has.
+    previous = bdd.configure(reordering=(do_sifting and time_budget is None))
+    try:
+        bdd.declare(*order)
+        r = apply_build_bdd(sg, g, bdd, post_order, {e: bdd.var(edge_variable(*e)) for e in uncertain_edges})
+        if do_sifting:
+            sift(bdd, time_budget)
+    finally:
+        bdd.configure(reordering=previous["reordering"])
 
     return bdd, r
 
@@ -93,3 +316,130 @@ def bdd_prob(bdd, f, p, memo):
     return 1-r if f.negated else r
 
 
+def _regular_key(g):
+    """ Integer identity of the regular (non-negated) node underlying the edge g. """
+    return int(~g) if g.negated else int(g)
+
+
+def bdd_node_table(f):
+    """ Returns one row (key, var, high_key, high_negated, low_key, low_negated) for each regular internal node
+    reachable from f, ordered so that every node comes before its children. Keys are the integer identities of the
+    regular nodes; terminal children all have the key of bdd.true. Uses an explicit stack (iterative post-order DFS),
+    so deep BDDs do not hit the recursion limit. """
+    rows = []
+    visited = set()
+    stack = [f]
+    while stack:
+        u = stack.pop()
+        if isinstance(u, tuple):
+            rows.append(u)
+            continue
+        if u.var is None:
+            continue
+        if u.negated:
+            u = ~u
+        k = int(u)
+        if k in visited:
+            continue
+        visited.add(k)
+        g, h = u.high, u.low
+        stack.append((k, u.var, _regular_key(g), g.negated, _regular_key(h), h.negated))
+        stack.append(h)
+        stack.append(g)
+
+    rows.reverse()
+    return rows
+
+
+def serialize_bdd(bdd, f):
+    """ Returns a JSON-serializable description of the BDD rooted at f: its variable order and node table (see
+    bdd_node_table), and the root as [key, negated]. """
+    return {
+        "order": bdd_variable_order(bdd, f),
+        "rows": [list(row) for row in bdd_node_table(f)],
+        "root": [_regular_key(f), f.negated],
+        "true": int(bdd.true)
+    }
+
+
+def deserialize_bdd(bdd, data):
+    """ Rebuilds a BDD described by serialize_bdd in the given manager and returns its root. Variables not yet in
+    the manager are declared in the stored order; variables already there keep their levels. """
+    bdd.declare(*data["order"])
+    nodes = {data["true"]: bdd.true}
+    for k, x, g, g_neg, h, h_neg in reversed(data["rows"]):
+        high = ~nodes[g] if g_neg else nodes[g]
+        low = ~nodes[h] if h_neg else nodes[h]
+        nodes[k] = bdd.ite(bdd.var(x), high, low)
+    key, negated = data["root"]
+    return ~nodes[key] if negated else nodes[key]
+
+
+def _node_probabilities(bdd, rows, p, memo):
+    """ Fills memo with the (non-negated) probability of each node in rows, children first. """
+    memo[int(bdd.true)] = 1.0
+    for k, x, g, g_neg, h, h_neg in reversed(rows):
+        if k in memo:
+            continue
+        high = 1 - memo[g] if g_neg else memo[g]
+        low = 1 - memo[h] if h_neg else memo[h]
+        memo[k] = p[x] * high + (1 - p[x]) * low
+    return memo
+
+
+def bdd_prob_iterative(bdd, f, p, memo=None):
+    """ Evaluate the BDD probability at node f, as bdd_prob does, without recursion.
+     Nodes are visited in topological order (children first) and the memo is keyed by the integer identity of the
+     regular node, so it may be reused across calls only with the same probabilities p. """
+    if memo is None:
+        memo = dict()
+
+    _node_probabilities(bdd, bdd_node_table(f), p, memo)
+    r = memo[_regular_key(f)]
+    return 1 - r if f.negated else r
+
+
+def bdd_birnbaum_importance(bdd, f, p):
+    """ Birnbaum importance of every variable in the BDD rooted at f, i.e. d P(f) / d p[x].
+    A bottom-up pass computes the probability of each node. A top-down pass then computes the sensitivity of P(f)
+    to each node (the "path probability" of reaching it, signed by complement edges). The importance of x is the sum
+    over nodes labeled x of sensitivity * (P(high) - P(low)). Variables not in the BDD are absent from the result. """
+    rows = bdd_node_table(f)
+    b_imps = {}
+    if not rows:
+        return b_imps
+
+    probs = _node_probabilities(bdd, rows, p, dict())
+
+    sensitivity = {k: 0.0 for k, *_ in rows}
+    sensitivity[int(bdd.true)] = 0.0
+    sensitivity[_regular_key(f)] = -1.0 if f.negated else 1.0
+
+    for k, x, g, g_neg, h, h_neg in rows:
+        s = sensitivity[k]
+        high = 1 - probs[g] if g_neg else probs[g]
+        low = 1 - probs[h] if h_neg else probs[h]
+        b_imps[x] = b_imps.get(x, 0.0) + s * (high - low)
+
+        sensitivity[g] += -s * p[x] if g_neg else s * p[x]
+        sensitivity[h] += -s * (1 - p[x]) if h_neg else s * (1 - p[x])
+
+    return b_imps
+
+
+def bdd_prob_batch(bdd, f, p_matrix, variables):
+    """ Evaluate the BDD probability at node f for many scenarios in one traversal.
+    p_matrix is an SxV array with one row per scenario; its columns follow the variable names in variables.
+    Each node combines whole column vectors, so the result is an array of S probabilities. """
+    p_matrix = np.asarray(p_matrix, dtype=float)
+    columns = {v: j for j, v in enumerate(variables)}
+
+    memo = {int(bdd.true): np.ones(p_matrix.shape[0])}
+    for k, x, g, g_neg, h, h_neg in reversed(bdd_node_table(f)):
+        high = 1 - memo[g] if g_neg else memo[g]
+        low = 1 - memo[h] if h_neg else memo[h]
+        px = p_matrix[:, columns[x]]
+        memo[k] = px * high + (1 - px) * low
+
+    r = memo[_regular_key(f)]
+    return 1 - r if f.negated else r
@@ -0,0 +1,187 @@
+import threading
+import weakref
+from contextlib import contextmanager
+
+import dd.cudd as _bdd
+
+from iscram.domain.metrics.bdd_functions import (
+    build_bdd, estimate_bdd_memory, bdd_variable_order, serialize_bdd, deserialize_bdd, DEFAULT_ORDERING
+)
+
+
+DEFAULT_POOL_MEMORY = 2**30
+DEFAULT_MANAGER_MEMORY = 2**26
+DEFAULT_SIFTING_TIME_BUDGET = None
+
+
+class _Manager:
+    def __init__(self, memory):
+        self.bdd = _bdd.BDD(memory_estimate=memory)
+        self.bdd.configure(reordering=True)
+        self.lock = threading.RLock()
+        self.memory = memory
+        self.load = 0
+        self.node_sets = {}
+
+    def accepts(self, names):
+        """ Variables are shared by name, so a manager only takes graphs over the same node names as one already
+        here, e.g. graphs derived by with_suppliers. Unrelated graphs reusing names (x1, x2, ...) would otherwise
+        force a compromise variable order on each other. """
+        return not self.node_sets or names in self.node_sets.values()
+
+
+class _Entry:
+    def __init__(self, manager, root, memory):
+        self.manager = manager
+        self.root = root
+        self.memory = memory
+        self.refcount = 0
+
+
+class BDDManagerPool:
+    """ Shares CUDD managers between system graphs instead of creating one manager per graph.
+    Each graph's memory need is estimated from its size. A graph is placed in a manager with room for it and with
+    compatible variables (see _Manager.accepts). A new manager is only created while the memory reserved by all
+    managers stays under max_memory, after which graphs share the least loaded manager.
+    Roots are reference counted by graph id, with one reference held by each SystemGraph object that acquired it.
+    The reference is dropped by release() (e.g. on eviction from a repository) or when the graph is garbage
+    collected. A root without references is dropped, and a manager without roots is removed from the pool, so CUDD
+    can free its nodes.
+    Roots are built with the given ordering strategy and sifting time budget (see build_bdd); without a time budget,
+    dynamic reordering stays on while building. The variable order of a root is read from its manager when asked
+    for, since sifting for any root in a manager moves the variables of all of them.
+    A place in a manager is reserved under the pool lock, while the root is built under the lock of its manager, so
+    that builds in other managers, and lookups, are not held up by it. CUDD managers are not thread safe, and graphs
+    sharing a manager may be used from several threads (e.g. jobs and requests), so every other operation on a
+    pooled BDD (let, apply, compile, configure, evaluation, dropping nodes) runs inside locked(sg) as well.
+    If an artifact store (with get(key) and put(key, artifact), see adapters.artifact_store) is set, roots are
+    loaded from it by graph id before being built, and newly built roots are saved to it. """
+
+    def __init__(self, max_memory=DEFAULT_POOL_MEMORY, manager_memory=DEFAULT_MANAGER_MEMORY,
+                 ordering=DEFAULT_ORDERING, sifting_time_budget=DEFAULT_SIFTING_TIME_BUDGET):
+        self.max_memory = max_memory
+        self.manager_memory = manager_memory
+        self.ordering = ordering
+        self.sifting_time_budget = sifting_time_budget
+        self.artifact_store = None
+        self._managers = []
+        self._entries = {}
+        self._leases = {}
+        self._lock = threading.RLock()
+
+    @property
+    def reserved_memory(self):
+        return sum(m.memory for m in self._managers)
+
+    def statistics(self):
+        with self._lock:
+            return {
+                "managers": len(self._managers),
+                "roots": len(self._entries),
+                "references": sum(e.refcount for e in self._entries.values()),
+                "reserved_memory": self.reserved_memory,
+                "estimated_load": sum(m.load for m in self._managers)
+            }
+
+    def acquire(self, sg, initial_order=None):
+        """ Returns (bdd, root) for sg, building the root in a shared manager if no graph with this id holds one.
+        An initial_order skips the ordering strategy when building. """
+        key = sg.get_id()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                memory = estimate_bdd_memory(sg)
+                names = frozenset(sg.nodes)
+                manager = self._select_manager(memory, names)
+                entry = _Entry(manager, None, memory)
+                self._entries[key] = entry
+                manager.node_sets[key] = names
+                manager.load += memory
+
+            lease = None
+            if id(sg) not in self._leases:
+                entry.refcount += 1
+                lease = weakref.finalize(sg, self._release, id(sg), key)
+                lease.atexit = False
+                self._leases[id(sg)] = lease
+
+        # Concurrent acquires of the same graph wait here for the first one to build its root. If a build fails, the
+        # reference taken for it is dropped and the next acquire builds again.
+        try:
+            with entry.manager.lock:
+                if entry.root is None:
+                    entry.root = self._load_or_build(key, sg, entry.manager.bdd, initial_order)
+        except BaseException:
+            if lease is not None:
+                lease()
+            raise
+        return entry.manager.bdd, entry.root
+
+    @contextmanager
+    def locked(self, sg):
+        """ Holds the lock of the manager of sg (which must have acquired its root) and yields (bdd, root). """
+        with self._lock:
+            entry = self._entries[sg.get_id()]
+        with entry.manager.lock:
+            yield entry.manager.bdd, entry.root
+
+    def get_variable_order(self, sg):
+        """ The current variable order (top to bottom) of the root of sg in its manager. """
+        with self.locked(sg) as (bdd, root):
+            return bdd_variable_order(bdd, root)
+
+    def release(self, sg):
+        """ Drops the reference held by sg, if any. Safe to call more than once. """
+        with self._lock:
+            lease = self._leases.get(id(sg))
+        if lease is not None:
+            lease()
+
+    def _release(self, lease_id, key):
+        with self._lock:
+            self._leases.pop(lease_id, None)
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            entry.refcount -= 1
+            if entry.refcount > 0:
+                return
+
+            del self._entries[key]
+            manager = entry.manager
+            del manager.node_sets[key]
+            manager.load -= entry.memory
+            if not manager.node_sets:
+                self._managers.remove(manager)
+
+        # Dereferencing the root changes the manager too. Taken after the pool lock, as in acquire.
+        with manager.lock:
+            entry.root = None
+
+    def _load_or_build(self, key, sg, bdd, initial_order):
+        if self.artifact_store is not None:
+            artifact = self.artifact_store.get(key)
+            if artifact is not None:
+                return deserialize_bdd(bdd, artifact)
+
+        _, root = build_bdd(sg, bdd, self.ordering, initial_order, self.sifting_time_budget)
+        if self.artifact_store is not None:
+            self.artifact_store.put(key, serialize_bdd(bdd, root))
+        return root
+
+    def _select_manager(self, memory, names):
+        for manager in self._managers:
+            if manager.load + memory <= manager.memory and manager.accepts(names):
+                return manager
+
+        new_memory = max(memory, self.manager_memory)
+        if not self._managers or self.reserved_memory + new_memory <= self.max_memory:
+            manager = _Manager(new_memory)
+            self._managers.append(manager)
+            return manager
+
+        # At the memory cap: share the manager with the most room relative to its size.
+        return min(self._managers, key=lambda m: m.load / m.memory)
+
+
+bdd_manager_pool = BDDManagerPool()
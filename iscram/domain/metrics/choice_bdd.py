@@ -0,0 +1,132 @@
+from typing import Dict, List, Tuple
+
+import dd.cudd as _bdd
+import numpy as np
+
+from iscram.domain.model import SystemGraph
+from iscram.domain.metrics.bdd_functions import dfs_orders, apply_build_bdd, estimate_bdd_memory, sift
+from iscram.domain.metrics.compiled_bdd import compile_bdd, compiled_prob_vectors
+from iscram.domain.metrics.probability_providers import provide_p_direct_from_data
+
+
+def selector_variable(src, dst):
+    """ Name of the (fictive) BDD variable selecting supplier src for component dst. """
+    return "@sel@{}@{}".format(src, dst)
+
+
+def own_variable(src, dst):
+    """ Name of the (fictive) BDD variable for the risk of component dst itself when supplied by src. """
+    return "@own@{}@{}".format(src, dst)
+
+
+def _type_tag(sg, node):
+    return "component" if "component" in sg.nodes[node].tags else "supplier"
+
+
+def build_choice_bdd(sg: SystemGraph, pairs: List[Tuple[str, str]], bdd=None, time_budget=None):
+    """ Builds one BDD for sg over all supplier choices given as (supplier, component) pairs, so that the graph that
+    with_suppliers would derive for any choice is evaluated by fixing selector variables instead of being built:
+        - Component c supplied through pair (s, c) depends on s only if the pair's selector holds, and fails by itself
+          if the selector and the pair's own variable hold (the component's risk may depend on its supplier).
+        - A supplier-supplier edge counts if both ends are chosen: used by a selected pair, or the root of a supplier
+          group with a used member (as with_suppliers tags them).
+        - Supplier-component edges of sg that are not pairs are ignored; other edges count unless potential.
+    Variables are declared in DFS order from the indicator, each pair's variables just before its component, and
+    improved by sifting (within time_budget seconds, if given). Returns the BDD and root node as a tuple. """
+    if bdd is None:
+        bdd = _bdd.BDD(memory_estimate=estimate_bdd_memory(sg))
+
+    g = {n: {} for n in sg.nodes}
+    supplier_edges = []
+    for e in sg.edges:
+        if e.src in sg.suppliers and e.dst in sg.components:
+            continue
+        if e.src in sg.suppliers and e.dst in sg.suppliers:
+            supplier_edges.append((e.src, e.dst))
+        elif "potential" in e.tags:
+            continue
+        g[e.dst][_type_tag(sg, e.src)] = g[e.dst].get(_type_tag(sg, e.src), []) + [e.src]
+    for s, c in pairs:
+        g[c]["supplier"] = g[c].get("supplier", []) + [s]
+
+    discovered, post_order = dfs_orders(g, "indicator")
+    pairs_of_component = {}
+    for s, c in pairs:
+        pairs_of_component.setdefault(c, []).append((s, c))
+    order = []
+    for u in discovered:
+        for s, c in pairs_of_component.get(u, []):
+            order += [selector_variable(s, c), own_variable(s, c)]
+        if u not in pairs_of_component:
+            order.append(u)
+
+    previous = bdd.configure(reordering=time_budget is None)
+    bdd.declare(*order)
+
+    used = {}
+    for s, c in pairs:
+        used[s] = used.get(s, bdd.false) | bdd.var(selector_variable(s, c))
+    chosen = {s: used.get(s, bdd.false) for s in sg.suppliers}
+    for root, group in sg.supplier_groups.items():
+        for member in group:
+            chosen[root] = chosen[root] | used.get(member, bdd.false)
+
+    edge_existence = {(s, c): bdd.var(selector_variable(s, c)) for s, c in pairs}
+    edge_existence.update({(src, dst): chosen[src] & chosen[dst] for src, dst in supplier_edges})
+    node_functions = {}
+    for c, c_pairs in pairs_of_component.items():
+        f = bdd.false
+        for s, _ in c_pairs:
+            f = f | (bdd.var(selector_variable(s, c)) & bdd.var(own_variable(s, c)))
+        node_functions[c] = f
+
+    r = apply_build_bdd(sg, g, bdd, post_order, edge_existence, node_functions)
+    sift(bdd, time_budget)
+    bdd.configure(reordering=previous["reordering"])
+    return bdd, r
+
+
+def provide_p_with_choices_from_data(sg: SystemGraph, data, pairs: List[Tuple[str, str]]) -> Dict[str, float]:
+    """ Probabilities of the nodes and own variables of a choice BDD, as provide_p_direct_from_data gives them for
+    the graph derived by with_suppliers: the risk of component c supplied by s is the risk of the data edge (s, c),
+    if given, else the risk of c. Selector variables are not included. """
+    p = provide_p_direct_from_data(sg, data)
+    node_risks = {n: d.get("risk", 0.0) for n, d in data.get("nodes", {}).items()}
+    own = {(s, c): node_risks.get(c, 0.0) for s, c in pairs}
+    for edge in data.get("edges", []):
+        if (edge["src"], edge["dst"]) in own:
+            own[(edge["src"], edge["dst"])] = edge.get("risk", own[(edge["src"], edge["dst"])])
+    p.update({own_variable(s, c): risk for (s, c), risk in own.items()})
+    return p
+
+
+def choice_risk_batch(compiled, p_vector, selector_index, selections):
+    """ Probability of the compiled choice BDD for each row of selections (SxP booleans, one column per pair), with
+    the other variables at p_vector (aligned to compiled.variables) and pair k's selector at selector_index[k]
+    (-1 if the BDD does not depend on it). Takes only picklable arguments, to run in worker processes. """
+    selections = np.atleast_2d(selections)
+    p_vars = np.repeat(np.asarray(p_vector, dtype=float)[:, np.newaxis], len(selections), axis=1)
+    present = selector_index >= 0
+    p_vars[selector_index[present]] = selections[:, present].T
+    return compiled_prob_vectors(compiled, p_vars)
+
+
+class ChoiceBDD:
+    """ The choice BDD (see build_choice_bdd) of a graph over the given pairs, compiled for batched evaluation. """
+
+    def __init__(self, sg: SystemGraph, pairs: List[Tuple[str, str]], time_budget=None):
+        self.pairs = list(pairs)
+        self.bdd, self.root = build_choice_bdd(sg, self.pairs, time_budget=time_budget)
+        self.compiled = compile_bdd(self.bdd, self.root)
+        index = {v: i for i, v in enumerate(self.compiled.variables)}
+        self.selector_index = np.array([index.get(selector_variable(s, c), -1) for s, c in self.pairs],
+                                       dtype=np.int64).reshape(len(self.pairs))
+
+    def p_vector(self, p: Dict[str, float]):
+        """ The probabilities of p aligned to the compiled variables, with selectors at 0. """
+        selectors = {selector_variable(s, c) for s, c in self.pairs}
+        return np.array([0.0 if v in selectors else p[v] for v in self.compiled.variables], dtype=float)
+
+    def risk_batch(self, p_vector, selections):
+        """ System risk of each row of selections, see choice_risk_batch. """
+        return choice_risk_batch(self.compiled, p_vector, self.selector_index, selections)
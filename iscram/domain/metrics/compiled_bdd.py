@@ -0,0 +1,134 @@
+import numpy as np
+
+from iscram.domain.metrics.bdd_functions import bdd_node_table, bdd_variable_order
+
+
+class CompiledBDD:
+    """ A BDD flattened into NumPy arrays, independent of the CUDD manager and picklable.
+    Node 0 is the true terminal; other nodes are the regular internal nodes of the BDD. For node k:
+        - var[k]: index into variables of the node's variable (-1 for the terminal)
+        - high[k], low[k]: indices of the children
+        - high_negated[k], low_negated[k]: complement flags of the edges to the children
+    order lists the internal nodes children first, grouped into layers by height above the terminal:
+    order[layer_bounds[i]:layer_bounds[i + 1]] is layer i. The nodes of a layer only have children in lower layers,
+    so a layer is evaluated as a whole. The function is the root node, complemented if root_negated. """
+
+    def __init__(self, variables, var, high, high_negated, low, low_negated, order, layer_bounds, root,
+                 root_negated):
+        self.variables = variables
+        self.var = var
+        self.high = high
+        self.high_negated = high_negated
+        self.low = low
+        self.low_negated = low_negated
+        self.order = order
+        self.layer_bounds = layer_bounds
+        self.root = root
+        self.root_negated = root_negated
+
+    def __len__(self):
+        return len(self.var)
+
+    def layers(self):
+        for i in range(len(self.layer_bounds) - 1):
+            yield self.order[self.layer_bounds[i]:self.layer_bounds[i + 1]]
+
+    def p_vector(self, p):
+        """ The probabilities of p (a dict by variable name) aligned to variables. """
+        return np.array([p[v] for v in self.variables], dtype=float)
+
+    def p_columns(self, p_matrix, variables):
+        """ The columns of p_matrix (SxV, columns following the names in variables) aligned to variables, as VxS. """
+        columns = {v: j for j, v in enumerate(variables)}
+        return np.asarray(p_matrix, dtype=float)[:, [columns[v] for v in self.variables]].T
+
+
+def compile_bdd(bdd, f) -> CompiledBDD:
+    """ Flattens the BDD rooted at f into a CompiledBDD. """
+    rows = bdd_node_table(f)
+    variables = bdd_variable_order(bdd, f)
+    var_index = {v: i for i, v in enumerate(variables)}
+
+    n = len(rows) + 1
+    index = {int(bdd.true): 0}
+    var = np.full(n, -1, dtype=np.int32)
+    high = np.zeros(n, dtype=np.int32)
+    low = np.zeros(n, dtype=np.int32)
+    high_negated = np.zeros(n, dtype=bool)
+    low_negated = np.zeros(n, dtype=bool)
+    height = np.zeros(n, dtype=np.int32)
+
+    for i, (k, x, g, g_neg, h, h_neg) in enumerate(reversed(rows), start=1):
+        index[k] = i
+        var[i] = var_index[x]
+        high[i], high_negated[i] = index[g], g_neg
+        low[i], low_negated[i] = index[h], h_neg
+        height[i] = max(height[high[i]], height[low[i]]) + 1
+
+    order = np.argsort(height[1:], kind="stable").astype(np.int32) + 1
+    layer_bounds = np.searchsorted(height[order], np.arange(1, height.max() + 2)).astype(np.int32)
+
+    root = index[int(~f) if f.negated else int(f)]
+    return CompiledBDD(variables, var, high, high_negated, low, low_negated, order, layer_bounds, root, f.negated)
+
+
+def _edge_values(values, children, negated):
+    v = values[children]
+    if negated.ndim < v.ndim:
+        negated = negated[:, np.newaxis]
+    return np.where(negated, 1 - v, v)
+
+
+def _node_values(c: CompiledBDD, p_vars):
+    """ Probability of each node (regular, i.e. not complemented), for p_vars of shape V or VxS. """
+    values = np.empty((len(c),) + p_vars.shape[1:])
+    values[0] = 1.0
+    for layer in c.layers():
+        px = p_vars[c.var[layer]]
+        high = _edge_values(values, c.high[layer], c.high_negated[layer])
+        low = _edge_values(values, c.low[layer], c.low_negated[layer])
+        values[layer] = px * high + (1 - px) * low
+    return values
+
+
+def _root_value(c: CompiledBDD, values):
+    r = values[c.root]
+    return 1 - r if c.root_negated else r
+
+
+def compiled_prob(c: CompiledBDD, p):
+    """ Probability of the compiled BDD given p, a dict by variable name. """
+    return float(_root_value(c, _node_values(c, c.p_vector(p))))
+
+
+def compiled_prob_batch(c: CompiledBDD, p_matrix, variables):
+    """ Probability of the compiled BDD for each row (scenario) of p_matrix, whose columns follow variables. """
+    return _root_value(c, _node_values(c, c.p_columns(p_matrix, variables)))
+
+
+def compiled_prob_vectors(c: CompiledBDD, p_vars):
+    """ Probability of the compiled BDD for each column (scenario) of p_vars, whose rows follow c.variables. """
+    return _root_value(c, _node_values(c, np.asarray(p_vars, dtype=float)))
+
+
+def compiled_birnbaum_importance(c: CompiledBDD, p):
+    """ Birnbaum importance of each variable of the compiled BDD, computed as bdd_birnbaum_importance does, with
+    the top-down sensitivity pass going through the layers from the root down. """
+    p_vars = c.p_vector(p)
+    values = _node_values(c, p_vars)
+
+    sensitivity = np.zeros(len(c))
+    sensitivity[c.root] = -1.0 if c.root_negated else 1.0
+    importance = np.zeros(len(c.variables))
+
+    for layer in reversed(list(c.layers())):
+        s = sensitivity[layer]
+        x = c.var[layer]
+        px = p_vars[x]
+        high = _edge_values(values, c.high[layer], c.high_negated[layer])
+        low = _edge_values(values, c.low[layer], c.low_negated[layer])
+        np.add.at(importance, x, s * (high - low))
+        np.add.at(sensitivity, c.high[layer], np.where(c.high_negated[layer], -s, s) * px)
+        np.add.at(sensitivity, c.low[layer], np.where(c.low_negated[layer], -s, s) * (1 - px))
+
+    return {v: float(importance[i]) for i, v in enumerate(c.variables)}
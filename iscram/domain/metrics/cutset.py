@@ -1,10 +1,13 @@
-from typing import FrozenSet, List, Set, Dict
+from typing import FrozenSet, List, Set, Dict, NamedTuple, Tuple
 from collections import deque
 
+import heapq
 import math
 
+import numpy as np
+
 from iscram.domain.model import SystemGraph
-from iscram.domain.metrics.bdd_functions import build_bdd
+from iscram.domain.metrics.bdd_functions import build_bdd, bdd_node_table
 
 
 def prep_for_mocus(sg: SystemGraph, ignore_suppliers):
@@ -67,7 +70,233 @@ def prep_for_mocus(sg: SystemGraph, ignore_suppliers):
 
 
 def find_minimal_cutsets(sg: SystemGraph, ignore_suppliers=False) -> FrozenSet[FrozenSet[str]]:
-    return mocus(sg, ignore_suppliers)
+    return bdd_minimal_cutsets(sg, ignore_suppliers)
+
+
+def bdd_minimal_cutsets(sg: SystemGraph, ignore_suppliers=False) -> FrozenSet[FrozenSet[str]]:
+    """ Minimal cutsets computed on the system graph's BDD (see minimal_solutions_bdd).
+    Ignoring suppliers restricts every supplier variable to False. The trivial cutset of the indicator is removed.
+    The number of minimal cutsets can grow exponentially with the graph (e.g. in deep and/or trees); it can be
+    checked beforehand with count_minimal_cutsets. """
+    masks, variables = _minimal_solutions_of_sg(sg, ignore_suppliers, lambda bdd, minsol, variables: (
+        minimal_solution_masks(bdd, minsol, variables), variables))
+    cutsets = set(masks_to_cutsets(masks, variables))
+    cutsets.discard(frozenset(["indicator"]))
+    return frozenset(cutsets)
+
+
+def count_minimal_cutsets(sg: SystemGraph, ignore_suppliers=False) -> int:
+    """ Number of minimal cutsets, as returned by bdd_minimal_cutsets, counted without enumerating them. """
+    return _minimal_solutions_of_sg(sg, ignore_suppliers, _count_solutions)
+
+
+def _count_solutions(bdd, minsol, variables):
+    count = int(bdd.count(minsol, nvars=len(variables)))
+    indicator_only = bdd.cube({v: v == "indicator" for v in variables})
+    if "indicator" in variables and (minsol & indicator_only) != bdd.false:
+        count -= 1
+    return count
+
+
+def _minimal_solutions_of_sg(sg: SystemGraph, ignore_suppliers, result):
+    """ result(bdd, minsol, variables) for the minimal solutions of sg's BDD (see minimal_solutions_bdd), computed
+    holding the lock of its shared manager. result must not return BDD nodes. """
+    with sg.locked_bdd() as (bdd, root):
+        return _minimal_solutions_result(bdd, root, sg.suppliers, ignore_suppliers, result)
+
+
+def _minimal_solutions_result(bdd, root, suppliers, ignore_suppliers, result):
+    # A function of its own, so that the nodes made here are dropped before the manager's lock is released.
+    suppliers = {s: False for s in suppliers if s in bdd.vars}
+    if ignore_suppliers and suppliers:
+        root = bdd.let(suppliers, root)
+    minsol, variables = minimal_solutions_bdd(bdd, root)
+    return result(bdd, minsol, variables)
+
+
+def minimal_solutions_bdd(bdd, f):
+    """ Rauzy's construction of the minimal solutions (minimal cutsets) of the monotone function f.
+    Returns (minsol, variables): minsol is a BDD, over the variables of f, that is true exactly for the assignments
+    whose true variables form a minimal solution of f. For f = x.f1 + -x.f0 (f0 <= f1 as f is monotone):
+        minsol(f) = ite(x, minsol(f1) & -f0, minsol(f0))
+    where "& -f0" removes the solutions of f1 that are supersets of a solution of f0 (Rauzy's "without"), since a set
+    contains a solution of the monotone f0 exactly when it satisfies f0. Variables skipped between a node and its
+    children (and above the root) are forced to False.
+    Dynamic reordering is disabled while building, as the construction relies on the levels of the variables. """
+    previous = bdd.configure(reordering=False)
+    try:
+        variables = sorted(bdd.support(f), key=bdd.level_of_var)
+        position = {x: i for i, x in enumerate(variables)}
+        end = len(variables)
+
+        def pos(u):
+            return end if u.var is None else position[u.var]
+
+        gaps = {}
+
+        def gap(i, j):
+            """ All variables at positions i <= l < j are False. """
+            if (i, j) not in gaps:
+                gaps[i, j] = bdd.cube({variables[l]: False for l in range(i, j)}) if i < j else bdd.true
+            return gaps[i, j]
+
+        memo = {int(bdd.true): bdd.true, int(bdd.false): bdd.false}
+        stack = [f]
+        while stack:
+            u = stack[-1]
+            if int(u) in memo:
+                stack.pop()
+                continue
+            # Cofactors of the edge u (with its complement applied) on its top variable.
+            x = u.var
+            high, low = bdd.let({x: True}, u), bdd.let({x: False}, u)
+            pending = [c for c in (high, low) if int(c) not in memo]
+            if pending:
+                stack.extend(pending)
+                continue
+            stack.pop()
+            i = position[x]
+            memo[int(u)] = bdd.ite(
+                bdd.var(x),
+                gap(i + 1, pos(high)) & memo[int(high)] & ~low,
+                gap(i + 1, pos(low)) & memo[int(low)]
+            )
+
+        minsol = gap(0, pos(f)) & memo[int(f)]
+    finally:
+        bdd.configure(reordering=previous["reordering"])
+    return minsol, variables
+
+
+def minimal_solution_masks(bdd, minsol, variables) -> List[int]:
+    """ Enumerates the solutions of a minsol BDD (see minimal_solutions_bdd) as integer bitmasks, with bit i set for
+    variables[i]. Each path to true is one solution: its high edges are the variables in the solution. """
+    bits = {x: 1 << i for i, x in enumerate(variables)}
+    masks = []
+    stack = [(minsol, 0)]
+    while stack:
+        u, mask = stack.pop()
+        if u == bdd.false:
+            continue
+        if u == bdd.true:
+            masks.append(mask)
+            continue
+        x = u.var
+        stack.append((bdd.let({x: False}, u), mask))
+        stack.append((bdd.let({x: True}, u), mask | bits[x]))
+    return masks
+
+
+def top_k_minimal_cutsets(sg: SystemGraph, p, k, max_order=None,
+                          ignore_suppliers=False) -> List[Tuple[FrozenSet[str], float]]:
+    """ The k most probable minimal cutsets (optionally only those with at most max_order nodes), with their
+    probabilities, most probable first. The probability of a cutset is the product of p over its nodes.
+    Best-first search over the minsol BDD: a partial path is ranked by its probability times the best probability
+    of any completion below it, so cutsets are found in order and the search stops after k of them. Paths that
+    cannot be completed within max_order are pruned. """
+    table, root, true, variables = _minimal_solutions_of_sg(sg, ignore_suppliers, _solution_table)
+    min_order = _min_order(table, true)
+    best = _best_probability(table, true, p)
+    max_order = len(variables) if max_order is None else max_order
+    indicator = 1 << variables.index("indicator") if "indicator" in variables else 0
+    bits = {x: 1 << i for i, x in enumerate(variables)}
+
+    results = []
+    tie = 0
+    heap = [(-best[root], tie, root, 0, 0, 1.0)]
+    while heap and len(results) < k:
+        _, _, edge, mask, order, prob = heapq.heappop(heap)
+        if edge == (true, False):
+            if mask != indicator:
+                results.append((mask, prob))
+            continue
+        x, high, low = _children(table, edge)
+        for child, child_mask, child_order, child_prob in ((high, mask | bits[x], order + 1, prob * p[x]),
+                                                           (low, mask, order, prob)):
+            if child_order + min_order[child] <= max_order:
+                tie += 1
+                heapq.heappush(heap, (-child_prob * best[child], tie, child, child_mask, child_order, child_prob))
+
+    cutsets = masks_to_cutsets([m for m, _ in results], variables)
+    return [(c, prob) for c, (_, prob) in zip(cutsets, results)]
+
+
+def minimal_cutsets_up_to_order(sg: SystemGraph, max_order, ignore_suppliers=False,
+                                limit=None) -> FrozenSet[FrozenSet[str]]:
+    """ All minimal cutsets with at most max_order nodes. Paths of the minsol BDD that cannot be completed within
+    max_order are pruned, so larger cutsets are never enumerated. Raises ValueError once more than limit cutsets
+    are found, if a limit is given, as even small orders can have very many of them. """
+    table, root, true, variables = _minimal_solutions_of_sg(sg, ignore_suppliers, _solution_table)
+    min_order = _min_order(table, true)
+    bits = {x: 1 << i for i, x in enumerate(variables)}
+    indicator = bits.get("indicator", 0)
+
+    masks = []
+    stack = [(root, 0, 0)]
+    while stack:
+        edge, mask, order = stack.pop()
+        if order + min_order[edge] > max_order:
+            continue
+        if edge == (true, False):
+            if mask != indicator:
+                masks.append(mask)
+            if limit is not None and len(masks) > limit:
+                raise ValueError("More than {} minimal cutsets of order at most {}.".format(limit, max_order))
+            continue
+        x, high, low = _children(table, edge)
+        stack.append((low, mask, order))
+        stack.append((high, mask | bits[x], order + 1))
+
+    cutsets = set(masks_to_cutsets(masks, variables))
+    cutsets.discard(frozenset(["indicator"]))
+    return frozenset(cutsets)
+
+
+def _solution_table(bdd, minsol, variables):
+    """ Node table of a minsol BDD as {key: (var, high_key, high_negated, low_key, low_negated)}, its root edge as
+    (key, negated), the key of the true terminal and the variables. """
+    table = {k: (x, g, g_neg, h, h_neg) for k, x, g, g_neg, h, h_neg in bdd_node_table(minsol)}
+    root = (int(~minsol) if minsol.negated else int(minsol), minsol.negated)
+    return table, root, int(bdd.true), variables
+
+
+def _children(table, edge):
+    k, negated = edge
+    x, g, g_neg, h, h_neg = table[k]
+    return x, (g, negated ^ g_neg), (h, negated ^ h_neg)
+
+
+def _min_order(table, true):
+    """ Fewest high edges (nodes in the cutset) on any path from each edge to true; infinite if there is none. """
+    result = {(true, False): 0, (true, True): math.inf}
+    for k in reversed(list(table)):
+        for negated in (False, True):
+            _, high, low = _children(table, (k, negated))
+            result[k, negated] = min(result[high] + 1, result[low])
+    return result
+
+
+def _best_probability(table, true, p):
+    """ Highest product of p over the high edges of any path from each edge to true; 0 if there is none. """
+    result = {(true, False): 1.0, (true, True): 0.0}
+    for k in reversed(list(table)):
+        for negated in (False, True):
+            x, high, low = _children(table, (k, negated))
+            result[k, negated] = max(p[x] * result[high], result[low])
+    return result
+
+
+def masks_to_cutsets(masks, variables) -> List[FrozenSet[str]]:
+    """ Converts bitmasks (bit i set for variables[i]) to sets of variable names. """
+    cutsets = []
+    for m in masks:
+        cutset = []
+        while m:
+            low_bit = m & -m
+            cutset.append(variables[low_bit.bit_length() - 1])
+            m ^= low_bit
+        cutsets.append(frozenset(cutset))
+    return cutsets
 
 
 def mocus(sg: SystemGraph, ignore_suppliers=False) -> FrozenSet[FrozenSet[str]]:
@@ -143,39 +372,152 @@ def probability_union(x):
 
 
 def probability_any_cutset(cutsets, x):
-    probability_each_cutset = map(lambda ct: math.prod([x[i] for i in ct]), cutsets)
-    return probability_union(probability_each_cutset)
+    """ Probability that any cutset fails, treating cutsets as independent. All cutset probabilities are computed in
+    one NumPy reduction over the cutset bitmasks. """
+    variables = sorted(set().union(*cutsets))
+    masks = cutsets_to_masks(cutsets, variables)
+    probability_each_cutset = mask_probabilities(masks, np.array([x[v] for v in variables], dtype=float))
+    return float(1 - np.prod(1 - probability_each_cutset))
+
+
+RARE_EVENT = "RARE_EVENT"
+MIN_CUT_UPPER_BOUND = "MIN_CUT_UPPER_BOUND"
+INCLUSION_EXCLUSION = "INCLUSION_EXCLUSION"
+CUTSET_RISK_MODES = (RARE_EVENT, MIN_CUT_UPPER_BOUND, INCLUSION_EXCLUSION)
+DEFAULT_MAX_TERMS = 10**5
+
+
+class CutsetRisk(NamedTuple):
+    """ Risk estimate with the lower and upper bounds achieved, and the number of inclusion-exclusion orders used. """
+    risk: float
+    lower: float
+    upper: float
+    order: int
+
+
+def cutset_risk(cutsets, x, mode=INCLUSION_EXCLUSION, tolerance=1e-6, max_terms=DEFAULT_MAX_TERMS) -> CutsetRisk:
+    """ Probability that any cutset fails (the union of the cutset events), with nodes failing independently.
+    Bounds always hold: the largest single cutset probability is a lower bound, and the min-cut upper bound holds
+    for coherent systems. Modes:
+        - RARE_EVENT: the sum of cutset probabilities (also an upper bound)
+        - MIN_CUT_UPPER_BOUND: 1 - prod(1 - P(cutset)), as probability_any_cutset
+        - INCLUSION_EXCLUSION: the inclusion-exclusion series truncated once successive partial sums (Bonferroni
+          bounds, alternately upper and lower) are within tolerance. The risk is the midpoint of the bounds. The
+          series also stops if the next order would need more than max_terms intersections.
+    The bounds apply to the given cutsets; if they are not all minimal cutsets of a system (e.g. only the top k),
+    the system risk is only bounded below. """
+    if mode not in CUTSET_RISK_MODES:
+        raise ValueError("Unknown cutset risk mode: {}".format(mode))
+
+    variables = sorted(set().union(*cutsets))
+    masks = cutsets_to_masks(cutsets, variables)
+    p_vector = np.array([x[v] for v in variables], dtype=float)
+    probs = mask_probabilities(masks, p_vector)
+    if len(probs) == 0:
+        return CutsetRisk(0.0, 0.0, 0.0, 0)
+
+    rare_event = float(probs.sum())
+    lower = float(probs.max())
+    upper = float(1 - np.prod(1 - probs))
+    if mode == RARE_EVENT:
+        return CutsetRisk(rare_event, lower, min(upper, rare_event), 1)
+    if mode == MIN_CUT_UPPER_BOUND:
+        return CutsetRisk(upper, lower, upper, 1)
+
+    # Each term of order k is an intersection of k cutsets, as (index of its last cutset, union of the masks).
+    terms = [(i, m) for i, m in enumerate(masks)]
+    term_probs = probs
+    partial = 0.0
+    order = 0
+    while True:
+        order += 1
+        partial += float(term_probs.sum()) * (1 if order % 2 else -1)
+        if order % 2:
+            upper = min(upper, partial)
+        else:
+            lower = max(lower, partial)
 
+        next_count = sum(len(masks) - 1 - last for last, _ in terms)
+        if next_count == 0:
+            # The series is complete, so the sum is exact.
+            lower = upper = min(max(partial, 0.0), 1.0)
+            break
+        if upper - lower <= tolerance or next_count > max_terms:
+            break
+
+        terms = [(j, m | masks[j]) for last, m in terms for j in range(last + 1, len(masks))]
+        term_probs = mask_probabilities([m for _, m in terms], p_vector)
+
+    return CutsetRisk((lower + upper) / 2, lower, upper, order)
 
-def minimize_cutsets(cutsets: List[FrozenSet]):
-    """ Inefficient method used for testing. Assumes all in cutsets are valid but some are not minimal."""
 
-    cutsets.sort(key=lambda c: len(c))
-    results = set()
+def cutsets_to_masks(cutsets, variables) -> List[int]:
+    """ Converts sets of variable names to bitmasks, with bit i set for variables[i]. """
+    bits = {v: 1 << i for i, v in enumerate(variables)}
+    return [sum(bits[v] for v in cutset) for cutset in cutsets]
 
-    for c in cutsets:
+
+def masks_to_matrix(masks, n):
+    """ Unpacks bitmasks over n variables to a boolean matrix with one row per mask. """
+    n_bytes = max(1, (n + 7) // 8)
+    packed = np.frombuffer(b"".join(m.to_bytes(n_bytes, "little") for m in masks), dtype=np.uint8)
+    bits = np.unpackbits(packed.reshape(len(masks), n_bytes), axis=1, bitorder="little")
+    return bits[:, :n].astype(bool)
+
+
+def mask_probabilities(masks, p_vector):
+    """ Product of p_vector over the set bits of each mask. """
+    if len(masks) == 0:
+        return np.zeros(0)
+    members = masks_to_matrix(masks, len(p_vector))
+    return np.where(members, p_vector, 1.0).prod(axis=1)
+
+
+def minimize_masks(masks: List[int]) -> List[int]:
+    """ Removes every mask that is a superset of another mask (and duplicates).
+    Masks are visited by increasing number of bits, so a kept mask is never a superset of a later one. A kept mask
+    is indexed by its lowest bit: a subset of c has its lowest bit in c, so c is only compared against the kept masks
+    indexed by one of its own bits. The empty mask is a subset of every mask. """
+    if 0 in masks:
+        return [0]
+
+    index = {}
+    results = []
+    for c in sorted(set(masks), key=lambda m: bin(m).count("1")):
         minimal = True
-        for x in results:
-            if x.issubset(c):
-                minimal = False
-                break
+        rest = c
+        while rest and minimal:
+            low_bit = rest & -rest
+            rest ^= low_bit
+            for x in index.get(low_bit, ()):
+                if x & c == x:
+                    minimal = False
+                    break
         if minimal:
-            results.add(c)
-
+            results.append(c)
+            index.setdefault(c & -c, []).append(c)
     return results
 
 
+def minimize_cutsets(cutsets: List[FrozenSet]):
+    """ Assumes all in cutsets are valid but some are not minimal. """
+    variables = sorted(set().union(*cutsets))
+    masks = minimize_masks(cutsets_to_masks(cutsets, variables))
+    return set(masks_to_cutsets(masks, variables))
+
+
 def brute_force_bdd_cutsets(sg: SystemGraph):
     """ Using a BDD all solutions are returned. Then they are minimized.
     This is very inefficient even on small graphs and used only for testing other algorithms.
     """
     bdd, root = build_bdd(sg)
-    cutsets = list()
+    variables = sorted(bdd.vars)
+    bits = {v: 1 << i for i, v in enumerate(variables)}
+    masks = list()
 
     for s in bdd.pick_iter(root):
-        cutsets.append(frozenset(filter(lambda u: s[u] is True, s.keys())))
+        masks.append(sum(bits[u] for u, value in s.items() if value is True))
 
-    min_cutsets = minimize_cutsets(cutsets)
+    min_cutsets = set(masks_to_cutsets(minimize_masks(masks), variables))
     min_cutsets.remove(frozenset(["indicator"]))
     return frozenset(min_cutsets)
-
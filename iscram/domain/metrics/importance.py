@@ -1,11 +1,13 @@
 from collections import Counter
-from typing import Dict
+from typing import Dict, Tuple
 
 from iscram.domain.model import (
     SystemGraph, DataValidationError
 )
 from iscram.domain.metrics.risk import risk_by_bdd
-from iscram.domain.metrics.probability_providers import provide_p_unknown_data
+from iscram.domain.metrics.bdd_functions import build_bdd, bdd_birnbaum_importance, edge_variable
+from iscram.domain.metrics.compiled_bdd import compiled_birnbaum_importance
+from iscram.domain.metrics.probability_providers import provide_p_unknown_data, provide_p_with_edge_existence
 
 
 def birnbaum_structural_importance(sg: SystemGraph, bdd_with_root=None, select=None):
@@ -27,19 +29,43 @@ def birnbaum_importance(sg: SystemGraph, p, bdd_with_root=None, select=None):
         b_imps["select"] = risk_top-risk_bottom
         return b_imps
 
+    if bdd_with_root is None:
+        bdd, root = build_bdd(sg)
+    else:
+        bdd, root = bdd_with_root
+
+    # All nodes at once from one forward and one backward pass; nodes absent from the BDD have no importance.
+    all_imps = bdd_birnbaum_importance(bdd, root, p)
     for i in sg.nodes:
-        saved = p[i]
-        p[i] = 1.0
-        risk_top = risk_by_bdd(sg, p, bdd_with_root)
-        p[i] = 0.0
-        risk_bottom = risk_by_bdd(sg, p, bdd_with_root)
-        b_imps[i] = risk_top - risk_bottom
-        p[i] = saved  # restore to initial state
+        b_imps[i] = all_imps.get(i, 0.0)
+
+    del b_imps["indicator"]
+    return b_imps
+
+
+def birnbaum_importance_compiled(sg: SystemGraph, p, compiled=None):
+    """ As birnbaum_importance for all nodes, computed on the compiled (array) form of the BDD. """
+    if compiled is None:
+        compiled = sg.get_compiled_bdd()
+
+    all_imps = compiled_birnbaum_importance(compiled, p)
+    b_imps = {i: all_imps.get(i, 0.0) for i in sg.nodes}
 
     del b_imps["indicator"]
     return b_imps
 
 
+def edge_existence_importance(sg: SystemGraph, p, existence, bdd_with_root=None) -> Dict[Tuple[str, str], float]:
+    """ Birnbaum importance of the existence of each uncertain edge: risk if the edge exists minus risk if not. """
+    if bdd_with_root is None:
+        bdd, root = build_bdd(sg, uncertain_edges=existence.keys())
+    else:
+        bdd, root = bdd_with_root
+
+    all_imps = bdd_birnbaum_importance(bdd, root, provide_p_with_edge_existence(p, existence))
+    return {edge: all_imps.get(edge_variable(*edge), 0.0) for edge in existence}
+
+
 def fractional_importance_of_attributes(sg: SystemGraph, data, error_on_missing_data=False) -> Dict[str, Dict[bool, float]]:
     all_attributes = []
 
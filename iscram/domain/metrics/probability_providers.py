@@ -1,4 +1,9 @@
+from typing import Dict, List, Tuple
+
+import numpy as np
+
 from iscram.domain.model import SystemGraph, DataValidationError
+from iscram.domain.metrics.bdd_functions import edge_variable
 
 
 def provide_p_unknown_data(sg: SystemGraph):
@@ -35,6 +40,100 @@ def provide_p_direct_from_data(sg: SystemGraph, data, error_on_missing_node=Fals
     return base
 
 
+def provide_p_matrix_from_data(sg: SystemGraph, data_list: List[Dict], variables: List[str], error_on_missing_node=False):
+    """ Stacks provide_p_direct_from_data for each data set: one row per data set, columns aligned to variables. """
+    p_matrix = np.zeros((len(data_list), len(variables)))
+    for s, data in enumerate(data_list):
+        p = provide_p_direct_from_data(sg, data, error_on_missing_node)
+        p_matrix[s] = [p[v] for v in variables]
+    return p_matrix
+
+
+def provide_risk_distributions_from_data(sg: SystemGraph, data) -> Dict[str, Dict]:
+    """ Risk distributions by node, following the same precedence as provide_p_direct_from_data: node data first,
+    overwritten by the data of the edge from the node's supplier (a point risk on that edge removes the node's
+    distribution). """
+    distributions = {}
+    for node, value in data.get("nodes", {}).items():
+        if node in sg.nodes and "risk_distribution" in value:
+            distributions[node] = value["risk_distribution"]
+
+    node_suppliers = {}
+    for edge in sg.edges:
+        if "potential" in edge.tags:
+            continue
+        if edge.src in sg.suppliers and edge.dst in sg.components:
+            node_suppliers[edge.dst] = edge.src
+
+    for edge in data.get("edges", []):
+        if edge["src"] == node_suppliers.get(edge["dst"]):
+            if "risk_distribution" in edge:
+                distributions[edge["dst"]] = edge["risk_distribution"]
+            elif "risk" in edge:
+                distributions.pop(edge["dst"], None)
+
+    return distributions
+
+
+def sample_risk_distribution(distribution: Dict, n, rng) -> np.ndarray:
+    kind = distribution["type"]
+    if kind == "beta":
+        return rng.beta(distribution["alpha"], distribution["beta"], n)
+    if kind == "uniform":
+        return rng.uniform(distribution["low"], distribution["high"], n)
+    if kind == "triangular":
+        if distribution["low"] == distribution["high"]:
+            return np.full(n, float(distribution["low"]))
+        return rng.triangular(distribution["low"], distribution["mode"], distribution["high"], n)
+    raise DataValidationError("Unknown risk distribution: {}".format(distribution))
+
+
+def risk_distribution_bounds(distribution: Dict):
+    """ Smallest and largest possible values of a risk distribution. """
+    if distribution["type"] == "beta":
+        return 0.0, 1.0
+    return float(distribution["low"]), float(distribution["high"])
+
+
+def provide_p_samples_from_data(sg: SystemGraph, data, variables: List[str], n_samples, rng):
+    """ n_samples probability vectors (rows, columns aligned to variables): point risks as in
+    provide_p_direct_from_data, and risks with a distribution sampled from it. """
+    p = provide_p_direct_from_data(sg, data)
+    p_matrix = np.tile(np.array([p[v] for v in variables], dtype=float), (n_samples, 1))
+    columns = {v: j for j, v in enumerate(variables)}
+    for node, distribution in provide_risk_distributions_from_data(sg, data).items():
+        if node in columns:
+            p_matrix[:, columns[node]] = sample_risk_distribution(distribution, n_samples, rng)
+    return p_matrix
+
+
+def provide_p_bounds_from_data(sg: SystemGraph, data):
+    """ Lowest and highest probabilities of each node given the risk distributions in data (point risks otherwise). """
+    low = provide_p_direct_from_data(sg, data)
+    high = dict(low)
+    for node, distribution in provide_risk_distributions_from_data(sg, data).items():
+        low[node], high[node] = risk_distribution_bounds(distribution)
+    return low, high
+
+
+def provide_edge_existence_from_data(sg: SystemGraph, data) -> Dict[Tuple[str, str], float]:
+    """ Existence probability of each edge of sg (not potential) given one in the edge data. """
+    edges = {(e.src, e.dst) for e in sg.edges if "potential" not in e.tags}
+    existence = {}
+    for edge in data.get("edges", []):
+        if "existence" in edge and (edge["src"], edge["dst"]) in edges:
+            existence[(edge["src"], edge["dst"])] = edge["existence"]
+    return existence
+
+
+def provide_p_with_edge_existence(p: Dict[str, float], existence: Dict[Tuple[str, str], float]) -> Dict[str, float]:
+    """ Adds the probabilities of the edge existence variables (see edge_variable) to p. """
+    p = dict(p)
+    for (src, dst), q in existence.items():
+        p[edge_variable(src, dst)] = q
+    return p
+
+
 def provide_p_attribute_heuristic(sg: SystemGraph, data):
     base = {n: 0.0 for n in sg.nodes}
 
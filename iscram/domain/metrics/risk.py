@@ -1,26 +1,74 @@
 from iscram.domain.model import SystemGraph
 
 from iscram.domain.metrics.cutset import (
-    find_minimal_cutsets, probability_any_cutset
+    find_minimal_cutsets, probability_any_cutset, cutset_risk, CutsetRisk, INCLUSION_EXCLUSION, DEFAULT_MAX_TERMS
 )
 
 from iscram.domain.metrics.bdd_functions import (
-    bdd_prob, build_bdd
+    bdd_prob_iterative, bdd_prob_batch, build_bdd
 )
+from iscram.domain.metrics.compiled_bdd import compiled_prob, compiled_prob_batch
+from iscram.domain.metrics.probability_providers import provide_p_with_edge_existence
 
 
-def risk_by_bdd(sg: SystemGraph, p, bdd_with_root=None):
+def risk_by_bdd(sg: SystemGraph, p, bdd_with_root=None, evaluator=bdd_prob_iterative):
+    """ The evaluator may be any function with the signature of bdd_prob, e.g. the recursive bdd_prob itself. """
     if bdd_with_root is None:
         bdd, root = build_bdd(sg)
     else:
         bdd, root = bdd_with_root
 
-    r = bdd_prob(bdd, root, p, dict())
+    r = evaluator(bdd, root, p, dict())
     return r
 
 
+def risk_by_bdd_batch(sg: SystemGraph, p_matrix, variables, bdd_with_root=None):
+    """ Risk for each row (scenario) of p_matrix, whose columns are aligned to variables. """
+    if bdd_with_root is None:
+        bdd, root = build_bdd(sg)
+    else:
+        bdd, root = bdd_with_root
+
+    return bdd_prob_batch(bdd, root, p_matrix, variables)
+
+
+def risk_by_compiled_bdd(sg: SystemGraph, p, compiled=None):
+    if compiled is None:
+        compiled = sg.get_compiled_bdd()
+
+    return compiled_prob(compiled, p)
+
+
+def risk_by_compiled_bdd_batch(sg: SystemGraph, p_matrix, variables, compiled=None):
+    """ Risk for each row (scenario) of p_matrix, whose columns are aligned to variables. """
+    if compiled is None:
+        compiled = sg.get_compiled_bdd()
+
+    return compiled_prob_batch(compiled, p_matrix, variables)
+
+
+def risk_by_bdd_with_uncertain_edges(sg: SystemGraph, p, existence, bdd_with_root=None):
+    """ Expected risk over all structures of sg, when each edge (src, dst) in existence exists independently with
+    the given probability. Edge existence is encoded in the BDD (see build_bdd), so structures are not enumerated. """
+    if bdd_with_root is None:
+        bdd, root = build_bdd(sg, uncertain_edges=existence.keys())
+    else:
+        bdd, root = bdd_with_root
+
+    return bdd_prob_iterative(bdd, root, provide_p_with_edge_existence(p, existence))
+
+
 def risk_by_cutsets(sg: SystemGraph, p, cutsets=None, ignore_suppliers=True):
     if cutsets is None:
         cutsets = find_minimal_cutsets(sg, ignore_suppliers)
 
     return probability_any_cutset(cutsets, p)
+
+
+def risk_bounds_by_cutsets(sg: SystemGraph, p, cutsets=None, ignore_suppliers=True, mode=INCLUSION_EXCLUSION,
+                           tolerance=1e-6, max_terms=DEFAULT_MAX_TERMS) -> CutsetRisk:
+    """ Risk with achieved bounds from the cutsets, using one of the modes of cutset_risk. """
+    if cutsets is None:
+        cutsets = find_minimal_cutsets(sg, ignore_suppliers)
+
+    return cutset_risk(cutsets, p, mode, tolerance, max_terms)
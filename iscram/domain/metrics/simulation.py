@@ -1,136 +1,284 @@
-## Placeholder code, copied from old version
-
-# import numpy as np
-# from multiprocessing import Pool
-#
-# def simulate(choice_problem, system_model, report, threads, trials):
-#     pool = Pool(threads)
-#
-#     params = setup_simulation(choice_problem, system_model, report)
-#     sims = [Simulator(trials // threads, params) for _ in range(threads)]
-#     sim_workers = [pool.apply_async(sims[i].run) for i in range(threads)]
-#     sim_result_list = [worker.get() for worker in sim_workers]
-#
-#     return sim_result_list
-#
-# def setup_simulation(choice_problem, system_model, report):
-#     sim_params = {}
-#     c_risks = np.sum(np.multiply(report["x"], choice_problem.risks), axis=1)
-#     sim_params["N"] = choice_problem.N
-#     sim_params["K"] = choice_problem.K
-#
-#     sim_params["c_p_true"] = np.array([1 - v for v in c_risks])
-#     sim_params["s_idx_by_c"] = [np.nonzero(report["x"][i])[0][0] for i in range(choice_problem.N)]
-#     sim_params["s_p_true"] = choice_problem.s_trusts
-#     sim_params["o_p_true"] = choice_problem.o_trusts
-#     sim_params["s_groups"] = choice_problem.s_groups
-#     sim_params["cutset_masks"] = system_model.cutset_masks
-#
-#     return sim_params
-#
-#
-# class Simulator:
-#     def __init__(self, trials, params):
-#         self.trials = trials
-#         self.params = params
-#         self.s_groups = params["s_groups"]
-#         self.s_idx_by_c = params["s_idx_by_c"]
-#         self.cutset_masks = params["cutset_masks"]
-#
-#     def sim_o_to_s(self, o, s, s_groups):
-#         for k in range(len(s_groups)):
-#             for j in s_groups[k]:
-#                 s[j] = s[j] & o[k]
-#         return s
-#
-#     def sim_s_to_c(self, s, c, s_idx_by_c):
-#         for i in range(len(c)):
-#             s_idx = s_idx_by_c[i]
-#             c[i] = c[i] & s[s_idx]
-#         return c
-#
-#     def sim_c_to_sys(self, c, cutset_masks):
-#         for m in cutset_masks:
-#             if np.sum(np.logical_and(c, m) != c) == 0:
-#                 return False
-#         return True
-#
-#     def filter_chosen_owner_state(self, o, s_groups, s_idx_by_c):
-#         chosen_o_state = []
-#         for k in range(len(s_groups)):
-#             chosen = False
-#             for j in s_groups[k]:
-#                 if j in s_idx_by_c:
-#                     chosen = True
-#             if chosen:
-#                 chosen_o_state.append(o[k])
-#         return chosen_o_state
-#
-#     def count_chosen_owner_state(self, o, s_groups, s_idx_by_c):
-#             chosen_o_state = []
-#             for k in range(len(s_groups)):
-#                 for j in s_groups[k]:
-#                     if j in s_idx_by_c:
-#                         chosen_o_state.append(o[k])
-#             return chosen_o_state
-#
-#     def run(self):
-#         np.random.seed(None)
-#         system_states_any_cause = []
-#         system_states_owner_only = []
-#
-#         # ab = []
-#         # b = []
-#
-#         for trial in range(self.trials):
-#             c_state = np.random.binomial(1, self.params["c_p_true"])
-#             s_state = np.random.binomial(1, self.params["s_p_true"])
-#             o_state = np.random.binomial(1, self.params["o_p_true"])
-#
-#             s_state = self.sim_o_to_s(o_state, s_state, self.params["s_groups"])
-#             c_state = self.sim_s_to_c(s_state, c_state, self.params["s_idx_by_c"])
-#             sys_state = self.sim_c_to_sys(c_state, self.params["cutset_masks"])
-#             system_states_any_cause.append(sys_state)
-#
-#             # repeat test but with perfect s and c states
-#             p_s_state = np.ones(len(s_state), dtype=int)
-#             p_c_state = np.ones(len(c_state), dtype=int)
-#
-#             p_s_state = self.sim_o_to_s(o_state, p_s_state, self.params["s_groups"])
-#             p_c_state = self.sim_s_to_c(p_s_state, p_c_state, self.params["s_idx_by_c"])
-#             p_sys_state = self.sim_c_to_sys(p_c_state, self.params["cutset_masks"])
-#
-#             system_states_owner_only.append(p_sys_state)
-#
-#             # chosen_owner_state = self.filter_chosen_owner_state(o_state, self.params["s_groups"], self.params["s_idx_by_c"])
-#             # ab.append(sys_state and not np.all(chosen_owner_state))
-#             # b.append(not np.all(chosen_owner_state))
-#
-#
-#
-#         avg_system_risk = 1 - (np.average(system_states_any_cause))
-#         avg_o_failures = 1 - np.average(system_states_owner_only)
-#         #print(avg_o_failures)
-#         #total_o_failures = sum(o_failures)
-#
-#
-#         # tmp = 1-(np.average(ab) / np.average(b))
-#
-#         # if avg_o_failures == 0 or avg_system_risk == 0:
-#         #     sys_o_ratio = 0
-#         # else:
-#         #     sys_o_ratio =  avg_o_failures / avg_system_risk
-#
-#         return avg_system_risk, avg_o_failures
-#
-#
-# if __name__ == "__main__":
-#     params = {
-#         "s_groups" : [[3,4], [1, 2], [0], []], "s_idx_by_c": [0,1,2,3,4], "cutset_masks" : [[0,1,1,1,1]],
-#         "c_p_true" : [1,1,1,1,1],
-#         "s_p_true" : [1,1,1,1,1],
-#         "o_p_true" : [1, 1, .5, 1, 1, 1,]
-#     }
-#     sim = Simulator(10, params)
-#     #print(sim.filter_chosen_owner_state([0,1,0,1,1], [[3,4], [1,2], [0]], [0,3,2]))
-#     print(sim.run())
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from statistics import NormalDist
+from typing import NamedTuple
+import math
+
+import numpy as np
+
+from iscram.domain.metrics.bdd_functions import build_sg_graph_dict, dfs_orders
+
+
+DEFAULT_TRIALS = 10**6
+# Trials are simulated in blocks of bit-packed words; a task (one seed) covers a fixed number of trials, so results
+# for a given seed do not depend on the number of processes.
+BLOCK_TRIALS = 2**16
+TASK_TRIALS = 2**20
+# Below this probability, failures are placed by sampling the gaps between them rather than testing every trial.
+SPARSE_P = 0.05
+
+
+class SimulationModel:
+    """ The structure of a system graph prepared for simulation, with nodes by integer index.
+    Nodes are listed children first (post-order from the indicator, which is last). A node fails if it fails itself,
+    or if its component dependencies fail (by its component logic), or if its supplier dependencies fail (by its
+    supplier logic, "and" by default), as in the BDD. Each gate is (node, components, components_and, suppliers,
+    suppliers_and). """
+
+    def __init__(self, sg):
+        g = build_sg_graph_dict(sg)
+        _, post_order = dfs_orders(g, "indicator")
+        self.names = post_order
+        index = {u: i for i, u in enumerate(post_order)}
+        self.gates = []
+        for u in post_order:
+            logic = sg.nodes[u].logic
+            components = tuple(index[c] for c in g[u].get("component", []))
+            suppliers = tuple(index[s] for s in g[u].get("supplier", []))
+            self.gates.append((index[u], components, logic.get("component") == "and",
+                               suppliers, logic.get("supplier", "and") == "and"))
+
+    def p_vector(self, p):
+        return np.array([p[u] for u in self.names], dtype=float)
+
+
+class SimulationResult(NamedTuple):
+    """ Estimated risk with a (Wilson score) confidence interval. """
+    risk: float
+    lower: float
+    upper: float
+    trials: int
+    failures: int
+    confidence: float
+
+
+def _combine(states, children, is_and):
+    result = states[children[0]].copy()
+    for c in children[1:]:
+        if is_and:
+            result &= states[c]
+        else:
+            result |= states[c]
+    return result
+
+
+def _sample_words(rng, p, trials):
+    """ Bit-packed failure states of one node: bit t of the words is set if the node fails in trial t. """
+    if p <= 0.0:
+        return np.zeros(trials // 64, dtype=np.uint64)
+    if p >= 1.0:
+        return np.full(trials // 64, np.iinfo(np.uint64).max, dtype=np.uint64)
+    if p < SPARSE_P:
+        failed = np.zeros(trials, dtype=bool)
+        failed[_sparse_failures(rng, p, trials)] = True
+    else:
+        failed = rng.random(trials) < p
+    return np.packbits(failed, bitorder="little").view(np.uint64)
+
+
+def _sparse_failures(rng, p, trials):
+    """ Trials that fail, for independent failures with probability p: the gaps between failures are geometric. """
+    expected = trials * p
+    positions = np.cumsum(rng.geometric(p, int(expected + 6 * math.sqrt(expected) + 16))) - 1
+    while positions[-1] < trials:
+        more = np.cumsum(rng.geometric(p, int(expected / 4) + 16)) + positions[-1]
+        positions = np.concatenate([positions, more])
+    return positions[positions < trials]
+
+
+def _propagate(model: SimulationModel, node_words):
+    """ System failure words, given each node's own failure words (which are updated in place to the node's
+    failure state), with bitwise operations through the gates, children first. """
+    for u, components, components_and, suppliers, suppliers_and in model.gates:
+        if components:
+            node_words[u] |= _combine(node_words, components, components_and)
+        if suppliers:
+            node_words[u] |= _combine(node_words, suppliers, suppliers_and)
+    return node_words[-1]
+
+
+def simulate_block(model: SimulationModel, p_vector, trials, rng):
+    """ Simulates trials at once and returns the number of system failures. Node states are sampled as bit-packed
+    words (trials rounded up to a multiple of 64, the extra trials are not counted) and propagated through the gates
+    with bitwise operations, children first. """
+    n_bits = -(-trials // 64) * 64
+    node_words = [_sample_words(rng, p_vector[u], n_bits) for u in range(len(model.names))]
+    failed = np.unpackbits(_propagate(model, node_words).view(np.uint8), bitorder="little")
+    return int(failed[:trials].sum())
+
+
+def _simulate_task(model: SimulationModel, p_vector, trials, seed):
+    rng = np.random.default_rng(seed)
+    failures = 0
+    while trials > 0:
+        block = min(trials, BLOCK_TRIALS)
+        failures += simulate_block(model, p_vector, block, rng)
+        trials -= block
+    return failures
+
+
+def wilson_interval(failures, trials, confidence):
+    """ Wilson score interval for a binomial proportion. """
+    if trials == 0:
+        return 0.0, 1.0
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    phat = failures / trials
+    denominator = 1 + z**2 / trials
+    center = (phat + z**2 / (2 * trials)) / denominator
+    half_width = z * math.sqrt(phat * (1 - phat) / trials + z**2 / (4 * trials**2)) / denominator
+    return max(0.0, center - half_width), min(1.0, center + half_width)
+
+
+def simulate_risk(sg, p, trials=DEFAULT_TRIALS, seed=None, processes=1, confidence=0.95) -> SimulationResult:
+    """ Monte Carlo estimate of system risk given node probabilities p.
+    Trials are split into tasks of TASK_TRIALS, each with its own seed spawned from seed (numpy SeedSequence), and
+    run on a pool of processes (in this process if processes is 1). The same seed gives the same result for any
+    number of processes. """
+    model = SimulationModel(sg)
+    p_vector = model.p_vector(p)
+
+    n_tasks = max(1, -(-trials // TASK_TRIALS))
+    task_trials = [TASK_TRIALS] * (n_tasks - 1) + [trials - TASK_TRIALS * (n_tasks - 1)]
+    seeds = np.random.SeedSequence(seed).spawn(n_tasks)
+
+    if processes == 1 or n_tasks == 1:
+        counts = [_simulate_task(model, p_vector, t, s) for t, s in zip(task_trials, seeds)]
+    else:
+        # Spawned, not forked: simulations may run on worker threads, and forking a threaded process copies locks
+        # held by the other threads.
+        with ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context("spawn")) as pool:
+            counts = list(pool.map(_simulate_task, [model] * n_tasks, [p_vector] * n_tasks, task_trials, seeds))
+
+    failures = sum(counts)
+    lower, upper = wilson_interval(failures, trials, confidence)
+    return SimulationResult(failures / trials if trials else 0.0, lower, upper, trials, failures, confidence)
+
+
+FAILURE_BIASING = "FAILURE_BIASING"
+CROSS_ENTROPY = "CROSS_ENTROPY"
+IMPORTANCE_SAMPLING_METHODS = (FAILURE_BIASING, CROSS_ENTROPY)
+DEFAULT_FAILURE_BIAS = 0.1
+MAX_BIASED_P = 0.5
+
+
+class ImportanceSamplingResult(NamedTuple):
+    """ Estimated risk with its relative error (standard error / estimate), the effective sample size of the weighted
+    failures, and a normal confidence interval. """
+    risk: float
+    relative_error: float
+    effective_sample_size: float
+    lower: float
+    upper: float
+    trials: int
+    confidence: float
+
+
+class _BiasedSampler:
+    """ Samples node states from the biased probabilities q (optionally conditioned on at least one node failing)
+    and computes each trial's likelihood ratio to the original probabilities p. Nodes with p of 0 or 1 are not
+    biased. Conditioning on A = "at least one failure" samples the first failing node j with probability
+    P(first = j | A), sets the nodes before it to not failed, and samples the nodes after it from q; the system
+    cannot fail outside A, and the ratio includes Q(A). """
+
+    def __init__(self, p_vector, q_vector, condition_on_failure):
+        self.p = p_vector
+        self.q = np.where((p_vector > 0) & (p_vector < 1), q_vector, p_vector)
+        self.condition_on_failure = condition_on_failure
+        varied = self.p != self.q
+        self.varied = np.nonzero(varied)[0]
+        p, q = self.p[varied], self.q[varied]
+        self.log_fail = np.log(p / q) - np.log((1 - p) / (1 - q))
+        self.log_base = float(np.sum(np.log((1 - p) / (1 - q))))
+        survive = np.concatenate([[1.0], np.cumprod(1 - self.q[:-1])])
+        first = self.q * survive
+        self.log_q_any = math.log(first.sum()) if first.sum() > 0 else -math.inf
+        self.first = first / first.sum() if first.sum() > 0 else None
+
+    def sample(self, rng, trials):
+        """ Returns (failure matrix of trials x nodes, log likelihood ratios). """
+        failed = rng.random((trials, len(self.q))) < self.q
+        log_ratio = failed[:, self.varied] @ self.log_fail + self.log_base
+        if self.condition_on_failure and self.first is not None:
+            first = rng.choice(len(self.q), size=trials, p=self.first)
+            failed &= np.arange(len(self.q)) >= first[:, np.newaxis]
+            failed[np.arange(trials), first] = True
+            log_ratio = failed[:, self.varied] @ self.log_fail + self.log_base + self.log_q_any
+        return failed, log_ratio
+
+
+def _system_failed(model: SimulationModel, failed):
+    """ System failure of each trial (row) of a node failure matrix, with trials a multiple of 64. """
+    packed = np.packbits(failed, axis=0, bitorder="little")
+    node_words = [np.ascontiguousarray(packed[:, u]).view(np.uint64) for u in range(failed.shape[1])]
+    system = _propagate(model, node_words)
+    return np.unpackbits(system.view(np.uint8), bitorder="little").astype(bool)
+
+
+def cross_entropy_probabilities(model: SimulationModel, p_vector, rng, trials=2**14, rounds=5, smoothing=0.7):
+    """ Tunes the biased probabilities by the cross-entropy method: starting from p, each round sets q to the
+    weighted frequency of failure of each node among the failed trials, which approaches the distribution
+    conditioned on system failure. Rounds without any failure double q instead. As the system is coherent, q is
+    kept at least p. """
+    q = p_vector.copy()
+    for _ in range(rounds):
+        failed, log_ratio = _BiasedSampler(p_vector, q, False).sample(rng, trials)
+        system = _system_failed(model, failed)
+        if not system.any():
+            q = np.minimum(2 * q, MAX_BIASED_P)
+            continue
+        w = np.exp(log_ratio[system] - log_ratio[system].max())
+        q_new = (w @ failed[system]) / w.sum()
+        q = np.clip(smoothing * q_new + (1 - smoothing) * q, p_vector, MAX_BIASED_P)
+    return q
+
+
+def importance_sampling_risk(sg, p, method=CROSS_ENTROPY, condition_on_failure=True, relative_error=0.01,
+                             min_trials=2**16, max_trials=DEFAULT_TRIALS, batch_trials=2**14, seed=None, confidence=0.95,
+                             bias=DEFAULT_FAILURE_BIAS) -> ImportanceSamplingResult:
+    """ Importance-sampling estimate of system risk given node probabilities p, for rare system failures.
+    Node failures are sampled from biased probabilities, either FAILURE_BIASING (each node fails with probability at
+    least bias, best for small systems) or CROSS_ENTROPY (tuned by cross_entropy_probabilities), optionally conditioned on at least one
+    failure, and failed trials are weighted by their likelihood ratio. Batches of trials are added until the
+    relative error is at most relative_error (after at least min_trials) or max_trials is reached. The relative error
+    is estimated from the weights observed, so it can be optimistic if the biased distribution rarely reaches a
+    failure mode with a large weight. """
+    if method not in IMPORTANCE_SAMPLING_METHODS:
+        raise ValueError("Unknown importance sampling method: {}".format(method))
+
+    model = SimulationModel(sg)
+    p_vector = model.p_vector(p)
+    rng = np.random.default_rng(seed)
+    batch_trials = -(-batch_trials // 64) * 64
+
+    if method == CROSS_ENTROPY:
+        q = cross_entropy_probabilities(model, p_vector, rng, batch_trials)
+    else:
+        q = np.maximum(p_vector, np.minimum(bias, MAX_BIASED_P))
+    sampler = _BiasedSampler(p_vector, q, condition_on_failure)
+
+    trials = 0
+    total = 0.0
+    total_squares = 0.0
+    while trials < max_trials:
+        failed, log_ratio = sampler.sample(rng, batch_trials)
+        w = np.exp(log_ratio[_system_failed(model, failed)])
+        total += float(w.sum())
+        total_squares += float((w ** 2).sum())
+        trials += batch_trials
+        if trials >= min_trials and total > 0 and _relative_error(total, total_squares, trials) <= relative_error:
+            break
+
+    risk = total / trials
+    rel_error = _relative_error(total, total_squares, trials) if total > 0 else math.inf
+    ess = total ** 2 / total_squares if total_squares > 0 else 0.0
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    half_width = z * risk * rel_error if total > 0 else 0.0
+    return ImportanceSamplingResult(risk, rel_error, ess, max(0.0, risk - half_width), min(1.0, risk + half_width),
+                                    trials, confidence)
+
+
+def _relative_error(total, total_squares, trials):
+    """ Standard error of the mean of weights over trials, relative to the mean. """
+    mean = total / trials
+    variance = max(total_squares / trials - mean ** 2, 0.0) / (trials - 1)
+    return math.sqrt(variance) / mean
@@ -1,7 +1,8 @@
-from typing import FrozenSet, Dict, List, Set
+from typing import FrozenSet, Dict, List, Optional, Set
 from hashlib import md5
 from dataclasses import field
 from functools import cached_property
+from contextlib import contextmanager
 import collections
 import json
 
@@ -9,7 +10,8 @@ from pydantic import validator, root_validator
 from pydantic.json import pydantic_encoder
 from pydantic.dataclasses import dataclass
 
-from iscram.domain.metrics.bdd_functions import build_bdd
+from iscram.domain.metrics.bdd_pool import bdd_manager_pool
+from iscram.domain.metrics.compiled_bdd import compile_bdd
 
 
 def validate_identifier(identifier: str) -> bool:
@@ -26,6 +28,24 @@ def validate_risk(risk: float) -> bool:
     return 0.0 <= risk <= 1.0
 
 
+def validate_risk_distribution(distribution: Dict) -> bool:
+    """ A risk distribution is one of:
+        {"type": "beta", "alpha": a, "beta": b} with a, b > 0
+        {"type": "uniform", "low": l, "high": h} with 0 <= l <= h <= 1
+        {"type": "triangular", "low": l, "mode": m, "high": h} with 0 <= l <= m <= h <= 1 """
+    try:
+        kind = distribution["type"]
+        if kind == "beta":
+            return distribution["alpha"] > 0 and distribution["beta"] > 0
+        if kind == "uniform":
+            return 0.0 <= distribution["low"] <= distribution["high"] <= 1.0
+        if kind == "triangular":
+            return 0.0 <= distribution["low"] <= distribution["mode"] <= distribution["high"] <= 1.0
+    except (KeyError, TypeError):
+        return False
+    return False
+
+
 def validate_cost(cost: int) -> bool:
     return cost >= 0
 
@@ -166,13 +186,44 @@ class SystemGraph:
     def get_id(self):
         return self._id
 
+    @cached_property
+    def _initial_variable_order(self) -> Optional[List[str]]:
+        return None
+
     @cached_property
     def _bdd_with_root(self):
-        return build_bdd(self)
+        return bdd_manager_pool.acquire(self, self._initial_variable_order)
 
     def get_bdd_with_root(self):
         return self._bdd_with_root
 
+    @contextmanager
+    def locked_bdd(self):
+        """ Yields (bdd, root) of this graph's BDD while holding the lock of its shared manager (see BDDManagerPool).
+        Operations on the BDD that may run alongside other threads go inside, and keep no nodes past it. """
+        self.get_bdd_with_root()
+        with bdd_manager_pool.locked(self) as bdd_with_root:
+            yield bdd_with_root
+
+    @cached_property
+    def _compiled_bdd(self):
+        with self.locked_bdd() as bdd_with_root:
+            return compile_bdd(*bdd_with_root)
+
+    def get_compiled_bdd(self):
+        return self._compiled_bdd
+
+    def get_variable_order(self) -> List[str]:
+        """ Returns the current BDD variable order (top to bottom) of this graph's BDD. """
+        self.get_bdd_with_root()
+        return bdd_manager_pool.get_variable_order(self)
+
+    def release_bdd(self):
+        """ Drops this graph's reference to its BDD in the shared manager pool. It is rebuilt if needed again. """
+        self.__dict__.pop("_compiled_bdd", None)
+        if self.__dict__.pop("_bdd_with_root", None) is not None:
+            bdd_manager_pool.release(self)
+
     @cached_property
     def supplier_groups(self) -> Dict[str, Set[str]]:
         """ Returns {root_node: descendants including self} """
@@ -252,7 +303,17 @@ class SystemGraph:
             new_node = Node(logic=n.logic, tags=tags)
             new_nodes[n_id] = new_node
 
-        return SystemGraph(nodes=new_nodes, edges=edges)
+        derived = SystemGraph(nodes=new_nodes, edges=edges)
+        if "_bdd_with_root" in self.__dict__:
+            # Start from the order already found for this graph instead of searching for one again.
+            derived.__dict__["_initial_variable_order"] = self.get_variable_order()
+        return derived
+
+
+def get_data_id(data: Dict) -> str:
+    """ A hash of the data's content, independent of key order. """
+    message = json.dumps(data, sort_keys=True, default=str)
+    return md5(message.encode('utf-8')).hexdigest()
 
 
 def validate_data(sg: SystemGraph, data: Dict) -> None:
@@ -265,6 +326,8 @@ def validate_data(sg: SystemGraph, data: Dict) -> None:
                 raise DataValidationError("Node name not in System Graph: {}".format(key))
             if "risk" in value and not validate_risk(value["risk"]):
                 raise DataValidationError("Risk data is invalid for node: {} {}".format(key, value))
+            if "risk_distribution" in value and not validate_risk_distribution(value["risk_distribution"]):
+                raise DataValidationError("Risk distribution is invalid for node: {} {}".format(key, value))
 
     # If edges are described in data dict, edge data must be valid for this System Graph
     if "edges" in data:
@@ -275,6 +338,10 @@ def validate_data(sg: SystemGraph, data: Dict) -> None:
                 raise DataValidationError("Could not find src or dst of edge: {}".format(edge))
             if "risk" in edge and not validate_risk(edge["risk"]):
                 raise DataValidationError("Risk is not valid for edge: {}".format(edge))
+            if "risk_distribution" in edge and not validate_risk_distribution(edge["risk_distribution"]):
+                raise DataValidationError("Risk distribution is not valid for edge: {}".format(edge))
+            if "existence" in edge and not validate_risk(edge["existence"]):
+                raise DataValidationError("Existence probability is not valid for edge: {}".format(edge))
             if "cost" in edge and not validate_cost(edge["cost"]):
                 raise DataValidationError("Cost is not valid for edge: {}".format(edge))
 
@@ -1,9 +1,30 @@
-from typing import Dict, List, Tuple
+import multiprocessing
+import threading
+from functools import cached_property
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple, NamedTuple, Sequence
 
+import numpy as np
 import pyomo.environ as pyo
 
-from iscram.domain.model import SystemGraph, Edge
+from iscram.domain.model import SystemGraph, Edge, DataValidationError
 from iscram.domain.metrics.importance import birnbaum_structural_importance
+from iscram.domain.metrics.probability_providers import provide_p_direct_from_data
+from iscram.domain.metrics.risk import risk_by_bdd
+from iscram.domain.metrics.choice_bdd import ChoiceBDD, choice_risk_batch, provide_p_with_choices_from_data
+from iscram.domain.supplier_choice_heuristic import SupplierChoiceArrays, solve_heuristic, GAP_TOLERANCE
+from iscram.domain.supplier_choice_exact import ExactSolverError, solve_exact
+from iscram.domain.supplier_choice_decomposition import solve_decomposed
+
+
+COUENNE = "couenne"
+HEURISTIC = "heuristic"
+EXACT = "exact"
+SOLVERS = (COUENNE, HEURISTIC, EXACT)
+
+EVALUATION_CHUNK = 4096
+REFINE_MAX_ROUNDS = 100
+REFINE_TOLERANCE = 1e-12
 
 
 class OptimizationError(Exception):
@@ -16,14 +37,15 @@ class SupplierChoiceProblem:
         """ Parameters extracted/computed from SystemGraph and data:
                    - N int: number of components in system
                    - M int: number of suppliers in system
-                   - NxM matrix of floats: component_risks
-                   - NxM matrix of floats: component_costs
+                   - list of (i, j) int pairs: pairs, the valid pairings of component i and supplier j
+                   - per pair floats: pair_risks, pair_costs
+                   - per component/supplier lists of int: pairs_of_component, pairs_of_supplier (indices into pairs)
                    - Nx1 vector of floats: component_importances
-                   - NxM matrix of booleans: valid_choices pairings of supplier/component
                    - Mx1 vector of floats: supplier risks
                    - K int: number of supplier groups in system
-                   - KxM matrix of booleans: membership of suppliers in groups
+                   - per group lists of int: supplier_groups, the suppliers (indices) in each group
                    - Kx1 vector of float: group risks
+               Only valid pairings (given by supplier edges in the graph or in the data) get a decision variable.
                """
 
         all_suppliers = set(sg.suppliers)
@@ -35,17 +57,16 @@ class SupplierChoiceProblem:
         self.N = len(sg.components)
         self.M = len(all_suppliers)
         self.K = len(supplier_groups_raw)
-        self.component_risks = [[0 for _ in range(self.M)] for _ in range(self.N)]
-        self.component_costs = [[0 for _ in range(self.M)] for _ in range(self.N)]
-        self.potential_suppliers = [[0 for _ in range(self.M)] for _ in range(self.N)]
         self.component_importances = [False for _ in range(self.N)]
         self.supplier_risks = [0 for _ in range(self.M)]
-        self.supplier_groups = [[False for _ in range(self.M)] for _ in range(self.K)]
         self.group_risks = [0 for _ in range(self.K)]
         component_index_map = {cname: idx for idx, cname in enumerate(sorted(sg.components))}
         supplier_index_map = {sname: idx for idx, sname in enumerate(sorted(all_suppliers))}
         group_index_map = {gname: idx for idx, gname in enumerate(sorted(supplier_groups_raw.keys()))}
         pre_existing_suppliers = {}  # map component name to supplier name
+        default_risks = [0 for _ in range(self.N)]  # risk of a component without a supplier given in its node data
+        pair_risks = {}
+        pair_costs = {}
 
         # begin with any supplier/component information in the system graph already
         for edge in sg.edges:
@@ -53,7 +74,7 @@ class SupplierChoiceProblem:
                 pre_existing_suppliers[edge.dst] = edge.src
                 i = component_index_map[edge.dst]
                 j = supplier_index_map[edge.src]
-                self.potential_suppliers[i][j] = True
+                pair_costs[(i, j)] = 0
 
         # extract risk values which are given in node data.
         for nodeId, nodeData in data.get("nodes", {}).items():
@@ -63,80 +84,91 @@ class SupplierChoiceProblem:
                 save = nodeData.get("risk", 0)
                 if supplier_of_i is not None:
                     j = supplier_index_map[supplier_of_i]
-                    self.component_risks[i][j] = save
+                    pair_risks[(i, j)] = save
                 else:
                     # This should not generally be used, but if a node has no supplier it may still contribute risk.
-                    self.component_risks[i] = [save] * self.M
+                    default_risks[i] = save
             elif nodeId in all_suppliers:
                 self.supplier_risks[supplier_index_map[nodeId]] = nodeData.get("risk", 0.0)
-                if group_index_map.get(nodeId):
-                    self.group_risks[group_index_map.get(nodeId)] = nodeData.get("risk", 0.0)
+                if nodeId in group_index_map:
+                    self.group_risks[group_index_map[nodeId]] = nodeData.get("risk", 0.0)
 
         # extract risk and cost values if given in data-edges for valid pairings
         for edgeDict in data.get("edges", []):
             if edgeDict["src"] in all_suppliers and edgeDict["dst"] in sg.components:
                 i = component_index_map[edgeDict["dst"]]
                 j = supplier_index_map[edgeDict["src"]]
-                self.component_risks[i][j] = edgeDict.get("risk", 0.0)
-                self.component_costs[i][j] = edgeDict.get("cost", 0.0)
-                self.potential_suppliers[i][j] = True
+                pair_risks[(i, j)] = edgeDict.get("risk", 0.0)
+                pair_costs[(i, j)] = edgeDict.get("cost", 0.0)
+
+        self.pairs = sorted(pair_costs)
+        self.pair_risks = [pair_risks.get((i, j), default_risks[i]) for i, j in self.pairs]
+        self.pair_costs = [pair_costs[pair] for pair in self.pairs]
+        self.pairs_of_component = [[] for _ in range(self.N)]
+        self.pairs_of_supplier = [[] for _ in range(self.M)]
+        for p, (i, j) in enumerate(self.pairs):
+            self.pairs_of_component[i].append(p)
+            self.pairs_of_supplier[j].append(p)
 
         # save indices for use after optimization
         self.map_index_component = invert_dict(component_index_map)
         self.map_index_supplier = invert_dict(supplier_index_map)
         self.map_index_group = invert_dict(group_index_map)
 
-        # load supplier groups into matrix
+        # load supplier groups as lists of supplier indices
+        self.supplier_groups = [[] for _ in range(self.K)]
         for root, group in supplier_groups_raw.items():
             k = group_index_map[root]
-            self.supplier_groups[k] = [True if self.map_index_supplier[m] in group else False for m in range(0, self.M)]
+            self.supplier_groups[k] = sorted(supplier_index_map[s] for s in group)
 
         # load component importances
-        all_importances = birnbaum_structural_importance(sg, bdd_with_root=sg.get_bdd_with_root())
+        with sg.locked_bdd() as bdd_with_root:
+            all_importances = birnbaum_structural_importance(sg, bdd_with_root=bdd_with_root)
         for i in range(0, self.N):
             self.component_importances[i] = all_importances[self.map_index_component[i]]
 
+        self._sg = sg
+        self._data = data
+        self._lock = threading.Lock()
         self.model = self.make_pyomo_model()
 
     def make_pyomo_model(self):
-        # Pyomo: retrieve and initialize a matrix of risks
-        def get_risks(mod, i, j):
-            return self.component_risks[i][j]
+        """ Builds the concrete model once. The budget b and alpha a are mutable parameters, set by each solve. """
+        # Pyomo: retrieve and initialize the risks of pairings
+        def get_risks(mod, p):
+            return self.pair_risks[p]
 
-        # Pyomo: retrieve and initialize a matrix of costs
-        def get_costs(mod, i, j):
-            return self.component_costs[i][j]
+        # Pyomo: retrieve and initialize the costs of pairings
+        def get_costs(mod, p):
+            return self.pair_costs[p]
 
-        model = pyo.AbstractModel()
+        model = pyo.ConcreteModel()
 
-        # Pyomo: RangeSets useful to initialize parameters
+        # Pyomo: RangeSets useful to initialize parameters; P indexes the valid pairings only
         model.I = pyo.RangeSet(0, self.N - 1)
-        model.J = pyo.RangeSet(0, self.M - 1)
+        model.P = pyo.RangeSet(0, len(self.pairs) - 1)
 
-        # Pyomo: Initialize cost and risk matrices
-        model.c = pyo.Param(model.I, model.J, within=pyo.NonNegativeIntegers, initialize=get_costs)
-        model.r = pyo.Param(model.I, model.J, within=pyo.PercentFraction, initialize=get_risks)
+        # Pyomo: Initialize cost and risk vectors
+        model.c = pyo.Param(model.P, within=pyo.NonNegativeIntegers, initialize=get_costs)
+        model.r = pyo.Param(model.P, within=pyo.PercentFraction, initialize=get_risks)
 
         # Pyomo: Declare decision variable
-        model.x = pyo.Var(model.I, model.J, domain=pyo.Boolean, initialize=0)
+        model.x = pyo.Var(model.P, domain=pyo.Boolean, initialize=0)
 
-        # Pyomo: Declare the budget parameter and 'alpha';
-        model.b = pyo.Param(within=pyo.NonNegativeIntegers)
-        model.a = pyo.Param()
+        # Pyomo: Declare the budget parameter and 'alpha'; mutable, so a solve only updates their values.
+        model.b = pyo.Param(within=pyo.NonNegativeIntegers, mutable=True, initialize=0)
+        model.a = pyo.Param(mutable=True, initialize=0)
 
         # Pyomo: define constraints
         def one_choice(mod, i):
-            return sum([mod.x[i, j] for j in range(self.M)]) == 1
-
-        def valid_choice(mod, i):
-            return sum([mod.x[i, j] * self.potential_suppliers[i][j] for j in range(self.M)]) == 1
-            #return sum([mod.x[i, j] for j in np.nonzero(self.potential_suppliers[i])[0]]) == 1
+            if len(self.pairs_of_component[i]) == 0:
+                return pyo.Constraint.Infeasible
+            return sum(mod.x[p] for p in self.pairs_of_component[i]) == 1
 
         def budget_constraint(mod):
             return pyo.summation(mod.c, mod.x) <= mod.b
 
         model.OneChoice = pyo.Constraint(model.I, rule=one_choice)
-        model.ValidChoice = pyo.Constraint(model.I, rule=valid_choice)
         model.BudgetConstraint = pyo.Constraint(rule=budget_constraint)
 
         # Pyomo: define objective function as sum of two functions
@@ -145,40 +177,257 @@ class SupplierChoiceProblem:
                                            self.component_importances,
                                            self.supplier_groups,
                                            self.group_risks,
-                                           self.N,
-                                           self.K)
+                                           self.pairs,
+                                           self.pairs_of_supplier)
 
         def apx_risk(mod):
             return compute_apx_risk(mod.r,
                                     self.supplier_risks,
                                     self.component_importances,
                                     mod.x,
-                                    self.N,
-                                    self.M)
+                                    self.pairs)
 
         def joint_objective(mod):
             return mod.apx_risk + mod.a * mod.s_group_penalty
 
-        model.Objective = pyo.Objective(rule=joint_objective, sense=pyo.minimize)
-
         # Pyomo: these Expressions are used to access data after solving
         model.apx_risk = pyo.Expression(rule=apx_risk)
         model.s_group_penalty = pyo.Expression(rule=s_group_penalty)
 
+        model.Objective = pyo.Objective(rule=joint_objective, sense=pyo.minimize)
+
         return model
 
-    def solve(self, params: Dict) -> Tuple[List[Edge], Dict]:
+    def solve(self, params: Dict, processes=1) -> Tuple[List[Edge], Dict]:
+        """ Solves for params["budget"] and params["alpha"] with params["solver"] (couenne by default, heuristic
+        for the in-process solver of supplier_choice_heuristic, or exact for the minimum exact system risk by
+        supplier_choice_exact). The model keeps the values of the last solution, which the couenne and heuristic
+        solvers get as their starting point, so solving a sequence of close parameters warm-starts each solve.
+        If the problem is too large for the exact solver, params["fallback_solver"] (couenne by default) solves it
+        instead, and the metadata records why.
+        With params["decompose"], heuristic solves split the problem into independent blocks solved in a pool of
+        processes (see solve_decomposed). Params are checked by validate_params. """
+        validate_params(params)
+        solver = params.get("solver", COUENNE)
+        fallback = params.get("fallback_solver", COUENNE)
+
+        with self._lock:
+            if solver == EXACT:
+                try:
+                    return self._solve_exact(params)
+                except ExactSolverError as e:
+                    if fallback == HEURISTIC:
+                        edges, metadata = self._solve_heuristic(params, processes)
+                    else:
+                        edges, metadata = self._solve(params)
+                    metadata.update({"fallback_solver": fallback, "fallback_reason": e.message})
+                    return edges, metadata
+            if solver == HEURISTIC:
+                return self._solve_heuristic(params, processes)
+            return self._solve(params)
+
+    @cached_property
+    def arrays(self) -> SupplierChoiceArrays:
+        return SupplierChoiceArrays(self)
+
+    @cached_property
+    def choice_bdd(self) -> ChoiceBDD:
+        return ChoiceBDD(self._sg, self.pair_names)
+
+    @cached_property
+    def pair_names(self) -> List[Tuple[str, str]]:
+        """ The (supplier, component) names of each pair. """
+        return [(self.map_index_supplier[j], self.map_index_component[i]) for i, j in self.pairs]
+
+    @cached_property
+    def _pair_index(self) -> Dict[Tuple[str, str], int]:
+        return {pair: p for p, pair in enumerate(self.pair_names)}
+
+    def choice_of_edges(self, edges: List[Edge]):
+        """ The pair chosen for each component by the supplier edges (as returned by solve), which must choose
+        exactly one valid supplier for every component. """
+        choice = np.full(self.N, -1, dtype=np.int64)
+        for e in edges:
+            p = self._pair_index.get((e.src, e.dst))
+            if p is None:
+                raise DataValidationError("Not a valid supplier choice: {}".format(e))
+            if choice[self.pairs[p][0]] >= 0:
+                raise DataValidationError("More than one supplier chosen for component: {}".format(e.dst))
+            choice[self.pairs[p][0]] = p
+        if (choice < 0).any():
+            missing = [self.map_index_component[i] for i in np.flatnonzero(choice < 0)]
+            raise DataValidationError("No supplier chosen for component(s): {}".format(missing))
+        return choice
+
+    def _choice_p_vector(self):
+        return self.choice_bdd.p_vector(provide_p_with_choices_from_data(self._sg, self._data, self.pair_names))
+
+    def evaluate(self, assignments: List[List[Edge]]) -> Tuple[np.ndarray, np.ndarray]:
+        """ Exact system risk and cost of each assignment (a list of supplier edges, see choice_of_edges), evaluated
+        in batches on the choice BDD, without deriving the graphs of the assignments. """
+        choices = np.array([self.choice_of_edges(edges) for edges in assignments], dtype=np.int64)
+        choices = choices.reshape(len(assignments), self.N)
+        with self._lock:
+            choice_bdd = self.choice_bdd
+            p_vector = self._choice_p_vector()
+
+        risks = np.empty(len(choices))
+        for start in range(0, len(choices), EVALUATION_CHUNK):
+            chunk = choices[start:start + EVALUATION_CHUNK]
+            selections = np.zeros((len(chunk), len(self.pairs)), dtype=bool)
+            selections[np.arange(len(chunk))[:, np.newaxis], chunk] = True
+            risks[start:start + len(chunk)] = choice_bdd.risk_batch(p_vector, selections)
+        return risks, self.arrays.costs[choices].sum(axis=1)
+
+    def refine(self, edges: List[Edge], params: Dict, processes=1) -> Tuple[List[Edge], Dict]:
+        """ Refines a solution on exact system risk, which the objective only approximates. From the choice of edges,
+        repeatedly moves to the neighbouring choice of least exact risk that fits params["budget"], until none
+        improves. Neighbours are all single supplier swaps and group moves (see neighbour_choices). Each round
+        evaluates all neighbours in batches on the compiled choice BDD. Large rounds, with at least EVALUATION_CHUNK
+        neighbours for each of two or more processes, are spread over a pool of processes (in this process
+        otherwise). Returns the refined edges, with the proxy (objective) and exact risks. """
         if "budget" not in params or "alpha" not in params:
             raise ValueError("Missing budget or alpha parameter for optimization.")
+        with self._lock:
+            choice_bdd = self.choice_bdd
+            p_vector = self._choice_p_vector()
+
+        pool = None
+
+        def evaluate(choices):
+            nonlocal pool
+            selections = np.zeros((len(choices), len(self.pairs)), dtype=bool)
+            selections[np.arange(len(choices))[:, np.newaxis], choices] = True
+            n_chunks = min(processes, len(selections) // EVALUATION_CHUNK)
+            if n_chunks < 2:
+                return choice_bdd.risk_batch(p_vector, selections)
+            if pool is None:
+                # Spawned, not forked (see solve_decomposed). The compiled BDD is sent to each worker once.
+                pool = ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context("spawn"),
+                                           initializer=_init_refine_worker,
+                                           initargs=(choice_bdd.compiled, p_vector, choice_bdd.selector_index))
+            return np.concatenate(list(pool.map(_refine_worker_risk_batch, np.array_split(selections, n_chunks))))
+
+        arrays = self.arrays
+        choice = self.choice_of_edges(edges)
+        try:
+            initial_risk = risk = float(evaluate(choice[np.newaxis])[0])
+            evaluated, rounds = 1, 0
+            for rounds in range(1, REFINE_MAX_ROUNDS + 1):
+                neighbours = neighbour_choices(arrays, choice)
+                neighbours = neighbours[arrays.costs[neighbours].sum(axis=1) <= params["budget"]]
+                if len(neighbours) == 0:
+                    break
+                risks = evaluate(neighbours)
+                evaluated += len(neighbours)
+                best = int(np.argmin(risks))
+                if risks[best] >= risk - REFINE_TOLERANCE:
+                    break
+                choice, risk = neighbours[best], float(risks[best])
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+        apx_risk, penalty, objective = arrays.terms(choice, params["alpha"])
+        metadata = {
+            "cost": float(arrays.costs[choice].sum()),
+            "objective": objective,
+            "risk_importance_heuristic": apx_risk,
+            "supplier_group_heuristic": penalty,
+            "exact_risk": risk,
+            "initial_exact_risk": initial_risk,
+            "evaluated": evaluated,
+            "rounds": rounds
+        }
+        return self._chosen_edges(sorted(choice.tolist())), metadata
+
+    def _current_choice(self):
+        """ The pair chosen for each component by the values in the model, or None if they are not a valid choice. """
+        chosen = [p for p in range(len(self.pairs)) if round(pyo.value(self.model.x[p]), 6) == 1]
+        choice = np.array(chosen, dtype=np.int64)
+        if len(choice) != self.N or not np.array_equal(self.arrays.component[choice], np.arange(self.N)):
+            return None
+        return choice
+
+    def _solve_heuristic(self, params: Dict, processes=1) -> Tuple[List[Edge], Dict]:
+        if params.get("decompose"):
+            return self._solve_decomposed(params, processes)
+        solution = solve_heuristic(self.arrays, params["budget"], params["alpha"], self._current_choice())
+        if solution is None:
+            raise OptimizationError("Infeasible budget constraint.")
+
+        chosen = set(solution.choice.tolist())
+        for p in range(len(self.pairs)):
+            self.model.x[p] = 1 if p in chosen else 0
 
-        data = {
-            None: {
-                "b": {None: params["budget"]},
-                "a": {None: params["alpha"]}
-            }
+        metadata = {
+            "solver_status": "ok",
+            "cost": solution.cost,
+            "termination_condition": "optimal" if solution.gap <= GAP_TOLERANCE else "locallyOptimal",
+            "objective": solution.objective,
+            "risk_importance_heuristic": solution.apx_risk,
+            "supplier_group_heuristic": solution.s_group_penalty,
+            "lower_bound": solution.lower_bound,
+            "gap": solution.gap
         }
+        return self._chosen_edges(sorted(chosen)), metadata
+
+    def _solve_decomposed(self, params: Dict, processes=1) -> Tuple[List[Edge], Dict]:
+        solution = solve_decomposed(self.arrays, params["budget"], params["alpha"], processes)
+        if solution is None:
+            raise OptimizationError("Infeasible budget constraint.")
 
-        instance = self.model.create_instance(data)
+        chosen = set(solution.choice.tolist())
+        for p in range(len(self.pairs)):
+            self.model.x[p] = 1 if p in chosen else 0
+
+        metadata = {
+            "solver_status": "ok",
+            "cost": solution.cost,
+            "termination_condition": "locallyOptimal",
+            "objective": solution.objective,
+            "risk_importance_heuristic": solution.apx_risk,
+            "supplier_group_heuristic": solution.s_group_penalty,
+            "blocks": solution.blocks,
+            "budget_price": solution.price
+        }
+        return self._chosen_edges(sorted(chosen)), metadata
+
+    def _solve_exact(self, params: Dict) -> Tuple[List[Edge], Dict]:
+        p = provide_p_with_choices_from_data(self._sg, self._data, self.pair_names)
+        solution = solve_exact(self.choice_bdd, p, self.pair_costs, self.pairs_of_component, params["budget"])
+        if solution is None:
+            raise OptimizationError("Infeasible budget constraint.")
+
+        chosen = set(solution.choice.tolist())
+        for p in range(len(self.pairs)):
+            self.model.x[p] = 1 if p in chosen else 0
+
+        apx_risk, penalty, objective = self.arrays.terms(solution.choice, params["alpha"])
+        metadata = {
+            "solver_status": "ok",
+            "cost": solution.cost,
+            "termination_condition": "optimal",
+            "objective": objective,
+            "risk_importance_heuristic": apx_risk,
+            "supplier_group_heuristic": penalty,
+            "exact_risk": solution.risk,
+            "diagram_size": solution.diagram_size,
+            "states": solution.states
+        }
+        return self._chosen_edges(sorted(chosen)), metadata
+
+    def _chosen_edges(self, chosen) -> List[Edge]:
+        edge_results = []
+        for p in chosen:
+            i, j = self.pairs[p]
+            edge_results.append(Edge(src=self.map_index_supplier[j], dst=self.map_index_component[i]))
+        return edge_results
+
+    def _solve(self, params: Dict) -> Tuple[List[Edge], Dict]:
+        instance = self.model
+        instance.b = params["budget"]
+        instance.a = params["alpha"]
 
         ## Fastest: SCIP, but (current) difficulties automating install
         # solver = pyo.SolverFactory("scipampl")
@@ -194,6 +443,7 @@ class SupplierChoiceProblem:
 
         metadata = {
             "solver_status": str(results.solver.status),
+            "cost": pyo.value(pyo.summation(instance.c, instance.x)),
             "termination_condition": str(results.solver.termination_condition),
             "objective": pyo.value(instance.Objective),
             "risk_importance_heuristic": pyo.value(instance.apx_risk),
@@ -205,32 +455,150 @@ class SupplierChoiceProblem:
         if metadata["solver_status"] != "ok":
             raise OptimizationError("Could not solve under given constraints.")
 
-        edge_results = []
-        for i in range(self.N):
-            for j in range(self.M):
-                if round(pyo.value(instance.x[i, j]), 6) == 1:
-                    edge_results.append(Edge(src=self.map_index_supplier[j], dst=self.map_index_component[i]))
-
-        return edge_results, metadata
-
-
-def compute_s_group_penalty(x, component_importances, supplier_groups, group_risks, N, K):
+        chosen = [p for p in range(len(self.pairs)) if round(pyo.value(instance.x[p]), 6) == 1]
+        return self._chosen_edges(chosen), metadata
+
+
+def validate_params(params: Dict) -> None:
+    """ Raises ValueError unless params has a budget and a non-negative alpha (the heuristic's bounds assume the
+    group penalty is not rewarded), known solvers, and params["decompose"] only with a heuristic solve: the
+    heuristic solver, or the exact solver falling back to the heuristic (decomposition applies to the fallback; the
+    exact solver itself does not decompose). """
+    if "budget" not in params or "alpha" not in params:
+        raise ValueError("Missing budget or alpha parameter for optimization.")
+    if params["alpha"] < 0:
+        raise ValueError("Alpha must not be negative: {}".format(params["alpha"]))
+    solver = params.get("solver", COUENNE)
+    fallback = params.get("fallback_solver", COUENNE)
+    if solver not in SOLVERS:
+        raise ValueError("Unknown solver: {}".format(solver))
+    if fallback not in SOLVERS or fallback == EXACT:
+        raise ValueError("Unknown fallback solver: {}".format(fallback))
+    if params.get("decompose") and solver != HEURISTIC and not (solver == EXACT and fallback == HEURISTIC):
+        raise ValueError("Decomposition needs the heuristic solver, or the exact solver with the heuristic fallback.")
+
+
+def neighbour_choices(arrays: SupplierChoiceArrays, choice):
+    """ The choices differing from choice by a single supplier swap (one component to another of its pairs), or by
+    a group move (every component on one supplier that can also use another supplier, moved to it). """
+    current = choice[arrays.component]
+    moves = np.flatnonzero(np.arange(len(current)) != current)
+    singles = np.repeat(choice[np.newaxis], len(moves), axis=0)
+    singles[np.arange(len(moves)), arrays.component[moves]] = moves
+
+    supplier = arrays.supplier
+    pairs_by_supplier = {}
+    for p in range(len(supplier)):
+        pairs_by_supplier.setdefault(supplier[p], {})[arrays.component[p]] = p
+    groups = []
+    for a in np.unique(supplier[choice]):
+        on_a = [i for i, p in enumerate(choice) if supplier[p] == a]
+        for b, pairs_of_b in pairs_by_supplier.items():
+            movable = [i for i in on_a if i in pairs_of_b]
+            if b == a or len(movable) < 2:
+                continue
+            moved = choice.copy()
+            moved[movable] = [pairs_of_b[i] for i in movable]
+            groups.append(moved)
+
+    neighbours = np.concatenate([singles] + ([np.array(groups)] if groups else []))
+    return np.unique(neighbours, axis=0)
+
+
+class SweepPoint(NamedTuple):
+    budget: int
+    alpha: float
+    cost: float
+    risk: float
+    edges: List[Edge]
+    metadata: Dict
+
+
+def _solve_budgets(problem: SupplierChoiceProblem, sg: SystemGraph, data: Dict, alpha, budgets,
+                   params: Dict = None) -> List[SweepPoint]:
+    """ Solves for each budget in turn (increasing), each solve starting from the previous solution. The risk of a
+    point is the exact system risk of the graph with the chosen suppliers. Infeasible budgets give no point. """
+    points = []
+    for budget in sorted(budgets):
+        try:
+            edges, metadata = problem.solve({**(params or {}), "budget": budget, "alpha": alpha})
+        except OptimizationError:
+            continue
+        updated = sg.with_suppliers(edges)
+        risk = risk_by_bdd(updated, provide_p_direct_from_data(updated, data))
+        points.append(SweepPoint(budget, alpha, metadata["cost"], risk, edges, metadata))
+    return points
+
+
+_refine_worker = {}
+
+
+def _init_refine_worker(compiled, p_vector, selector_index):
+    _refine_worker.update(compiled=compiled, p_vector=p_vector, selector_index=selector_index)
+
+
+def _refine_worker_risk_batch(selections):
+    return choice_risk_batch(_refine_worker["compiled"], _refine_worker["p_vector"], _refine_worker["selector_index"],
+                             selections)
+
+
+def _sweep_task(sg_dict: Dict, data: Dict, alpha, budgets, params: Dict = None) -> List[SweepPoint]:
+    sg = SystemGraph(**sg_dict)
+    return _solve_budgets(SupplierChoiceProblem(sg, data), sg, data, alpha, budgets, params)
+
+
+def pareto_frontier(points: Sequence[SweepPoint]) -> List[SweepPoint]:
+    """ The points not dominated on (cost, risk), by increasing cost. Of equal points, the first is kept. """
+    frontier = []
+    for point in sorted(points, key=lambda pt: (pt.cost, pt.risk)):
+        if len(frontier) == 0 or point.risk < frontier[-1].risk:
+            frontier.append(point)
+    return frontier
+
+
+def sweep_supplier_choices(sg: SystemGraph, data: Dict, budgets: Sequence[int], alphas: Sequence[float],
+                           processes=1, problem: SupplierChoiceProblem = None, params: Dict = None) -> List[SweepPoint]:
+    """ Solves the supplier choice problem for every budget and alpha, and returns the risk-cost Pareto frontier.
+    The budgets of each alpha are split into contiguous chunks, solved in increasing order so each solve is
+    warm-started from its neighbour's solution. Chunks run on a pool of processes, each rebuilding the problem
+    from sg.dict(), or in this process (with problem, if given) if processes is 1. Other params (e.g. the solver)
+    are passed to each solve. """
+    budgets = sorted(set(budgets))
+    if len(budgets) == 0 or len(alphas) == 0:
+        raise ValueError("Sweep needs at least one budget and one alpha.")
+
+    if processes == 1:
+        problem = problem if problem is not None else SupplierChoiceProblem(sg, data)
+        points = [pt for alpha in alphas for pt in _solve_budgets(problem, sg, data, alpha, budgets, params)]
+        return pareto_frontier(points)
+
+    n_chunks = min(len(budgets), max(1, processes // len(alphas)))
+    chunk_size = -(-len(budgets) // n_chunks)
+    tasks = [(alpha, budgets[i:i + chunk_size]) for alpha in alphas for i in range(0, len(budgets), chunk_size)]
+    sg_dict = sg.dict()
+    with ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context("spawn")) as pool:
+        results = pool.map(_sweep_task, [sg_dict] * len(tasks), [data] * len(tasks), *zip(*tasks),
+                           [params] * len(tasks))
+        points = [pt for result in results for pt in result]
+    return pareto_frontier(points)
+
+
+def compute_s_group_penalty(x, component_importances, supplier_groups, group_risks, pairs, pairs_of_supplier):
     group_penalty = 0
-    for k in range(K):
+    for k, group in enumerate(supplier_groups):
         score = 0
-        for j in supplier_groups[k]:
-            for i in range(N):
-                score += x[i, j] * component_importances[i]
+        for j in group:
+            for p in pairs_of_supplier[j]:
+                score += x[p] * component_importances[pairs[p][0]]
         group_penalty += (group_risks[k] * score) ** 2
     return group_penalty
 
 
-def compute_apx_risk(r, supplier_risks, component_importances, x, N, M):
+def compute_apx_risk(r, supplier_risks, component_importances, x, pairs):
     apx_risk = 0
-    for i in range(N):
-        for j in range(M):
-            score = r[i, j] + supplier_risks[j] - (r[i, j] * supplier_risks[j])
-            apx_risk += score * component_importances[i] * x[i, j]
+    for p, (i, j) in enumerate(pairs):
+        score = r[p] + supplier_risks[j] - (r[p] * supplier_risks[j])
+        apx_risk += score * component_importances[i] * x[p]
     return apx_risk
 
 
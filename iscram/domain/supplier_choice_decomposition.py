@@ -0,0 +1,128 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, NamedTuple, Optional
+
+import numpy as np
+
+from iscram.domain.supplier_choice_heuristic import SupplierChoiceArrays, solve_heuristic, GAP_TOLERANCE
+
+
+PRICE_ITERATIONS = 40
+
+
+class DecomposedSolution(NamedTuple):
+    choice: np.ndarray  # index of the chosen pair for each component
+    objective: float
+    apx_risk: float
+    s_group_penalty: float
+    cost: float
+    blocks: int
+    price: float  # Lagrange multiplier of the budget
+
+
+def independent_blocks(arrays: SupplierChoiceArrays) -> List[np.ndarray]:
+    """ Splits the pairs into blocks whose components share no supplier group score, so that the objective is the
+    sum of the objectives of the blocks and only the budget couples them. Components are joined by union-find
+    through the groups their pairs score in. Returns the (sorted) pairs of each block, in order of their first
+    component. """
+    parent = list(range(arrays.n_components + len(arrays.group_risks_squared)))
+
+    def find(u):
+        while parent[u] != u:
+            parent[u] = parent[parent[u]]
+            u = parent[u]
+        return u
+
+    for k, p in zip(*np.nonzero(arrays.group_scores)):
+        parent[find(arrays.n_components + k)] = find(arrays.component[p])
+
+    roots = np.array([find(i) for i in arrays.component], dtype=np.int64).reshape(len(arrays.component))
+    _, first = np.unique(roots, return_index=True)
+    return [np.flatnonzero(roots == roots[p]) for p in sorted(first)]
+
+
+def _solve_priced(arrays: SupplierChoiceArrays, price, alpha):
+    """ Choice of a block minimizing its objective plus price times its cost, without a budget. """
+    return solve_heuristic(arrays.with_weights(arrays.weights + price * arrays.costs), np.inf, alpha).choice
+
+
+def _solve_block(arrays: SupplierChoiceArrays, budget, alpha, initial):
+    return solve_heuristic(arrays, budget, alpha, initial).choice
+
+
+def solve_decomposed(arrays: SupplierChoiceArrays, budget, alpha, processes=1) -> Optional[DecomposedSolution]:
+    """ Minimizes the supplier choice objective under the budget by solving the independent blocks (see
+    independent_blocks) separately, with solve_heuristic, in a pool of processes (in this process if processes is
+    1). The blocks are coordinated on the shared budget by its Lagrange multiplier (the price): each block minimizes
+    its objective plus price times its cost, and the price is set by bisection to the lowest that fits the budget.
+    The budget left at that price is then allocated to the blocks by their improvement per unit of extra cost, each
+    block re-solved with its cost plus all of the remaining budget. Returns None if no choice fits the budget. """
+    if not arrays.has_choices():
+        return None
+    cheapest = arrays.component_argmin(arrays.costs, arrays.weights)
+    if arrays.costs[cheapest].sum() > budget:
+        return None
+
+    blocks = independent_blocks(arrays)
+    block_arrays = [arrays.block(pairs) for pairs in blocks]
+    pool = None
+    if processes > 1 and len(blocks) > 1:
+        # Spawned, not forked: solves may run on worker threads (see JobQueue), and forking a threaded process
+        # copies locks held by the other threads.
+        pool = ProcessPoolExecutor(min(processes, len(blocks)), mp_context=multiprocessing.get_context("spawn"))
+
+    def solve_all(function, *args):
+        args = [[a] * len(blocks) if np.isscalar(a) else a for a in args]
+        if pool is None:
+            return list(map(function, block_arrays, *args))
+        return list(pool.map(function, block_arrays, *args))
+
+    def block_costs(choices):
+        return np.array([b.costs[c].sum() for b, c in zip(block_arrays, choices)])
+
+    def block_objectives(choices):
+        return np.array([b.terms(c, alpha)[2] for b, c in zip(block_arrays, choices)])
+
+    try:
+        price, choices = 0.0, solve_all(_solve_priced, 0.0, alpha)
+        if block_costs(choices).sum() > budget:
+            low, high = 0.0, 1.0
+            high_choices = solve_all(_solve_priced, high, alpha)
+            for _ in range(PRICE_ITERATIONS):
+                if block_costs(high_choices).sum() <= budget:
+                    break
+                low, high = high, high * 2
+                high_choices = solve_all(_solve_priced, high, alpha)
+            if block_costs(high_choices).sum() > budget:
+                high_choices = [b.component_argmin(b.costs, b.weights) for b in block_arrays]
+            for _ in range(PRICE_ITERATIONS):
+                mid = (low + high) / 2
+                mid_choices = solve_all(_solve_priced, mid, alpha)
+                if block_costs(mid_choices).sum() <= budget:
+                    high, high_choices = mid, mid_choices
+                else:
+                    low = mid
+            price, choices = high, high_choices
+
+        costs = block_costs(choices)
+        slack = budget - costs.sum()
+        if slack > GAP_TOLERANCE:
+            candidates = solve_all(_solve_block, list(costs + slack), alpha, choices)
+            gains = block_objectives(choices) - block_objectives(candidates)
+            extra = block_costs(candidates) - costs
+            rate = np.where(extra > 0, gains / np.maximum(extra, GAP_TOLERANCE), np.inf)
+            for b in np.lexsort((-gains, -rate)):
+                if gains[b] > GAP_TOLERANCE and extra[b] <= slack:
+                    choices[b] = candidates[b]
+                    slack -= extra[b]
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    choice = np.empty(arrays.n_components, dtype=np.int64)
+    for pairs, block_choice in zip(blocks, choices):
+        chosen = pairs[block_choice]
+        choice[arrays.component[chosen]] = chosen
+    apx_risk, penalty, objective = arrays.terms(choice, alpha)
+    return DecomposedSolution(choice, objective, apx_risk, penalty, float(arrays.costs[choice].sum()), len(blocks),
+                              price)
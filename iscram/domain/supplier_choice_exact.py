@@ -0,0 +1,146 @@
+from typing import Dict, List, NamedTuple, Optional, Sequence
+
+import numpy as np
+
+from iscram.domain.metrics.bdd_functions import bdd_prob_iterative, bdd_node_table
+from iscram.domain.metrics.choice_bdd import ChoiceBDD, selector_variable
+
+
+EXACT_MAX_PAIRS = 256
+EXACT_MAX_NODES = 2**16
+# About 0.3 ms each on the full example (178 node choice BDD), so seconds of search at most.
+EXACT_MAX_STATES = 2**15
+
+
+class ExactSolverError(Exception):
+    def __init__(self, message):
+        self.message = message
+
+
+class ExactSolution(NamedTuple):
+    choice: np.ndarray  # index of the chosen pair for each component
+    risk: float
+    cost: float
+    diagram_size: int
+    states: int
+
+
+def _probability_bounds(bdd, f, p, decisions, memo):
+    """ Lowest and highest probability of f over the values of the decision variables, if each were decided at its
+    node, knowing the values of the variables above it. These bound the probability of f for any fixed values of the
+    decision variables. The memo is keyed by the integer identity of the regular nodes. """
+    memo.setdefault(int(bdd.true), (1.0, 1.0))
+    for k, x, g, g_neg, h, h_neg in reversed(bdd_node_table(f)):
+        if k in memo:
+            continue
+        high = (1 - memo[g][1], 1 - memo[g][0]) if g_neg else memo[g]
+        low = (1 - memo[h][1], 1 - memo[h][0]) if h_neg else memo[h]
+        if x in decisions:
+            memo[k] = (min(high[0], low[0]), max(high[1], low[1]))
+        else:
+            memo[k] = (p[x] * high[0] + (1 - p[x]) * low[0], p[x] * high[1] + (1 - p[x]) * low[1])
+    if f.var is None:
+        return (0.0, 0.0) if f.negated else (1.0, 1.0)
+    r = memo[int(~f) if f.negated else int(f)]
+    return (1 - r[1], 1 - r[0]) if f.negated else r
+
+
+def solve_exact(choice_bdd: ChoiceBDD, p: Dict[str, float], pair_costs: Sequence[float],
+                pairs_of_component: List[List[int]], budget) -> Optional[ExactSolution]:
+    """ Minimum exact system risk over all supplier choices within budget, by branch and bound over the choice BDD
+    (see build_choice_bdd), with p as given by provide_p_with_choices_from_data.
+    The selectors of each component form a one-hot block. Blocks are fixed one at a time, topmost first: after
+    blocks 0..k-1, the choice BDD restricted to their chosen pairs is a node (a state) standing for the risk of the
+    choices of the remaining components. A state is cut if the cheapest remaining pairs do not fit the budget left,
+    if the same node was searched before with at least as much budget left (budget dominance), or if its lower bound
+    is no better than the best choice found. The bound is _probability_bounds of the node with each remaining block
+    encoded so that every value of its selectors is one of its pairs (the first selected pair in level order, else
+    the last), i.e. it relaxes only when each choice is made. Blocks the node does not depend on take their cheapest
+    pair, and a node without selectors is evaluated as a probability.
+    Returns None if no choice fits the budget, and raises ExactSolverError if the problem exceeds the size limits
+    (pairs, diagram nodes or states). """
+    costs = np.asarray(pair_costs, dtype=float)
+    pair_names = choice_bdd.pairs
+    if len(pair_names) > EXACT_MAX_PAIRS:
+        raise ExactSolverError("Too many supplier pairs for the exact solver: {}".format(len(pair_names)))
+    if any(len(block) == 0 for block in pairs_of_component):
+        return None
+    min_costs = np.array([costs[block].min() for block in pairs_of_component])
+    if min_costs.sum() > budget:
+        return None
+
+    bdd, root = choice_bdd.bdd, choice_bdd.root
+    diagram_size = root.dag_size
+    if diagram_size > EXACT_MAX_NODES:
+        raise ExactSolverError("Choice diagram too large for the exact solver: {} nodes".format(diagram_size))
+
+    previous = bdd.configure(reordering=False)
+    try:
+        selectors = [selector_variable(*pair) for pair in pair_names]
+        levels = {v: bdd.level_of_var(v) if v in bdd.vars else len(bdd.vars) for v in selectors}
+        blocks = [sorted(block, key=lambda q: (levels[selectors[q]], q)) for block in pairs_of_component]
+        order = sorted(range(len(blocks)), key=lambda i: levels[selectors[blocks[i][0]]])
+        blocks = [blocks[i] for i in order]
+        block_of = {selectors[q]: k for k, block in enumerate(blocks) for q in block}
+        block_min_costs = min_costs[order]
+        remaining_min_costs = np.append(np.cumsum(block_min_costs[::-1])[::-1], 0.0)
+        cheapest = [min(block, key=lambda q: (costs[q], q)) for block in blocks]
+
+        encoding = {}
+        for block in blocks:
+            none_before = bdd.true
+            for q in block[:-1]:
+                encoding[selectors[q]] = none_before & bdd.var(selectors[q])
+                none_before = none_before & ~bdd.var(selectors[q])
+            encoding[selectors[block[-1]]] = none_before
+        encoded_root = bdd.let(encoding, root)
+
+        alive = []  # keeps the nodes of all keys alive, so that their integer identities are not reused
+        searched = {}
+        top_blocks = {}
+        bounds, probabilities = {}, {}
+        best = {"risk": np.inf, "choice": None}
+        path = np.empty(len(blocks), dtype=np.int64)
+
+        def top_block(f):
+            """ The first block f depends on (all blocks above it are fixed). """
+            if int(f) not in top_blocks:
+                top_blocks[int(f)] = min((block_of[v] for v in bdd.support(f) if v in block_of), default=len(blocks))
+            return top_blocks[int(f)]
+
+        def search(f, k, b):
+            top = top_block(f)
+            path[k:top] = cheapest[k:top]
+            b -= block_min_costs[k:top].sum()
+            if top == len(blocks):
+                risk = bdd_prob_iterative(bdd, f, p, probabilities)
+                if risk < best["risk"]:
+                    best["risk"], best["choice"] = risk, path.copy()
+                return
+            if searched.get((int(f), top), -np.inf) >= b:
+                return
+            searched[(int(f), top)] = b
+            if len(searched) > EXACT_MAX_STATES:
+                raise ExactSolverError("Too many states for the exact solver: more than {}".format(EXACT_MAX_STATES))
+
+            children = []
+            for q in blocks[top]:
+                if costs[q] + remaining_min_costs[top + 1] <= b:
+                    child = bdd.let({selectors[r]: r == q for r in blocks[top]}, f)
+                    alive.append(child)
+                    children.append((_probability_bounds(bdd, child, p, block_of, bounds)[0], costs[q], q, child))
+            for bound, c, q, child in sorted(children, key=lambda child: child[:3]):
+                if bound >= best["risk"]:
+                    break
+                path[top] = q
+                search(child, top + 1, b - c)
+
+        search(encoded_root, 0, budget)
+    finally:
+        bdd.configure(reordering=previous["reordering"])
+
+    if best["choice"] is None:
+        return None
+    choice = np.empty(len(blocks), dtype=np.int64)
+    choice[order] = best["choice"]
+    return ExactSolution(choice, float(best["risk"]), float(costs[choice].sum()), diagram_size, len(searched))
@@ -0,0 +1,244 @@
+import copy
+from typing import NamedTuple, Optional
+
+import numpy as np
+
+
+LOCAL_SEARCH_MAX_ITERATIONS = 10000
+COMBINED_MOVE_CANDIDATES = 20
+LAGRANGIAN_ITERATIONS = 60
+GAP_TOLERANCE = 1e-9
+
+
+class HeuristicSolution(NamedTuple):
+    choice: np.ndarray  # index of the chosen pair for each component
+    objective: float
+    apx_risk: float
+    s_group_penalty: float
+    cost: float
+    lower_bound: float
+    gap: float
+
+
+class SupplierChoiceArrays:
+    """ The supplier choice objective of a SupplierChoiceProblem as arrays over its pairs (see compute_apx_risk and
+    compute_s_group_penalty):
+        - weights[p]: the apx_risk term of pair p
+        - costs[p]: the cost of pair p
+        - component[p], supplier[p]: the component and supplier of pair p; starts[i] is the first pair of component i
+        - group_scores[k, p]: the importance pair p adds to the score of supplier group k
+        - group_risks_squared[k]
+    Pairs must be sorted by component, as SupplierChoiceProblem keeps them.
+    The objective of a choice x is weights . x + alpha * sum_k group_risks_squared[k] * (group_scores[k] . x) ** 2 """
+
+    def __init__(self, problem):
+        n_pairs = len(problem.pairs)
+        importances = np.asarray(problem.component_importances, dtype=float)
+        supplier_risks = np.asarray(problem.supplier_risks, dtype=float)
+        self.component = np.array([i for i, _ in problem.pairs], dtype=np.int64).reshape(n_pairs)
+        self.supplier = supplier = np.array([j for _, j in problem.pairs], dtype=np.int64).reshape(n_pairs)
+        risks = np.asarray(problem.pair_risks, dtype=float).reshape(n_pairs)
+
+        self.n_components = problem.N
+        self.costs = np.asarray(problem.pair_costs, dtype=float).reshape(n_pairs)
+        self.weights = (risks + supplier_risks[supplier] - risks * supplier_risks[supplier]) \
+            * importances[self.component]
+        self.starts = np.searchsorted(self.component, np.arange(problem.N))
+        self.group_scores = np.zeros((problem.K, n_pairs))
+        for k, group in enumerate(problem.supplier_groups):
+            in_group = np.isin(supplier, group)
+            self.group_scores[k, in_group] = importances[self.component[in_group]]
+        self.group_risks_squared = np.asarray(problem.group_risks, dtype=float) ** 2
+
+        # For move_deltas: sum_k group_risks_squared[k] * group_scores[k, p] * group_scores[k, q] for p itself
+        # (squared_scores) and for each q of the same component (cross[p, position of q in the component]).
+        weighted = self.group_scores * self.group_risks_squared[:, np.newaxis]
+        self.squared_scores = (weighted * self.group_scores).sum(axis=0)
+        self.position = np.arange(n_pairs) - self.starts[self.component]
+        ends = np.append(self.starts[1:], n_pairs)
+        self.cross = np.zeros((n_pairs, max((ends - self.starts).max(initial=0), 1)))
+        for start, end in zip(self.starts, ends):
+            self.cross[start:end, :end - start] = weighted[:, start:end].T @ self.group_scores[:, start:end]
+
+    def block(self, pairs):
+        """ The arrays of a subset of the pairs covering whole components (see independent_blocks), with the
+        components renumbered in order and the groups without a score on the pairs dropped. """
+        pairs = np.asarray(pairs, dtype=np.int64)
+        block = copy.copy(self)
+        components, block.component = np.unique(self.component[pairs], return_inverse=True)
+        groups = np.flatnonzero(self.group_scores[:, pairs].any(axis=1))
+        block.n_components = len(components)
+        block.costs = self.costs[pairs]
+        block.weights = self.weights[pairs]
+        block.supplier = self.supplier[pairs]
+        block.starts = np.searchsorted(block.component, np.arange(len(components)))
+        block.group_scores = self.group_scores[np.ix_(groups, pairs)]
+        block.group_risks_squared = self.group_risks_squared[groups]
+        block.squared_scores = self.squared_scores[pairs]
+        block.position = self.position[pairs]
+        block.cross = self.cross[pairs]
+        return block
+
+    def with_weights(self, weights):
+        """ The same arrays with other apx_risk terms, e.g. priced by a Lagrange multiplier on the costs. """
+        priced = copy.copy(self)
+        priced.weights = np.asarray(weights, dtype=float)
+        return priced
+
+    def has_choices(self):
+        return bool(np.all(np.bincount(self.component, minlength=self.n_components) > 0))
+
+    def component_min(self, values):
+        return np.minimum.reduceat(values, self.starts)
+
+    def component_argmin(self, values, tie_breaker):
+        """ For each component, the pair minimizing values, ties going to the smaller tie_breaker. """
+        order = np.lexsort((tie_breaker, values, self.component))
+        return order[self.starts]
+
+    def terms(self, choice, alpha):
+        scores = self.group_scores[:, choice].sum(axis=1)
+        apx_risk = float(self.weights[choice].sum())
+        penalty = float((self.group_risks_squared * scores ** 2).sum())
+        return apx_risk, penalty, apx_risk + alpha * penalty
+
+    def move_deltas(self, choice, alpha):
+        """ Change of objective and cost when moving the component of each pair p to p. """
+        current = choice[self.component]
+        scores = self.group_scores[:, choice].sum(axis=1)
+        linear = (self.group_risks_squared * scores) @ self.group_scores
+        d_penalty = 2 * (linear - linear[current]) + self.squared_scores + self.squared_scores[current] \
+            - 2 * self.cross[np.arange(len(current)), self.position[current]]
+        d_objective = self.weights - self.weights[current] + alpha * d_penalty
+        return d_objective, self.costs - self.costs[current]
+
+
+def _lagrangian(arrays: SupplierChoiceArrays, budget):
+    """ Lagrangian relaxation of the budget on the separable apx_risk part. Returns the best bound found, and the
+    cheapest-penalty choice minimizing weights + lambda * costs that fits the budget.
+    The group penalty is at least the penalty of each component's smallest contribution to each group, so adding
+    that to the relaxed apx_risk still bounds the objective from below. """
+    def relaxed(lam):
+        values = arrays.weights + lam * arrays.costs
+        choice = arrays.component_argmin(values, arrays.costs)
+        return float(arrays.component_min(values).sum() - lam * budget), choice
+
+    bound, choice = relaxed(0.0)
+    if arrays.costs[choice].sum() <= budget:
+        return bound, choice
+
+    low, high = 0.0, 1.0
+    _, high_choice = relaxed(high)
+    for _ in range(LAGRANGIAN_ITERATIONS):
+        if arrays.costs[high_choice].sum() <= budget:
+            break
+        low, high = high, high * 2
+        _, high_choice = relaxed(high)
+
+    for _ in range(LAGRANGIAN_ITERATIONS):
+        mid = (low + high) / 2
+        value, mid_choice = relaxed(mid)
+        bound = max(bound, value)
+        if arrays.costs[mid_choice].sum() <= budget:
+            high, high_choice = mid, mid_choice
+        else:
+            low = mid
+    bound = max(bound, relaxed(high)[0])
+
+    feasible = high_choice if arrays.costs[high_choice].sum() <= budget else None
+    return bound, feasible
+
+
+def _group_penalty_bound(arrays: SupplierChoiceArrays, alpha):
+    smallest = np.minimum.reduceat(arrays.group_scores, arrays.starts, axis=1).sum(axis=1)
+    return alpha * float((arrays.group_risks_squared * smallest ** 2).sum())
+
+
+def _greedy(arrays: SupplierChoiceArrays, budget, alpha, choice):
+    """ From a feasible choice, repeatedly takes the improving move with the best improvement per unit of extra cost
+    that fits in the budget (moves that do not add cost first). """
+    cost = arrays.costs[choice].sum()
+    for _ in range(LOCAL_SEARCH_MAX_ITERATIONS):
+        d_objective, d_cost = arrays.move_deltas(choice, alpha)
+        candidates = (d_objective < -GAP_TOLERANCE) & (cost + d_cost <= budget)
+        if not candidates.any():
+            break
+        rate = np.where(d_cost > 0, -d_objective / np.maximum(d_cost, GAP_TOLERANCE), np.inf)
+        rate = np.where(candidates, rate, -np.inf)
+        best = np.flatnonzero(rate == rate.max())
+        p = best[np.argmin(d_objective[best])]
+        choice[arrays.component[p]] = p
+        cost += d_cost[p]
+    return choice
+
+
+def _local_search(arrays: SupplierChoiceArrays, budget, alpha, choice):
+    """ Best-improvement local search over single moves, and over moves that do not fit the budget combined with a
+    cost-saving move of another component. """
+    cost = arrays.costs[choice].sum()
+    _, _, objective = arrays.terms(choice, alpha)
+    for _ in range(LOCAL_SEARCH_MAX_ITERATIONS):
+        d_objective, d_cost = arrays.move_deltas(choice, alpha)
+        fits = cost + d_cost <= budget
+        single = np.where(fits, d_objective, np.inf)
+        p = int(np.argmin(single))
+        if single[p] < -GAP_TOLERANCE:
+            choice[arrays.component[p]] = p
+            cost += d_cost[p]
+            objective += single[p]
+            continue
+
+        improved = False
+        blocked = np.flatnonzero(~fits & (d_objective < -GAP_TOLERANCE))
+        for p in blocked[np.argsort(d_objective[blocked])][:COMBINED_MOVE_CANDIDATES]:
+            excess = cost + d_cost[p] - budget
+            savers = np.flatnonzero((d_cost <= -excess) & (arrays.component != arrays.component[p]))
+            for q in savers[np.argsort(d_objective[savers])][:COMBINED_MOVE_CANDIDATES]:
+                candidate = choice.copy()
+                candidate[arrays.component[p]] = p
+                candidate[arrays.component[q]] = q
+                _, _, candidate_objective = arrays.terms(candidate, alpha)
+                if candidate_objective < objective - GAP_TOLERANCE:
+                    choice, objective = candidate, candidate_objective
+                    cost = arrays.costs[choice].sum()
+                    improved = True
+                    break
+            if improved:
+                break
+        if not improved:
+            break
+    return choice
+
+
+def solve_heuristic(arrays: SupplierChoiceArrays, budget, alpha, initial=None) -> Optional[HeuristicSolution]:
+    """ Minimizes the supplier choice objective under the budget without an external solver.
+    Candidate starting choices are the cheapest choice, the choice found by the Lagrangian relaxation of the budget,
+    and initial (e.g. a previous solution), if feasible. Each is improved by greedy construction and local search,
+    and the best is returned with the Lagrangian lower bound and the relative gap to it. Returns None if no choice
+    fits the budget. """
+    if not arrays.has_choices():
+        return None
+    cheapest = arrays.component_argmin(arrays.costs, arrays.weights)
+    if arrays.costs[cheapest].sum() > budget:
+        return None
+
+    lower_bound, lagrangian_choice = _lagrangian(arrays, budget)
+    lower_bound += _group_penalty_bound(arrays, alpha)
+
+    starts = [cheapest]
+    if lagrangian_choice is not None:
+        starts.append(lagrangian_choice)
+    if initial is not None and arrays.costs[initial].sum() <= budget:
+        starts.append(np.asarray(initial))
+
+    best, best_objective = None, np.inf
+    for start in starts:
+        choice = _local_search(arrays, budget, alpha, _greedy(arrays, budget, alpha, start.copy()))
+        objective = arrays.terms(choice, alpha)[2]
+        if objective < best_objective:
+            best, best_objective = choice, objective
+
+    apx_risk, penalty, objective = arrays.terms(best, alpha)
+    lower_bound = min(lower_bound, objective)
+    gap = (objective - lower_bound) / objective if objective > 0 else 0.0
+    return HeuristicSolution(best, objective, apx_risk, penalty, float(arrays.costs[best].sum()), lower_bound, gap)
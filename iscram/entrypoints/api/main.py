@@ -1,16 +1,22 @@
-from typing import Dict, Optional
+from typing import Dict, List, Optional
+import asyncio
+import os
+import tempfile
 
 import uvicorn
 from pydantic import BaseModel
 
-from fastapi import FastAPI, Body, Request
+from fastapi import FastAPI, Body, Request, Query, HTTPException
 from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 
-from iscram.domain.model import SystemGraph, DataValidationError
-from iscram.domain.optimization import OptimizationError
+from iscram.domain.model import SystemGraph, Edge, DataValidationError
+from iscram.domain.optimization import OptimizationError, validate_params
 from iscram.service_layer import services
+from iscram.service_layer.jobs import JobQueue, JobLookupError, JobQueueFullError, DONE, FAILED
+from iscram.domain.metrics.bdd_pool import bdd_manager_pool
 from iscram.adapters.repository import LRUCacheRepository, RepositoryLookupError
+from iscram.adapters.artifact_store import DiskArtifactStore
 
 app = FastAPI(
     title="ISCRAM: IoT Supply Chain Risk Analysis and Mitigation Tool (Server)",
@@ -29,6 +35,26 @@ app.add_middleware(
 
 repo = LRUCacheRepository()
 
+# Compiled BDDs outlive repository evictions and server restarts.
+ARTIFACT_DIRECTORY = os.environ.get("ISCRAM_ARTIFACT_DIRECTORY",
+                                    os.path.join(tempfile.gettempdir(), "iscram", "bdd"))
+ARTIFACT_MAX_BYTES = int(os.environ.get("ISCRAM_ARTIFACT_MAX_BYTES", 2**28))
+bdd_manager_pool.artifact_store = DiskArtifactStore(ARTIFACT_DIRECTORY, ARTIFACT_MAX_BYTES)
+
+# Optimizations run as jobs on a bounded pool of worker threads, off the event loop.
+JOB_WORKERS = int(os.environ.get("ISCRAM_JOB_WORKERS", 2))
+JOB_MAX_PENDING = int(os.environ.get("ISCRAM_JOB_MAX_PENDING", 32))
+jobs = JobQueue(max_workers=JOB_WORKERS, max_pending=JOB_MAX_PENDING)
+
+# Sweeps are solved while the request waits, so their grid of budgets and alphas is bounded.
+SWEEP_MAX_POINTS = int(os.environ.get("ISCRAM_SWEEP_MAX_POINTS", 256))
+# Assignments are scored while the request waits, so their number is bounded too.
+MAX_ASSIGNMENTS = int(os.environ.get("ISCRAM_MAX_ASSIGNMENTS", 2**16))
+# Cutset searches are bounded by the number of cutsets returned.
+MAX_CUTSETS = int(os.environ.get("ISCRAM_MAX_CUTSETS", 10000))
+# Uncertainty samples are drawn and evaluated while the request waits.
+MAX_UNCERTAINTY_SAMPLES = int(os.environ.get("ISCRAM_MAX_UNCERTAINTY_SAMPLES", 10**6))
+
 
 class SystemGraphRequest(BaseModel):
     system_graph: SystemGraph
@@ -39,6 +65,10 @@ class RequestBody(BaseModel):
     preferences: Optional[Dict]
 
 
+class AssignmentsRequestBody(RequestBody):
+    assignments: List[List[Edge]]
+
+
 class AnalysisResponseBody(BaseModel):
     name: str
     payload: Dict
@@ -53,6 +83,12 @@ class OptimizationResponseBody(BaseModel):
     system_graph: Dict
 
 
+class JobResponseBody(BaseModel):
+    job_id: str
+    status: str
+    error: Optional[str]
+
+
 @app.exception_handler(DataValidationError)
 async def data_validation_error_handler(request: Request, exc: DataValidationError):
     error = dict(msg=exc.message, type="Data Validation Error")
@@ -80,6 +116,43 @@ async def repository_lookup_error_handler(request: Request, exc: RepositoryLooku
     )
 
 
+@app.exception_handler(JobLookupError)
+async def job_lookup_error_handler(request: Request, exc: JobLookupError):
+    error = dict(msg=exc.message, type="JobLookupError")
+    return JSONResponse(
+        status_code=404,
+        content=dict(error=error)
+    )
+
+
+@app.exception_handler(JobQueueFullError)
+async def job_queue_full_error_handler(request: Request, exc: JobQueueFullError):
+    error = dict(msg=exc.message, type="JobQueueFullError")
+    return JSONResponse(
+        status_code=503,
+        content=dict(error=error)
+    )
+
+
+@app.on_event("shutdown")
+def shutdown_jobs():
+    jobs.shutdown(wait=False)
+
+
+def optimization_params(**params) -> Dict:
+    """ The params of a supplier optimization, checked before anything is solved. """
+    try:
+        validate_params(params)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return params
+
+
+def optimization_response(updated: SystemGraph):
+    services.put_system_graph(updated, repo)
+    return dict(sg_id=updated.get_id(), system_graph=updated.dict())
+
+
 @app.post("/id")
 async def get_id(rq: SystemGraphRequest = Body(...)):
     services.put_system_graph(rq.system_graph, repo)
@@ -93,6 +166,39 @@ async def system_risk(sg_id: str, data_source: Optional[str] = None, rq: Request
     return dict(name="system_risk", payload=services.get_risk(sg, rq.data), data_source=data_source)
 
 
+@app.post("/id/{sg_id}/analyze/system/risk/uncertainty", response_model=AnalysisResponseBody)
+def system_risk_uncertainty(sg_id: str, samples: int = Query(10000, gt=0, le=MAX_UNCERTAINTY_SAMPLES),
+                            seed: Optional[int] = None, data_source: Optional[str] = None,
+                            rq: RequestBody = Body(...)):
+    sg = services.get_system_graph(sg_id, repo)
+    payload = services.get_risk_uncertainty(sg, rq.data, n_samples=samples, seed=seed)
+    return dict(name="system_risk_uncertainty", payload=payload, data_source=data_source)
+
+
+@app.post("/id/{sg_id}/analyze/system/risk/structural", response_model=AnalysisResponseBody)
+async def system_risk_structural(sg_id: str, data_source: Optional[str] = None, rq: RequestBody = Body(...)):
+    sg = services.get_system_graph(sg_id, repo)
+    return dict(name="system_risk_structural", payload=services.get_structural_uncertainty(sg, rq.data), data_source=data_source)
+
+
+@app.post("/id/{sg_id}/analyze/system/cutsets/top", response_model=AnalysisResponseBody)
+def system_cutsets_top(sg_id: str, k: int = Query(..., gt=0, le=MAX_CUTSETS),
+                       max_order: Optional[int] = Query(None, gt=0), data_source: Optional[str] = None,
+                       rq: RequestBody = Body(...)):
+    sg = services.get_system_graph(sg_id, repo)
+    return dict(name="system_cutsets_top", payload=services.get_top_cutsets(sg, rq.data, k, max_order), data_source=data_source)
+
+
+@app.post("/id/{sg_id}/analyze/system/cutsets/order", response_model=AnalysisResponseBody)
+def system_cutsets_order(sg_id: str, max_order: int = Query(..., gt=0)):
+    sg = services.get_system_graph(sg_id, repo)
+    try:
+        payload = services.get_cutsets_up_to_order(sg, max_order, limit=MAX_CUTSETS)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return dict(name="system_cutsets_order", payload=payload)
+
+
 @app.post("/id/{sg_id}/analyze/node/risk")
 async def node_risk(sg_id: str, data_source: str,  node_id: str, rq: RequestBody = Body(...)):
     # service for risk at this node (e.g., not at indicator, new bdd, etc).
@@ -135,12 +241,77 @@ async def attribute_importance_fractional(sg_id: str, rq: RequestBody = Body(...
         return dict(name="attribute_importance_fractional", payload=services.get_fractional_importance_traits(sg, rq.data), attribute=attribute, value=value)
 
 
+@app.post("/id/{sg_id}/analyze/supplier/assignments", response_model=AnalysisResponseBody)
+def supplier_assignments(sg_id: str, data_source: Optional[str] = None, rq: AssignmentsRequestBody = Body(...)):
+    if len(rq.assignments) > MAX_ASSIGNMENTS:
+        raise HTTPException(status_code=422, detail="Too many assignments: {}, at most {}.".format(
+            len(rq.assignments), MAX_ASSIGNMENTS))
+    sg = services.get_system_graph(sg_id, repo)
+    payload = services.get_assignment_scores(sg, rq.data, rq.assignments)
+    return dict(name="supplier_assignments", payload=payload, data_source=data_source)
+
+
 @app.post("/id/{sg_id}/recommend/component/supplier", response_model=OptimizationResponseBody)
-async def recommend_node_supplier(sg_id: str, alpha: float, budget: int, rq: RequestBody = Body(...)):
+async def recommend_node_supplier(sg_id: str, alpha: float, budget: int, solver: str = "couenne", refine: bool = False,
+                                  decompose: bool = False, fallback_solver: str = "couenne",
+                                  rq: RequestBody = Body(...)):
+    params = optimization_params(alpha=alpha, budget=budget, solver=solver, refine=refine, decompose=decompose,
+                                 fallback_solver=fallback_solver)
     sg = services.get_system_graph(sg_id, repo)
-    updated = services.get_system_graph_optimized_suppliers(sg, rq.data, {"alpha": alpha, "budget": budget})
-    services.put_system_graph(updated, repo)
-    return dict(sg_id=updated.get_id(), system_graph=updated.dict())
+    job = services.submit_optimized_suppliers(sg, rq.data, params, jobs)
+    # Shielded: a dropped request must not cancel a job that other requests may share.
+    updated = await asyncio.shield(asyncio.wrap_future(job.future))
+    return optimization_response(updated)
+
+
+@app.post("/id/{sg_id}/recommend/component/supplier/jobs", response_model=JobResponseBody, status_code=202)
+async def submit_recommend_node_supplier(sg_id: str, alpha: float, budget: int, solver: str = "couenne",
+                                         refine: bool = False, decompose: bool = False,
+                                         fallback_solver: str = "couenne", rq: RequestBody = Body(...)):
+    params = optimization_params(alpha=alpha, budget=budget, solver=solver, refine=refine, decompose=decompose,
+                                 fallback_solver=fallback_solver)
+    sg = services.get_system_graph(sg_id, repo)
+    return services.submit_optimized_suppliers(sg, rq.data, params, jobs).info()
+
+
+@app.get("/jobs/{job_id}", response_model=JobResponseBody)
+async def job_status(job_id: str):
+    return jobs.get(job_id).info()
+
+
+@app.delete("/jobs/{job_id}", response_model=JobResponseBody)
+async def cancel_job(job_id: str):
+    if not jobs.cancel(job_id):
+        raise HTTPException(status_code=409, detail="Only queued jobs can be cancelled.")
+    return jobs.get(job_id).info()
+
+
+@app.get("/jobs/{job_id}/result", response_model=OptimizationResponseBody)
+async def job_result(job_id: str):
+    job = jobs.get(job_id)
+    status = job.status
+    if status == FAILED:
+        error = dict(msg=job.info()["error"], type=type(job.future.exception()).__name__)
+        return JSONResponse(status_code=400, content=dict(error=error))
+    if status != DONE:
+        raise HTTPException(status_code=409, detail="Job is {}.".format(status))
+    return optimization_response(job.future.result())
+
+
+@app.post("/id/{sg_id}/recommend/component/supplier/sweep", response_model=AnalysisResponseBody)
+def recommend_node_supplier_sweep(sg_id: str, budget_min: int, budget_max: int, budget_step: int = 1,
+                                  alphas: List[float] = Query(...), solver: str = "couenne",
+                                  rq: RequestBody = Body(...)):
+    if budget_step <= 0 or budget_min > budget_max:
+        raise HTTPException(status_code=422, detail="Invalid budget range.")
+    budgets = range(budget_min, budget_max + 1, budget_step)
+    if len(budgets) * len(alphas) > SWEEP_MAX_POINTS:
+        raise HTTPException(status_code=422, detail="Sweep grid too large: {} points, at most {}.".format(
+            len(budgets) * len(alphas), SWEEP_MAX_POINTS))
+    params = optimization_params(budget=budget_min, alpha=alphas[0], solver=solver)
+    sg = services.get_system_graph(sg_id, repo)
+    payload = services.get_supplier_choice_sweep(sg, rq.data, budgets, alphas, params={"solver": params["solver"]})
+    return dict(name="supplier_choice_sweep", payload=payload)
 
 
 @app.get("/status")
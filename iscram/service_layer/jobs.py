@@ -0,0 +1,99 @@
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Dict, Hashable
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+class JobLookupError(Exception):
+    def __init__(self, message):
+        self.message = message
+
+
+class JobQueueFullError(Exception):
+    def __init__(self, message):
+        self.message = message
+
+
+class Job:
+    def __init__(self, job_id: str, key: Hashable, future: Future):
+        self.job_id = job_id
+        self.key = key
+        self.future = future
+
+    @property
+    def status(self) -> str:
+        if self.future.cancelled():
+            return CANCELLED
+        if not self.future.done():
+            return RUNNING if self.future.running() else QUEUED
+        return FAILED if self.future.exception() is not None else DONE
+
+    def info(self) -> Dict:
+        info = {"job_id": self.job_id, "status": self.status}
+        if info["status"] == FAILED:
+            error = self.future.exception()
+            info["error"] = getattr(error, "message", str(error))
+        return info
+
+
+class JobQueue:
+    """ Runs jobs on a bounded pool of worker threads, so that long computations (e.g. solves, which run external
+    solvers or their own process pools) do not block the caller. Jobs are deduplicated by key: submitting the key of
+    a job that is queued, running or done returns that job instead of a new one, while failed or cancelled jobs are
+    replaced. At most max_pending jobs are queued or running at once. Finished jobs are kept for lookup up to
+    history jobs in total, the least recently submitted or looked up being dropped first. """
+
+    def __init__(self, max_workers=2, max_pending=32, history=256):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.history = history
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="iscram-job")
+        self._jobs = OrderedDict()
+        self._job_of_key = {}
+        self._lock = threading.Lock()
+
+    def submit(self, key: Hashable, fn, *args, **kwargs) -> Job:
+        with self._lock:
+            job = self._jobs.get(self._job_of_key.get(key))
+            if job is not None and job.status not in (FAILED, CANCELLED):
+                self._jobs.move_to_end(job.job_id)
+                return job
+            if sum(not j.future.done() for j in self._jobs.values()) >= self.max_pending:
+                raise JobQueueFullError("Too many pending jobs: {}".format(self.max_pending))
+
+            job = Job(uuid.uuid4().hex, key, self._executor.submit(fn, *args, **kwargs))
+            self._jobs[job.job_id] = job
+            self._job_of_key[key] = job.job_id
+            self._evict()
+            return job
+
+    def _evict(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.future.done()]
+        for job_id in finished[:max(len(self._jobs) - self.history, 0)]:
+            job = self._jobs.pop(job_id)
+            if self._job_of_key.get(job.key) == job_id:
+                del self._job_of_key[job.key]
+
+    def get(self, job_id: str) -> Job:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                raise JobLookupError("Job not found: {}".format(job_id))
+            self._jobs.move_to_end(job_id)
+            return job
+
+    def cancel(self, job_id: str) -> bool:
+        """ Cancels a queued job. Running jobs run to the end; returns whether the job is cancelled. """
+        job = self.get(job_id)
+        job.future.cancel()
+        return job.status == CANCELLED
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait, cancel_futures=True)
@@ -1,18 +1,36 @@
-from typing import Dict
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, List, Sequence, Tuple
 
-from iscram.domain.model import SystemGraph, validate_data
-from iscram.domain.optimization import SupplierChoiceProblem
+import numpy as np
+
+from iscram.domain.model import SystemGraph, Edge, validate_data, get_data_id
+from iscram.domain.optimization import SupplierChoiceProblem, sweep_supplier_choices, validate_params
 from iscram.adapters.repository import AbstractRepository
-from iscram.domain.metrics.risk import risk_by_bdd
+from iscram.service_layer.jobs import Job, JobQueue
+from iscram.domain.metrics.risk import (
+    risk_by_compiled_bdd, risk_by_compiled_bdd_batch, risk_by_bdd_with_uncertain_edges
+)
 from iscram.domain.metrics.importance import (
-    birnbaum_importance, birnbaum_structural_importance, fractional_importance_of_attributes
+    birnbaum_importance, birnbaum_importance_compiled, birnbaum_structural_importance,
+    fractional_importance_of_attributes, edge_existence_importance
 )
 from iscram.domain.metrics.probability_providers import (
-    provide_p_unknown_data, provide_p_direct_from_data
+    provide_p_unknown_data, provide_p_direct_from_data, provide_p_matrix_from_data, provide_p_samples_from_data,
+    provide_p_bounds_from_data, provide_edge_existence_from_data
 )
+from iscram.domain.metrics.bdd_functions import build_bdd
+from iscram.domain.metrics.cutset import top_k_minimal_cutsets, minimal_cutsets_up_to_order
 from iscram.domain.metrics.scale import apply_scaling
 
 
+UNCERTAINTY_SAMPLE_CHUNK = 4096
+OPTIMIZATION_PROCESSES = os.cpu_count() or 1
+SUPPLIER_CHOICE_PROBLEM_CACHE_SIZE = 8
+UNCERTAIN_EDGE_BDD_CACHE_SIZE = 8
+
 DEFAULT_PREFERENCES = {
     "SCALE_METRICS": "MIN_MAX",
     "RISK_SOURCE": "KNOWN"
@@ -37,29 +55,140 @@ def put_system_graph(sg: SystemGraph, repo: AbstractRepository):
 
 
 def get_risk(sg: SystemGraph, data: Dict, prefs=None) -> Dict[str, float]:
-    bdd_with_root = sg.get_bdd_with_root()
+    compiled = sg.get_compiled_bdd()
     validate_data(sg, data)
     p = provide_p_direct_from_data(sg, data)
-    risk = risk_by_bdd(sg, p, bdd_with_root=bdd_with_root)
+    risk = risk_by_compiled_bdd(sg, p, compiled=compiled)
     return {"system" : risk}
 
 
+def get_risk_batch(sg: SystemGraph, data_list: List[Dict], prefs=None) -> Dict[str, List[float]]:
+    """ System risk for each data set in data_list, all evaluated in a single BDD traversal. """
+    compiled = sg.get_compiled_bdd()
+    for data in data_list:
+        validate_data(sg, data)
+    variables = sorted(sg.nodes)
+    p_matrix = provide_p_matrix_from_data(sg, data_list, variables)
+    risks = risk_by_compiled_bdd_batch(sg, p_matrix, variables, compiled=compiled)
+    return {"system": risks.tolist()}
+
+
+def get_risk_uncertainty(sg: SystemGraph, data: Dict, n_samples: int = 10000,
+                         quantiles: Sequence[float] = (0.05, 0.25, 0.5, 0.75, 0.95), bins: int = 20, seed=None,
+                         prefs=None) -> Dict:
+    """ Distribution of system risk when node risks carry a risk_distribution (beta, uniform or triangular).
+    Sampled probability vectors are evaluated in vectorized passes over the compiled BDD. As risk is monotone in
+    each node probability, the exact minimum and maximum are the risks at the lowest and highest node values. """
+    compiled = sg.get_compiled_bdd()
+    validate_data(sg, data)
+    rng = np.random.default_rng(seed)
+    variables = compiled.variables
+
+    risks = []
+    for start in range(0, n_samples, UNCERTAINTY_SAMPLE_CHUNK):
+        n = min(UNCERTAINTY_SAMPLE_CHUNK, n_samples - start)
+        p_matrix = provide_p_samples_from_data(sg, data, variables, n, rng)
+        risks.append(risk_by_compiled_bdd_batch(sg, p_matrix, variables, compiled=compiled))
+    risks = np.concatenate(risks) if risks else np.zeros(0)
+
+    low, high = provide_p_bounds_from_data(sg, data)
+    counts, edges = np.histogram(risks, bins=bins)
+    return {
+        "mean": float(risks.mean()) if len(risks) else None,
+        "std": float(risks.std()) if len(risks) else None,
+        "quantiles": {str(q): float(np.quantile(risks, q)) for q in quantiles} if len(risks) else {},
+        "histogram": {"counts": counts.tolist(), "edges": edges.tolist()},
+        "bounds": {"min": risk_by_compiled_bdd(sg, low, compiled=compiled),
+                   "max": risk_by_compiled_bdd(sg, high, compiled=compiled)}
+    }
+
+
+_uncertain_edge_bdds = OrderedDict()
+_uncertain_edge_bdds_lock = threading.Lock()
+
+
+@contextmanager
+def locked_uncertain_edge_bdd(sg: SystemGraph, uncertain_edges):
+    """ The BDD of sg with the uncertain (src, dst) edges as variables (see build_bdd), built once and kept in a
+    small LRU cache, as the graph's own BDD is kept by the manager pool. Yields (bdd, root) while holding the lock of
+    the cached BDD, since CUDD managers are not thread safe and requests may share it. """
+    key = (sg.get_id(), frozenset(uncertain_edges))
+    with _uncertain_edge_bdds_lock:
+        cached = _uncertain_edge_bdds.get(key)
+        if cached is not None:
+            _uncertain_edge_bdds.move_to_end(key)
+
+    if cached is None:
+        cached = (build_bdd(sg, uncertain_edges=key[1]), threading.Lock())
+        with _uncertain_edge_bdds_lock:
+            cached = _uncertain_edge_bdds.setdefault(key, cached)
+            _uncertain_edge_bdds.move_to_end(key)
+            if len(_uncertain_edge_bdds) > UNCERTAIN_EDGE_BDD_CACHE_SIZE:
+                _uncertain_edge_bdds.popitem(last=False)
+
+    bdd_with_root, lock = cached
+    with lock:
+        yield bdd_with_root
+
+
+def get_structural_uncertainty(sg: SystemGraph, data: Dict, prefs=None) -> Dict:
+    """ Expected system risk when edges in data carry an existence probability, and the contribution of each
+    uncertain edge: its importance (risk if present minus risk if absent) and the risk in either case. """
+    validate_data(sg, data)
+    p = provide_p_direct_from_data(sg, data)
+    existence = provide_edge_existence_from_data(sg, data)
+    locked_bdd = locked_uncertain_edge_bdd(sg, existence.keys()) if existence else sg.locked_bdd()
+    with locked_bdd as bdd_with_root:
+        risk = risk_by_bdd_with_uncertain_edges(sg, p, existence, bdd_with_root)
+        importances = edge_existence_importance(sg, p, existence, bdd_with_root)
+
+    edges = []
+    for (src, dst), q in existence.items():
+        importance = importances[(src, dst)]
+        edges.append({
+            "src": src,
+            "dst": dst,
+            "existence": q,
+            "importance": importance,
+            "risk_if_present": risk + (1 - q) * importance,
+            "risk_if_absent": risk - q * importance
+        })
+    edges.sort(key=lambda e: -abs(e["importance"]))
+    return {"system": risk, "edges": edges}
+
+
+def get_top_cutsets(sg: SystemGraph, data: Dict, k: int, max_order: int = None, prefs=None) -> Dict[str, List[Dict]]:
+    """ The k most probable minimal cutsets, most probable first. """
+    validate_data(sg, data)
+    p = provide_p_direct_from_data(sg, data)
+    top = top_k_minimal_cutsets(sg, p, k, max_order)
+    return {"cutsets": [{"nodes": sorted(cutset), "probability": prob} for cutset, prob in top]}
+
+
+def get_cutsets_up_to_order(sg: SystemGraph, max_order: int, prefs=None, limit=None) -> Dict[str, List[Dict]]:
+    """ All minimal cutsets with at most max_order nodes, smallest first. Raises ValueError if there are more than
+    limit of them. """
+    cutsets = sorted((sorted(cutset) for cutset in minimal_cutsets_up_to_order(sg, max_order, limit=limit)),
+                     key=lambda c: (len(c), c))
+    return {"cutsets": [{"nodes": cutset} for cutset in cutsets]}
+
+
 def get_birnbaum_structural_importances(sg: SystemGraph, data=None, prefs=None) -> Dict[str, float]:
     prefs = apply_prefs(prefs)
-    bdd_with_root = sg.get_bdd_with_root()
-    result = birnbaum_structural_importance(sg, bdd_with_root=bdd_with_root)
+    with sg.locked_bdd() as bdd_with_root:
+        result = birnbaum_structural_importance(sg, bdd_with_root=bdd_with_root)
     return apply_scaling(result, prefs["SCALE_METRICS"])
 
 
 def get_birnbaum_importances(sg: SystemGraph, data: Dict, data_src: str, prefs=None) -> Dict[str, float]:
     prefs = apply_prefs(prefs)
-    bdd_with_root = sg.get_bdd_with_root()
+    compiled = sg.get_compiled_bdd()
     if data_src == "data":
         p = provide_p_direct_from_data(sg, data)
     else:
         p = provide_p_unknown_data(sg)
 
-    result = birnbaum_importance(sg, p, bdd_with_root=bdd_with_root)
+    result = birnbaum_importance_compiled(sg, p, compiled=compiled)
     return apply_scaling(result, prefs["SCALE_METRICS"])
 
 
@@ -81,12 +210,12 @@ def get_birnbaum_importances_select(sg: SystemGraph, data: Dict, selector: Dict,
         if select_key in attrs and attrs[select_key] == select_value:
             select.append(node)
 
-    bdd_with_root = sg.get_bdd_with_root()
     if data_src == "data":
         p = provide_p_direct_from_data(sg, data)
     else:
         p = provide_p_unknown_data(sg)
-    result = birnbaum_importance(sg, p, bdd_with_root=bdd_with_root, select=select)
+    with sg.locked_bdd() as bdd_with_root:
+        result = birnbaum_importance(sg, p, bdd_with_root=bdd_with_root, select=select)
 
     return {select_key: {select_value: result["select"]}}
 
@@ -109,7 +238,80 @@ def get_fractional_importance_traits(sg: SystemGraph, data: Dict, prefs=None) ->
     return fractional_importance_of_attributes(sg, data)
 
 
-def get_system_graph_optimized_suppliers(sg: SystemGraph, data: Dict, params: Dict) -> SystemGraph:
+_supplier_choice_problems = OrderedDict()
+_supplier_choice_problems_lock = threading.Lock()
+
+
+def get_supplier_choice_problem(sg: SystemGraph, data: Dict) -> SupplierChoiceProblem:
+    """ The SupplierChoiceProblem for (sg, data), built once and kept in a small LRU cache, so that solving for other
+    budgets or alphas only updates the model's parameters. """
+    key = (sg.get_id(), get_data_id(data))
+    with _supplier_choice_problems_lock:
+        problem = _supplier_choice_problems.get(key)
+        if problem is not None:
+            _supplier_choice_problems.move_to_end(key)
+            return problem
+
     problem = SupplierChoiceProblem(sg, data)
-    chosen_suppliers, metadata = problem.solve(params)
-    return sg.with_suppliers(chosen_suppliers)
+    with _supplier_choice_problems_lock:
+        problem = _supplier_choice_problems.setdefault(key, problem)
+        _supplier_choice_problems.move_to_end(key)
+        if len(_supplier_choice_problems) > SUPPLIER_CHOICE_PROBLEM_CACHE_SIZE:
+            _supplier_choice_problems.popitem(last=False)
+    return problem
+
+
+def get_system_graph_optimized_suppliers(sg: SystemGraph, data: Dict, params: Dict, processes=None) -> SystemGraph:
+    return sg.with_suppliers(get_optimized_suppliers(sg, data, params, processes)[0])
+
+
+def get_optimized_suppliers(sg: SystemGraph, data: Dict, params: Dict, processes=None) -> Tuple[List[Edge], Dict]:
+    """ The supplier edges chosen by the optimization and its metadata. If params["refine"] is set, the solution is
+    refined on exact system risk (see SupplierChoiceProblem.refine) and the refinement's metadata is added.
+    Decomposed solves and refinement use a pool of processes. """
+    problem = get_supplier_choice_problem(sg, data)
+    processes = processes if processes is not None else OPTIMIZATION_PROCESSES
+    chosen_suppliers, metadata = problem.solve(params, processes)
+    if params.get("refine"):
+        chosen_suppliers, refined = problem.refine(chosen_suppliers, params, processes)
+        metadata = {**metadata, "refined": refined}
+    return chosen_suppliers, metadata
+
+
+def submit_optimized_suppliers(sg: SystemGraph, data: Dict, params: Dict, jobs: JobQueue) -> Job:
+    """ Submits the optimization of sg's suppliers (see get_system_graph_optimized_suppliers) as a job, whose result
+    is the optimized graph. Jobs are keyed by sg id, data id, budget and alpha (and the other params), so the same
+    optimization submitted again attaches to the existing job. Params are checked (see validate_params) before the
+    job is queued, and each job gets an equal share of the OPTIMIZATION_PROCESSES among the queue's workers. """
+    validate_params(params)
+    others = tuple(sorted((name, value) for name, value in params.items() if name not in ("budget", "alpha")))
+    key = (sg.get_id(), get_data_id(data), params["budget"], params["alpha"], others)
+    processes = max(1, OPTIMIZATION_PROCESSES // jobs.max_workers)
+    return jobs.submit(key, get_system_graph_optimized_suppliers, sg, data, params, processes)
+
+
+def get_supplier_choice_sweep(sg: SystemGraph, data: Dict, budgets: Sequence[int], alphas: Sequence[float],
+                              processes=None, params: Dict = None) -> Dict:
+    """ Risk-cost Pareto frontier of the supplier choices over a grid of budgets and alphas, with the chosen
+    supplier edges and solver metadata of each point. Other params (e.g. the solver) are passed to each solve. """
+    validate_data(sg, data)
+    processes = processes if processes is not None else min(OPTIMIZATION_PROCESSES, len(budgets) * len(alphas))
+    problem = get_supplier_choice_problem(sg, data) if processes == 1 else None
+    frontier = sweep_supplier_choices(sg, data, budgets, alphas, processes, problem, params)
+    return {"frontier": [{
+        "budget": point.budget,
+        "alpha": point.alpha,
+        "cost": point.cost,
+        "risk": point.risk,
+        "edges": [{"src": e.src, "dst": e.dst} for e in point.edges],
+        "metadata": point.metadata
+    } for point in frontier]}
+
+
+def get_assignment_scores(sg: SystemGraph, data: Dict, assignments: List[List[Edge]]) -> Dict:
+    """ Exact system risk and cost of each candidate supplier assignment of sg, scored together on one BDD over
+    all potential supplier edges instead of deriving a graph per assignment. """
+    validate_data(sg, data)
+    problem = get_supplier_choice_problem(sg, data)
+    risks, costs = problem.evaluate(assignments)
+    return {"assignments": [{"risk": float(risk), "cost": float(cost)} for risk, cost in zip(risks, costs)]}
@@ -1,9 +1,15 @@
 import pytest
 from importlib.resources import read_text
+from itertools import product
+from types import SimpleNamespace
 from typing import Dict
 import json
 
-from iscram.domain.model import SystemGraph
+import numpy as np
+
+from iscram.domain.model import SystemGraph, Edge
+from iscram.domain.metrics.risk import risk_by_bdd
+from iscram.domain.metrics.probability_providers import provide_p_direct_from_data
 
 
 def get_sg_from_file(filename: str) -> SystemGraph:
@@ -57,3 +63,78 @@ def full_with_supplier_choices_data():
     return get_data_from_file("full_with_supplier_choices_data.json")
 
 
+@pytest.fixture
+def supplier_chain():
+    sg = SystemGraph(**{
+        "nodes": {
+            "x1": {"tags": ["component"], "logic": {"component": "and"}},
+            "x2": {"tags": ["component"], "logic": {"component": "and"}},
+            "x3": {"tags": ["component"], "logic": {"component": "and"}},
+            "r": {"tags": ["supplier"]},
+            "m": {"tags": ["supplier"]},
+            "s1": {"tags": ["supplier"]},
+            "s2": {"tags": ["supplier"]},
+            "s3": {"tags": ["supplier"]},
+            "s4": {"tags": ["supplier"]},
+            "indicator": {"tags": ["indicator"], "logic": {"component": "or"}}
+        },
+        "edges": [
+            {"src": "x1", "dst": "x2"},
+            {"src": "x1", "dst": "x3"},
+            {"src": "x3", "dst": "indicator"},
+            {"src": "x2", "dst": "indicator"},
+            {"src": "r", "dst": "m"},
+            {"src": "m", "dst": "s1"},
+            {"src": "r", "dst": "s2"},
+            {"src": "s1", "dst": "x1"},
+            {"src": "s2", "dst": "x2"},
+            {"src": "s3", "dst": "x3"},
+            {"src": "s4", "dst": "x2", "tags": ["potential"]}
+        ]
+    })
+    data = {
+        "nodes": {
+            "x1": {"risk": 0.1}, "x2": {"risk": 0.2}, "x3": {"risk": 0.05}, "r": {"risk": 0.3}, "m": {"risk": 0.15},
+            "s1": {"risk": 0.1}, "s2": {"risk": 0.25}, "s3": {"risk": 0.05}, "s4": {"risk": 0.4}
+        },
+        "edges": [
+            {"src": "s4", "dst": "x1", "risk": 0.01, "cost": 3},
+            {"src": "s3", "dst": "x2", "cost": 2},
+            {"src": "s2", "dst": "x3", "risk": 0.3, "cost": 1},
+            {"src": "r", "dst": "x3", "risk": 0.02, "cost": 5}
+        ]
+    }
+    return sg, data
+
+
+def all_choices(problem):
+    return np.array(list(product(*problem.pairs_of_component)))
+
+
+def derived_risk(sg, data, pairs, choice):
+    updated = sg.with_suppliers([Edge(src=pairs[p][0], dst=pairs[p][1]) for p in choice])
+    return risk_by_bdd(updated, provide_p_direct_from_data(updated, data))
+
+
+def brute_force_objective(arrays, budget, alpha):
+    pairs_of_component = [np.flatnonzero(arrays.component == i) for i in range(arrays.n_components)]
+    best = np.inf
+    for choice in product(*pairs_of_component):
+        choice = np.array(choice)
+        if arrays.costs[choice].sum() <= budget:
+            best = min(best, arrays.terms(choice, alpha)[2])
+    return best
+
+
+def random_problem(rng):
+    n, m, k = rng.integers(2, 6), rng.integers(2, 5), rng.integers(1, 4)
+    pairs = sorted({(i, j) for i in range(n) for j in rng.choice(m, rng.integers(1, m + 1), replace=False)})
+    return SimpleNamespace(
+        N=n, M=m, K=k, pairs=pairs,
+        pair_risks=list(rng.random(len(pairs)) * 0.3),
+        pair_costs=list(rng.integers(0, 20, len(pairs)).astype(float)),
+        component_importances=list(rng.random(n)),
+        supplier_risks=list(rng.random(m) * 0.2),
+        supplier_groups=[sorted(rng.choice(m, rng.integers(1, m + 1), replace=False).tolist()) for _ in range(k)],
+        group_risks=list(rng.random(k))
+    )
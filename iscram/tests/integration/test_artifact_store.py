@@ -0,0 +1,59 @@
+import os
+
+from pytest import approx
+
+from iscram.domain.model import SystemGraph
+from iscram.domain.metrics import bdd_pool
+from iscram.domain.metrics.bdd_pool import BDDManagerPool
+from iscram.domain.metrics.bdd_functions import bdd_prob_iterative
+from iscram.domain.metrics.probability_providers import provide_p_unknown_data
+from iscram.adapters.artifact_store import DiskArtifactStore
+
+
+def test_put_get(tmp_path):
+    store = DiskArtifactStore(str(tmp_path))
+    store.put("a", {"rows": [[1, "x", 2, False, 2, True]]})
+    assert store.get("a") == {"rows": [[1, "x", 2, False, 2, True]]}
+    assert store.get("b") is None
+
+
+def test_unreadable_is_missing(tmp_path):
+    store = DiskArtifactStore(str(tmp_path))
+    with open(os.path.join(str(tmp_path), "a.json"), "w") as f:
+        f.write("{not json")
+    assert store.get("a") is None
+
+
+def test_cleanup_removes_least_recently_used(tmp_path):
+    store = DiskArtifactStore(str(tmp_path), max_bytes=2**20)
+    for key in ("a", "b", "c"):
+        store.put(key, {"payload": "x" * 1000})
+    os.utime(os.path.join(str(tmp_path), "a.json"), ns=(1, 1))
+    os.utime(os.path.join(str(tmp_path), "b.json"), ns=(2, 2))
+    store.get("a")
+
+    store.max_bytes = 2500
+    store.cleanup()
+    assert store.get("b") is None
+    assert store.get("a") is not None
+    assert store.get("c") is not None
+    assert store.size() <= 2500
+
+
+def test_pool_loads_from_store(tmp_path, canonical: SystemGraph, monkeypatch):
+    store = DiskArtifactStore(str(tmp_path))
+    p = provide_p_unknown_data(canonical)
+
+    first = BDDManagerPool()
+    first.artifact_store = store
+    expected = bdd_prob_iterative(*first.acquire(canonical), p)
+    expected_order = first.get_variable_order(canonical)
+
+    def no_build(*args, **kwargs):
+        raise AssertionError("BDD was rebuilt")
+
+    monkeypatch.setattr(bdd_pool, "build_bdd", no_build)
+    second = BDDManagerPool()
+    second.artifact_store = store
+    assert bdd_prob_iterative(*second.acquire(canonical), p) == approx(expected)
+    assert second.get_variable_order(canonical) == expected_order
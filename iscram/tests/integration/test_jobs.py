@@ -0,0 +1,68 @@
+import threading
+
+import pytest
+
+from iscram.service_layer.jobs import JobQueue, JobLookupError, JobQueueFullError, DONE, FAILED, CANCELLED, QUEUED
+
+
+def test_submit_dedupes_by_key():
+    jobs = JobQueue(max_workers=1)
+    calls = []
+
+    def work(x):
+        calls.append(x)
+        return x * 2
+
+    job = jobs.submit("a", work, 2)
+    assert job.future.result(timeout=10) == 4
+    assert jobs.submit("a", work, 2) is job
+    assert jobs.get(job.job_id).info() == {"job_id": job.job_id, "status": DONE}
+    assert calls == [2]
+    jobs.shutdown()
+
+
+def test_failed_job_is_replaced():
+    jobs = JobQueue(max_workers=1)
+
+    def fail():
+        raise ValueError("bad")
+
+    job = jobs.submit("a", fail)
+    with pytest.raises(ValueError):
+        job.future.result(timeout=10)
+    assert job.info() == {"job_id": job.job_id, "status": FAILED, "error": "bad"}
+    assert jobs.submit("a", lambda: 1) is not job
+    jobs.shutdown()
+
+
+def test_cancel_and_bounds():
+    jobs = JobQueue(max_workers=1, max_pending=2)
+    release = threading.Event()
+    running = jobs.submit("a", release.wait, 10)
+    queued = jobs.submit("b", lambda: 1)
+
+    assert queued.status == QUEUED
+    with pytest.raises(JobQueueFullError):
+        jobs.submit("c", lambda: 1)
+    assert jobs.cancel(queued.job_id)
+    assert queued.status == CANCELLED
+    assert not jobs.cancel(running.job_id)
+
+    release.set()
+    assert running.future.result(timeout=10)
+    with pytest.raises(JobLookupError):
+        jobs.get("missing")
+    jobs.shutdown()
+
+
+def test_history_drops_finished_jobs():
+    jobs = JobQueue(max_workers=1, history=2)
+    submitted = [jobs.submit(key, lambda: 1) for key in "abc"]
+    for job in submitted:
+        job.future.result(timeout=10)
+    jobs.submit("d", lambda: 1).future.result(timeout=10)
+
+    with pytest.raises(JobLookupError):
+        jobs.get(submitted[0].job_id)
+    assert jobs.get(submitted[2].job_id).status == DONE
+    jobs.shutdown()
@@ -56,4 +56,14 @@ def test_evicted_lru(minimal: SystemGraph, diamond: SystemGraph, full_example_sy
 def test_raise_error_on_absent_graph():
     repo = LRUCacheRepository()
     with pytest.raises(RepositoryLookupError):
-        repo.get("hi")
\ No newline at end of file
+        repo.get("hi")
+
+def test_eviction_releases_bdd(minimal: SystemGraph, diamond: SystemGraph):
+    tiny = LRUCacheRepository(1)
+    tiny.put(minimal)
+    minimal.get_bdd_with_root()
+    assert "_bdd_with_root" in minimal.__dict__
+
+    tiny.put(diamond)
+    assert "_bdd_with_root" not in minimal.__dict__
+    assert minimal.get_bdd_with_root() is not None
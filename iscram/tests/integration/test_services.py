@@ -1,9 +1,12 @@
+import json
 from typing import Dict
+import pytest
 from pytest import approx
 
-from iscram.domain.model import SystemGraph
+from iscram.domain.model import SystemGraph, DataValidationError
 from iscram.adapters.repository import FakeRepository
 from iscram.service_layer import services
+from iscram.service_layer.jobs import JobQueue
 from iscram.tests.conftest import get_sg_from_file
 
 
@@ -24,6 +27,140 @@ def test_get_birnbaum_importance(minimal: SystemGraph):
     assert len(b_imps) != 0
 
 
+def test_get_risk_batch(full_example_system: SystemGraph, full_example_data_1: Dict):
+    no_risk = {"nodes": {}}
+    data_list = [full_example_data_1, no_risk, full_example_data_1]
+    result = services.get_risk_batch(full_example_system, data_list)
+
+    expected = services.get_risk(full_example_system, full_example_data_1)["system"]
+    assert result["system"] == approx([expected, 0.0, expected])
+
+
+def test_get_risk_uncertainty_point_data(full_example_system: SystemGraph, full_example_data_1: Dict):
+    result = services.get_risk_uncertainty(full_example_system, full_example_data_1, n_samples=100, seed=0)
+    expected = services.get_risk(full_example_system, full_example_data_1)["system"]
+
+    assert result["mean"] == approx(expected)
+    assert result["bounds"] == approx({"min": expected, "max": expected})
+
+
+def test_get_risk_uncertainty(canonical: SystemGraph):
+    data = {"nodes": {
+        "x1": {"risk_distribution": {"type": "uniform", "low": 0.01, "high": 0.05}},
+        "x2": {"risk_distribution": {"type": "triangular", "low": 0.1, "mode": 0.2, "high": 0.4}},
+        "x5": {"risk_distribution": {"type": "beta", "alpha": 2, "beta": 20}},
+        "x6": {"risk": 0.3}
+    }}
+    result = services.get_risk_uncertainty(canonical, data, n_samples=5000, bins=10, seed=0)
+    quantiles = list(result["quantiles"].values())
+
+    assert quantiles == sorted(quantiles)
+    assert result["bounds"]["min"] <= quantiles[0] <= quantiles[-1] <= result["bounds"]["max"]
+    assert sum(result["histogram"]["counts"]) == 5000
+    assert len(result["histogram"]["edges"]) == 11
+
+    same_seed = services.get_risk_uncertainty(canonical, data, n_samples=5000, bins=10, seed=0)
+    assert same_seed["mean"] == result["mean"]
+
+
+def test_get_structural_uncertainty(full_example_system: SystemGraph, full_example_data_1: Dict):
+    certain = services.get_structural_uncertainty(full_example_system, full_example_data_1)
+    assert certain["system"] == approx(services.get_risk(full_example_system, full_example_data_1)["system"])
+    assert certain["edges"] == []
+
+    edge = full_example_system.edges[0]
+    data = {**full_example_data_1, "edges": [{"src": edge.src, "dst": edge.dst, "existence": 0.3}]}
+    result = services.get_structural_uncertainty(full_example_system, data)
+    contribution = result["edges"][0]
+
+    assert (contribution["src"], contribution["dst"]) == (edge.src, edge.dst)
+    assert result["system"] == approx(
+        0.3 * contribution["risk_if_present"] + 0.7 * contribution["risk_if_absent"])
+    assert contribution["risk_if_present"] == approx(certain["system"])
+
+
+def test_uncertain_edge_bdd_is_cached(full_example_system: SystemGraph):
+    edges = [(e.src, e.dst) for e in full_example_system.edges[:2]]
+    with services.locked_uncertain_edge_bdd(full_example_system, edges) as bdd_with_root:
+        pass
+    with services.locked_uncertain_edge_bdd(full_example_system, edges[::-1]) as same:
+        assert same is bdd_with_root
+    with services.locked_uncertain_edge_bdd(full_example_system, edges[:1]) as other:
+        assert other is not bdd_with_root
+
+
+def test_get_structural_uncertainty_invalid_existence(full_example_system: SystemGraph):
+    edge = full_example_system.edges[0]
+    data = {"edges": [{"src": edge.src, "dst": edge.dst, "existence": 1.5}]}
+    with pytest.raises(DataValidationError):
+        services.get_structural_uncertainty(full_example_system, data)
+
+
+def test_get_supplier_choice_problem_is_cached(full_with_supplier_choices: SystemGraph,
+                                              full_with_supplier_choices_data: Dict):
+    problem = services.get_supplier_choice_problem(full_with_supplier_choices, full_with_supplier_choices_data)
+    same_data = json.loads(json.dumps(full_with_supplier_choices_data))
+    assert services.get_supplier_choice_problem(full_with_supplier_choices, same_data) is problem
+
+    same_data["edges"][0]["risk"] = 0.99
+    assert services.get_supplier_choice_problem(full_with_supplier_choices, same_data) is not problem
+
+
+def test_get_optimized_suppliers_refined(full_with_supplier_choices: SystemGraph,
+                                         full_with_supplier_choices_data: Dict):
+    params = {"alpha": 0.01, "budget": 500, "solver": "heuristic", "refine": True}
+    edges, metadata = services.get_optimized_suppliers(full_with_supplier_choices, full_with_supplier_choices_data,
+                                                       params, processes=1)
+    assert len(edges) == len(full_with_supplier_choices.components)
+    assert metadata["refined"]["exact_risk"] <= metadata["refined"]["initial_exact_risk"]
+
+
+def test_submit_optimized_suppliers(full_with_supplier_choices: SystemGraph, full_with_supplier_choices_data: Dict):
+    jobs = JobQueue(max_workers=1)
+    params = {"alpha": 0.01, "budget": 500, "solver": "heuristic"}
+    job = services.submit_optimized_suppliers(full_with_supplier_choices, full_with_supplier_choices_data, params, jobs)
+    same_data = json.loads(json.dumps(full_with_supplier_choices_data))
+
+    assert services.submit_optimized_suppliers(full_with_supplier_choices, same_data, dict(params), jobs) is job
+    assert services.submit_optimized_suppliers(full_with_supplier_choices, same_data, {**params, "budget": 400},
+                                               jobs) is not job
+    for invalid in ({"solver": "unknown"}, {"solver": "exact", "decompose": True},
+                    {"solver": "couenne", "decompose": True}):
+        with pytest.raises(ValueError):
+            services.submit_optimized_suppliers(full_with_supplier_choices, same_data, {**params, **invalid}, jobs)
+    updated = job.future.result(timeout=60)
+    assert updated == services.get_system_graph_optimized_suppliers(full_with_supplier_choices,
+                                                                    full_with_supplier_choices_data, params)
+    jobs.shutdown()
+
+
+def test_get_assignment_scores(full_with_supplier_choices: SystemGraph, full_with_supplier_choices_data: Dict):
+    edges, _ = services.get_optimized_suppliers(full_with_supplier_choices, full_with_supplier_choices_data,
+                                                {"alpha": 0.01, "budget": 500, "solver": "heuristic"})
+    result = services.get_assignment_scores(full_with_supplier_choices, full_with_supplier_choices_data,
+                                            [edges, edges])
+    updated = full_with_supplier_choices.with_suppliers(edges)
+
+    assert len(result["assignments"]) == 2
+    assert result["assignments"][0]["risk"] == approx(
+        services.get_risk(updated, full_with_supplier_choices_data)["system"])
+
+
+def test_get_top_cutsets(full_example_system: SystemGraph, full_example_data_1: Dict):
+    result = services.get_top_cutsets(full_example_system, full_example_data_1, 5, max_order=2)
+    probabilities = [c["probability"] for c in result["cutsets"]]
+
+    assert len(result["cutsets"]) == 5
+    assert probabilities == sorted(probabilities, reverse=True)
+    assert all(len(c["nodes"]) <= 2 for c in result["cutsets"])
+
+
+def test_get_cutsets_up_to_order(canonical: SystemGraph):
+    result = services.get_cutsets_up_to_order(canonical, 2)
+    assert result["cutsets"][0] == {"nodes": ["x1"]}
+    assert len(result["cutsets"]) == 10
+
+
 def test_select_attribute_no_suppliers(minimal: SystemGraph):
     data = {"nodes": {}}
     result = services.get_birnbaum_importances_select(minimal, data, {"domestic": False}, "data")
@@ -1,11 +1,18 @@
 import dd.cudd as _bdd
 
+import json
+import timeit
 import pytest
+import numpy as np
 
 from iscram.domain.model import SystemGraph
 from iscram.domain.metrics.bdd_functions import (
-    build_bdd, bdd_prob, build_sg_graph_dict, recursive_build_expr
+    build_bdd, bdd_prob, bdd_prob_iterative, bdd_prob_batch, build_sg_graph_dict, recursive_build_expr,
+    bdd_birnbaum_importance, prep_for_bdd, dfs_orders, bdd_variable_order, ORDERING_STRATEGIES,
+    serialize_bdd, deserialize_bdd
 )
+from iscram.domain.metrics.probability_providers import provide_p_unknown_data
+from iscram.tests.conftest import get_sg_from_file
 
 
 def test_smoke_build_bdd(minimal: SystemGraph):
@@ -48,6 +55,90 @@ def test_recursive_build_expr_2(diamond_suppliers: SystemGraph):
     assert recursive_build_expr(diamond_suppliers, g, "indicator", []) == expected
 
 
+@pytest.mark.parametrize("filename", (
+                         "minimal.json", "diamond.json", "diamond_suppliers.json", "canonical.json",
+                         "full_example_system.json", "full_with_supplier_choices.json"
+                         ))
+def test_build_bdd_matches_expression(filename):
+    sg = get_sg_from_file(filename)
+    r_expr, discovered = prep_for_bdd(sg)
+    bdd, root = build_bdd(sg)
+
+    assert dfs_orders(build_sg_graph_dict(sg), "indicator")[0] == list(dict.fromkeys(discovered))
+    assert root == bdd.add_expr(r_expr)
+
+
+def test_build_bdd_shared_subgraphs():
+    # Each level depends on both nodes of the level below, so the expression string would double per level.
+    levels = 40
+    nodes = {"indicator": {"tags": ["indicator"], "logic": {"component": "and"}}}
+    edges = [{"src": "a" + str(levels), "dst": "indicator"}, {"src": "b" + str(levels), "dst": "indicator"}]
+    for i in range(1, levels + 1):
+        for name in ("a" + str(i), "b" + str(i)):
+            nodes[name] = {"tags": ["component"], "logic": {"component": "and" if name[0] == "a" else "or"}}
+            if i > 1:
+                edges.append({"src": "a" + str(i - 1), "dst": name})
+                edges.append({"src": "b" + str(i - 1), "dst": name})
+    sg = SystemGraph(nodes=nodes, edges=edges)
+
+    bdd, root = build_bdd(sg)
+    p = {n: 0.0 for n in nodes}
+    assert bdd_prob_iterative(bdd, root, p) == 0.0
+    p["a1"] = p["b1"] = 1.0
+    assert bdd_prob_iterative(bdd, root, p) == 1.0
+
+
+def test_build_bdd_skips_unreachable(diamond_suppliers: SystemGraph):
+    nodes = dict(diamond_suppliers.nodes)
+    nodes["orphan"] = nodes["x1"]
+    sg = SystemGraph(nodes=nodes, edges=diamond_suppliers.edges)
+
+    bdd, root = build_bdd(sg)
+    assert "orphan" not in bdd.vars
+
+
+@pytest.mark.parametrize("ordering", ORDERING_STRATEGIES)
+def test_build_bdd_orderings_agree(ordering, canonical: SystemGraph):
+    p = provide_p_unknown_data(canonical)
+    bdd, root = build_bdd(canonical, ordering=ordering)
+
+    assert bdd_prob_iterative(bdd, root, p) == pytest.approx(bdd_prob_iterative(*build_bdd(canonical), p))
+
+
+def test_build_bdd_unknown_ordering(minimal: SystemGraph):
+    with pytest.raises(ValueError):
+        build_bdd(minimal, ordering="RANDOM")
+
+
+def test_build_bdd_sifting_time_budget():
+    sg = get_sg_from_file("rand_system_graph_tree_500.json")
+    p = provide_p_unknown_data(sg)
+    bdd, root = build_bdd(sg, time_budget=0.05)
+
+    assert bdd.configure()["max_swaps"] == _bdd.BDD().configure()["max_swaps"]
+    assert bdd_prob_iterative(bdd, root, p) == pytest.approx(bdd_prob_iterative(*build_bdd(sg), p))
+
+
+def test_build_bdd_initial_order(canonical: SystemGraph):
+    order = list(reversed(bdd_variable_order(*build_bdd(canonical))))
+    bdd, root = build_bdd(canonical, initial_order=order)
+
+    assert bdd_variable_order(bdd, root) == order
+
+
+@pytest.mark.parametrize("r_expr", ("a & ~(b | c)", "~(a | c) & (b | ~c)", "TRUE", "FALSE"))
+def test_serialize_bdd_round_trip(r_expr):
+    bdd = _bdd.BDD()
+    bdd.declare("a", "b", "c")
+    f = bdd.add_expr(r_expr)
+    data = json.loads(json.dumps(serialize_bdd(bdd, f)))
+
+    other = _bdd.BDD()
+    other.declare("c", "b")
+    g = deserialize_bdd(other, data)
+    assert other.to_expr(g) == other.to_expr(other.add_expr(r_expr))
+
+
 def test_prob_ex_rauzy_1():
     vars = ["a", "c", "b"]
     r_expr = "(a | c) & (b | c)"
@@ -122,4 +213,82 @@ def test_prob_negated_edge_basic_2():
     r = bdd.add_expr(r_expr)
 
     x = {"a": 0.5, "b": 0.25, "c" : 0.125}
-    assert (bdd_prob(bdd, r, x, dict()) == 0.046875)
\ No newline at end of file
+    assert (bdd_prob(bdd, r, x, dict()) == 0.046875)
+
+
+@pytest.mark.parametrize("r_expr,x", (
+                         ("(a | c) & (b | c)", {"a": 0.5, "b": 0.5, "c": 0.5}),
+                         ("a & ~b", {"a": 0.5, "b": 0.25, "c": 0}),
+                         ("a & ~(b | ~c)", {"a": 0.5, "b": 0.25, "c": 0.125}),
+                         ("~(a | b | c)", {"a": 0.1, "b": 0.2, "c": 0.3}),
+                         ("TRUE", {}),
+                         ("FALSE", {})
+                         ))
+def test_prob_iterative_matches_recursive(r_expr, x):
+    bdd = _bdd.BDD()
+    bdd.declare('a', 'b', 'c')
+    r = bdd.add_expr(r_expr)
+
+    assert bdd_prob_iterative(bdd, r, x) == pytest.approx(bdd_prob(bdd, r, x, dict()))
+
+
+def test_prob_iterative_deep_chain():
+    # A conjunction of many variables gives a BDD with one level per variable, deeper than the recursion limit.
+    n = 5000
+    bdd = _bdd.BDD()
+    bdd.configure(reordering=False)
+    names = ["x" + str(i) for i in range(n)]
+    bdd.declare(*names)
+    r = bdd.true
+    for name in reversed(names):
+        r = bdd.var(name) & r
+
+    assert bdd_prob_iterative(bdd, r, {name: 1.0 for name in names}) == 1.0
+    assert bdd_prob_iterative(bdd, ~r, {name: 0.5 for name in names}) == 1.0
+
+
+def test_speed_bdd_prob_iterative_vs_recursive_rand_tree_500():
+    sg = get_sg_from_file("rand_system_graph_tree_500.json")
+    bdd, root = sg.get_bdd_with_root()
+    p = provide_p_unknown_data(sg)
+
+    assert bdd_prob_iterative(bdd, root, p) == pytest.approx(bdd_prob(bdd, root, p, dict()))
+
+    # best of a few repeats, so that a busy machine does not decide the comparison
+    recursive = min(timeit.repeat(lambda: bdd_prob(bdd, root, p, dict()), number=20, repeat=5))
+    iterative = min(timeit.repeat(lambda: bdd_prob_iterative(bdd, root, p), number=20, repeat=5))
+    assert iterative <= 2 * recursive
+
+
+def test_prob_batch_matches_scalar():
+    r_expr = "a & ~(b | ~c) | (b & c)"
+    bdd = _bdd.BDD()
+    bdd.declare('a', 'b', 'c')
+    r = bdd.add_expr(r_expr)
+
+    variables = ["c", "a", "b"]
+    p_matrix = np.random.default_rng(0).random((50, 3))
+    expected = [bdd_prob(bdd, r, dict(zip(variables, row)), dict()) for row in p_matrix]
+
+    assert bdd_prob_batch(bdd, r, p_matrix, variables) == pytest.approx(expected)
+    assert bdd_prob_batch(bdd, ~r, p_matrix, variables) == pytest.approx([1 - e for e in expected])
+
+
+def test_birnbaum_importance_negated_edges():
+    r_expr = "a & ~(b | ~c)"
+    bdd = _bdd.BDD()
+    bdd.declare('a', 'b', 'c')
+    r = bdd.add_expr(r_expr)
+
+    x = {"a": 0.5, "b": 0.25, "c": 0.125}
+    b_imps = bdd_birnbaum_importance(bdd, r, x)
+
+    for v in x:
+        high = bdd_prob(bdd, r, {**x, v: 1.0}, dict())
+        low = bdd_prob(bdd, r, {**x, v: 0.0}, dict())
+        assert b_imps[v] == pytest.approx(high - low)
+
+
+def test_birnbaum_importance_constant():
+    bdd = _bdd.BDD()
+    assert bdd_birnbaum_importance(bdd, bdd.true, {}) == {}
@@ -0,0 +1,189 @@
+import gc
+import threading
+
+import pytest
+from pytest import approx
+
+from iscram.domain import model
+from iscram.domain.model import SystemGraph, Edge
+from iscram.domain.metrics.bdd_pool import BDDManagerPool
+from iscram.domain.metrics.bdd_functions import bdd_prob_iterative, build_bdd, estimate_bdd_memory
+from iscram.domain.metrics.probability_providers import provide_p_unknown_data
+from iscram.tests.conftest import get_sg_from_file
+
+
+def test_related_graphs_share_manager(full_with_supplier_choices: SystemGraph):
+    pool = BDDManagerPool()
+    derived = full_with_supplier_choices.with_suppliers([Edge(src="x18", dst="x3")])
+    bdd_1, root_1 = pool.acquire(full_with_supplier_choices)
+    bdd_2, root_2 = pool.acquire(derived)
+
+    assert bdd_1 is bdd_2
+    assert root_1 != root_2
+    assert pool.statistics()["managers"] == 1
+
+
+def test_conflicting_graphs_use_separate_managers(minimal: SystemGraph, canonical: SystemGraph):
+    pool = BDDManagerPool()
+    bdd_1, root_1 = pool.acquire(minimal)
+    bdd_2, root_2 = pool.acquire(canonical)
+
+    assert bdd_1 is not bdd_2
+    assert pool.statistics()["managers"] == 2
+    assert bdd_prob_iterative(bdd_1, root_1, provide_p_unknown_data(minimal)) == 0.625
+
+
+def test_same_id_shares_root(minimal: SystemGraph):
+    pool = BDDManagerPool()
+    copy = get_sg_from_file("minimal.json")
+    _, root_1 = pool.acquire(minimal)
+    _, root_2 = pool.acquire(copy)
+    # acquiring twice with the same object holds one reference
+    pool.acquire(minimal)
+
+    assert root_1 == root_2
+    assert pool.statistics()["roots"] == 1
+    assert pool.statistics()["references"] == 2
+
+
+def test_release_drops_root_and_manager(minimal: SystemGraph):
+    pool = BDDManagerPool()
+    copy = get_sg_from_file("minimal.json")
+    pool.acquire(minimal)
+    pool.acquire(copy)
+
+    pool.release(minimal)
+    pool.release(minimal)
+    assert pool.statistics()["references"] == 1
+
+    pool.release(copy)
+    assert pool.statistics() == {
+        "managers": 0, "roots": 0, "references": 0, "reserved_memory": 0, "estimated_load": 0
+    }
+
+
+def test_release_on_garbage_collection():
+    pool = BDDManagerPool()
+    sg = get_sg_from_file("minimal.json")
+    pool.acquire(sg)
+    del sg
+    gc.collect()
+    assert pool.statistics()["roots"] == 0
+
+
+def test_memory_cap_forces_sharing(minimal: SystemGraph):
+    memory = estimate_bdd_memory(minimal)
+    pool = BDDManagerPool(max_memory=memory, manager_memory=memory)
+    graphs = [minimal] + [get_sg_from_file(name) for name in ("diamond.json", "canonical.json")]
+    for sg in graphs:
+        pool.acquire(sg)
+
+    assert pool.statistics()["managers"] == 1
+    assert pool.statistics()["reserved_memory"] == memory
+
+
+def test_manager_sized_to_graph():
+    sg = get_sg_from_file("rand_system_graph_tree_500.json")
+    pool = BDDManagerPool(manager_memory=1)
+    pool.acquire(sg)
+    assert pool.statistics()["reserved_memory"] == estimate_bdd_memory(sg)
+
+
+def test_pooled_root_matches_private_manager(canonical: SystemGraph):
+    pool = BDDManagerPool()
+    pool.acquire(get_sg_from_file("full_example_system.json"))
+    bdd, root = pool.acquire(canonical)
+    p = provide_p_unknown_data(canonical)
+
+    assert bdd_prob_iterative(bdd, root, p) == approx(bdd_prob_iterative(*build_bdd(canonical), p))
+
+
+def test_derived_graph_starts_from_parent_order(full_with_supplier_choices: SystemGraph, monkeypatch):
+    monkeypatch.setattr(model, "bdd_manager_pool", BDDManagerPool())
+    order = full_with_supplier_choices.get_variable_order()
+    derived = full_with_supplier_choices.with_suppliers([Edge(src="x18", dst="x3")])
+
+    assert derived._initial_variable_order == order
+    derived_order = derived.get_variable_order()
+    assert [v for v in derived_order if v in order] == [v for v in order if v in derived_order]
+
+
+def test_variable_order_follows_manager(full_with_supplier_choices: SystemGraph):
+    pool = BDDManagerPool()
+    derived = full_with_supplier_choices.with_suppliers([Edge(src="x18", dst="x3")])
+    bdd, root = pool.acquire(full_with_supplier_choices)
+    pool.acquire(derived)
+
+    order = pool.get_variable_order(full_with_supplier_choices)
+    others = sorted(set(bdd.vars) - set(order))
+    bdd.reorder({v: i for i, v in enumerate(order[::-1] + others)})
+    assert pool.get_variable_order(full_with_supplier_choices) == order[::-1]
+
+
+def test_build_outside_pool_lock(minimal: SystemGraph, canonical: SystemGraph, monkeypatch):
+    pool = BDDManagerPool()
+    pool.acquire(canonical)
+    started, release = threading.Event(), threading.Event()
+    builds = []
+    load_or_build = pool._load_or_build
+
+    def slow_load_or_build(*args):
+        builds.append(args[0])
+        started.set()
+        release.wait(10)
+        return load_or_build(*args)
+
+    monkeypatch.setattr(pool, "_load_or_build", slow_load_or_build)
+    copy = get_sg_from_file("minimal.json")
+    threads = [threading.Thread(target=pool.acquire, args=(sg,)) for sg in (minimal, copy)]
+    for thread in threads:
+        thread.start()
+    assert started.wait(10)
+    # other graphs are served while the root of minimal is built
+    assert pool.get_variable_order(canonical)
+    release.set()
+    for thread in threads:
+        thread.join(10)
+
+    assert builds == [minimal.get_id()]
+    assert pool.statistics()["references"] == 3
+    bdd, root = pool.acquire(minimal)
+    assert bdd_prob_iterative(bdd, root, provide_p_unknown_data(minimal)) == 0.625
+
+
+def test_failed_build_drops_reference(minimal: SystemGraph, monkeypatch):
+    pool = BDDManagerPool()
+
+    def failing_load_or_build(*args):
+        raise RuntimeError("build failed")
+
+    monkeypatch.setattr(pool, "_load_or_build", failing_load_or_build)
+    with pytest.raises(RuntimeError):
+        pool.acquire(minimal)
+    assert pool.statistics()["roots"] == 0
+    assert pool.statistics()["managers"] == 0
+
+    monkeypatch.undo()
+    pool.acquire(minimal)
+    assert pool.statistics()["references"] == 1
+
+
+def test_locked_serializes_graphs_of_a_manager(full_with_supplier_choices: SystemGraph):
+    pool = BDDManagerPool()
+    derived = full_with_supplier_choices.with_suppliers([Edge(src="x18", dst="x3")])
+    pool.acquire(full_with_supplier_choices)
+    pool.acquire(derived)
+    entered = threading.Event()
+
+    def use_derived():
+        with pool.locked(derived):
+            entered.set()
+
+    with pool.locked(full_with_supplier_choices) as (bdd, root):
+        thread = threading.Thread(target=use_derived)
+        thread.start()
+        assert not entered.wait(0.2)
+        # the lock is reentrant, e.g. for reading the order while holding it
+        assert pool.get_variable_order(full_with_supplier_choices)
+    thread.join(10)
+    assert entered.is_set()
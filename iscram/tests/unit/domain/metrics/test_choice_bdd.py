@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+from iscram.domain.optimization import SupplierChoiceProblem
+from iscram.domain.metrics.choice_bdd import ChoiceBDD, provide_p_with_choices_from_data
+from iscram.tests.conftest import all_choices, derived_risk
+
+
+def test_choice_bdd_matches_derived_graphs(supplier_chain):
+    sg, data = supplier_chain
+    problem = SupplierChoiceProblem(sg, data)
+    pairs = [(problem.map_index_supplier[j], problem.map_index_component[i]) for i, j in problem.pairs]
+    choice_bdd = ChoiceBDD(sg, pairs)
+    p_vector = choice_bdd.p_vector(provide_p_with_choices_from_data(sg, data, pairs))
+
+    choices = all_choices(problem)
+    selections = np.zeros((len(choices), len(pairs)), dtype=bool)
+    selections[np.arange(len(choices))[:, np.newaxis], choices] = True
+    risks = choice_bdd.risk_batch(p_vector, selections)
+
+    assert len(choices) == 18
+    for choice, risk in zip(choices, risks):
+        assert risk == pytest.approx(derived_risk(sg, data, pairs, choice), abs=1e-12)
+
+
+def test_choice_bdd_full_example(full_with_supplier_choices, full_with_supplier_choices_data):
+    problem = SupplierChoiceProblem(full_with_supplier_choices, full_with_supplier_choices_data)
+    pairs = [(problem.map_index_supplier[j], problem.map_index_component[i]) for i, j in problem.pairs]
+    choice_bdd = ChoiceBDD(full_with_supplier_choices, pairs)
+    p_vector = choice_bdd.p_vector(provide_p_with_choices_from_data(full_with_supplier_choices,
+                                                                    full_with_supplier_choices_data, pairs))
+
+    rng = np.random.default_rng(0)
+    choices = np.array([[rng.choice(c) for c in problem.pairs_of_component] for _ in range(10)])
+    selections = np.zeros((len(choices), len(pairs)), dtype=bool)
+    selections[np.arange(len(choices))[:, np.newaxis], choices] = True
+    risks = choice_bdd.risk_batch(p_vector, selections)
+
+    for choice, risk in zip(choices, risks):
+        expected = derived_risk(full_with_supplier_choices, full_with_supplier_choices_data, pairs, choice)
+        assert risk == pytest.approx(expected, abs=1e-12)
@@ -0,0 +1,64 @@
+import pickle
+
+import dd.cudd as _bdd
+import numpy as np
+import pytest
+
+from iscram.domain.model import SystemGraph
+from iscram.domain.metrics.bdd_functions import (
+    build_bdd, bdd_prob_iterative, bdd_prob_batch, bdd_birnbaum_importance
+)
+from iscram.domain.metrics.compiled_bdd import (
+    compile_bdd, compiled_prob, compiled_prob_batch, compiled_birnbaum_importance
+)
+from iscram.domain.metrics.risk import risk_by_bdd, risk_by_compiled_bdd
+from iscram.domain.metrics.importance import birnbaum_importance, birnbaum_importance_compiled
+from iscram.domain.metrics.probability_providers import provide_p_unknown_data
+from iscram.tests.conftest import get_sg_from_file
+
+
+@pytest.mark.parametrize("r_expr", ("a & ~(b | c)", "~(a | c) & (b | ~c)", "(a | c) & (b | c)", "TRUE", "FALSE"))
+def test_compiled_matches_bdd(r_expr):
+    bdd = _bdd.BDD()
+    bdd.declare("a", "b", "c")
+    f = bdd.add_expr(r_expr)
+    p = {"a": 0.2, "b": 0.7, "c": 0.4}
+    c = compile_bdd(bdd, f)
+
+    assert compiled_prob(c, p) == pytest.approx(bdd_prob_iterative(bdd, f, p))
+    assert compiled_birnbaum_importance(c, p) == pytest.approx(bdd_birnbaum_importance(bdd, f, p))
+
+
+def test_compiled_batch_matches_bdd(canonical: SystemGraph):
+    bdd, root = build_bdd(canonical)
+    c = compile_bdd(bdd, root)
+    variables = sorted(canonical.nodes)
+    p_matrix = np.random.default_rng(0).random((20, len(variables)))
+
+    np.testing.assert_allclose(compiled_prob_batch(c, p_matrix, variables),
+                               bdd_prob_batch(bdd, root, p_matrix, variables))
+
+
+def test_compiled_is_picklable():
+    sg = get_sg_from_file("rand_system_graph_tree_500.json")
+    p = provide_p_unknown_data(sg)
+    c = pickle.loads(pickle.dumps(sg.get_compiled_bdd()))
+
+    assert compiled_prob(c, p) == pytest.approx(risk_by_bdd(sg, p, sg.get_bdd_with_root()))
+
+
+def test_layers_cover_nodes_children_first(full_example_system: SystemGraph):
+    c = full_example_system.get_compiled_bdd()
+    seen = {0}
+    for layer in c.layers():
+        assert all(c.high[k] in seen and c.low[k] in seen for k in layer)
+        seen.update(layer.tolist())
+    assert seen == set(range(len(c)))
+
+
+def test_risk_and_importance_by_compiled(full_example_system: SystemGraph):
+    p = provide_p_unknown_data(full_example_system)
+
+    assert risk_by_compiled_bdd(full_example_system, p) == pytest.approx(risk_by_bdd(full_example_system, p))
+    assert birnbaum_importance_compiled(full_example_system, p) == pytest.approx(
+        birnbaum_importance(full_example_system, p))
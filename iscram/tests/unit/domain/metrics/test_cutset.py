@@ -1,10 +1,19 @@
+import math
+import random
+
 import pytest
 
+import dd.cudd as _bdd
+
 from iscram.domain.metrics.cutset import (
-    mocus, probability_union, minimize_cutsets, brute_force_bdd_cutsets
+    mocus, probability_union, minimize_cutsets, brute_force_bdd_cutsets, bdd_minimal_cutsets, count_minimal_cutsets,
+    minimal_solutions_bdd, minimal_solution_masks, masks_to_cutsets, top_k_minimal_cutsets,
+    minimal_cutsets_up_to_order, minimize_masks, masks_to_matrix, probability_any_cutset
 )
+from iscram.domain.metrics.probability_providers import provide_p_direct_from_data
 
 from iscram.domain.model import SystemGraph
+from iscram.tests.conftest import get_sg_from_file, get_data_from_file
 
 
 @pytest.mark.parametrize("x,expected", (
@@ -61,6 +70,30 @@ def test_minimize_cutsets():
     assert minimize_cutsets(non_minimal) == expected
 
 
+def test_minimize_masks():
+    rng = random.Random(0)
+    masks = [rng.getrandbits(12) & rng.getrandbits(12) for _ in range(300)]
+    expected = {m for m in masks if not any(x != m and x & m == x for x in masks)}
+
+    assert sorted(minimize_masks(masks)) == sorted(expected)
+
+
+def test_masks_to_matrix_wide():
+    matrix = masks_to_matrix([1 | 1 << 70, 1 << 99], 100)
+    assert matrix.shape == (2, 100)
+    assert set(matrix[0].nonzero()[0]) == {0, 70}
+    assert set(matrix[1].nonzero()[0]) == {99}
+
+
+def test_probability_any_cutset():
+    cutsets = [frozenset(["a", "b"]), frozenset(["c"]), frozenset(["b", "d", "e"])]
+    x = {"a": 0.3, "b": 0.5, "c": 0.1, "d": 0.9, "e": 0.2}
+    expected = probability_union([math.prod(x[i] for i in c) for c in cutsets])
+
+    assert probability_any_cutset(cutsets, x) == pytest.approx(expected)
+    assert probability_any_cutset([], x) == 0.0
+
+
 def test_brute_force_bdd_cutsets(canonical: SystemGraph):
     expected = frozenset([frozenset(["x1"]),
                           frozenset(["x2", "x5"]),
@@ -78,3 +111,79 @@ def test_brute_force_bdd_cutsets(canonical: SystemGraph):
 
     assert brute_force_bdd_cutsets(canonical) == expected
 
+
+
+@pytest.mark.parametrize("filename", (
+                         "minimal.json", "diamond.json", "diamond_suppliers.json", "canonical.json",
+                         "full_example_system.json", "full_with_supplier_choices.json"
+                         ))
+@pytest.mark.parametrize("ignore_suppliers", (True, False))
+def test_bdd_minimal_cutsets_match_mocus(filename, ignore_suppliers):
+    sg = get_sg_from_file(filename)
+    cutsets = bdd_minimal_cutsets(sg, ignore_suppliers)
+
+    assert cutsets == mocus(sg, ignore_suppliers)
+    assert count_minimal_cutsets(sg, ignore_suppliers) == len(cutsets)
+
+
+def test_minimal_solutions_skipped_variables():
+    bdd = _bdd.BDD()
+    bdd.declare("a", "b", "c", "d")
+    minsol, variables = minimal_solutions_bdd(bdd, bdd.add_expr("(a & d) | (b & c) | (a & b & c & d)"))
+    cutsets = masks_to_cutsets(minimal_solution_masks(bdd, minsol, variables), variables)
+
+    assert set(cutsets) == {frozenset(["a", "d"]), frozenset(["b", "c"])}
+
+
+def test_minimal_solutions_restores_reordering_on_error():
+    class FailingBDD:
+        def __init__(self, bdd):
+            self.bdd = bdd
+
+        def __getattr__(self, name):
+            return getattr(self.bdd, name)
+
+        def ite(self, *args):
+            raise MemoryError("out of nodes")
+
+    bdd = _bdd.BDD()
+    bdd.declare("a", "b")
+    bdd.configure(reordering=True)
+    with pytest.raises(MemoryError):
+        minimal_solutions_bdd(FailingBDD(bdd), bdd.add_expr("a | b"))
+    assert bdd.configure()["reordering"]
+
+
+def test_count_minimal_cutsets_large():
+    sg = get_sg_from_file("rand_system_graph_tree_500.json")
+    assert count_minimal_cutsets(sg) > 10**18
+
+
+@pytest.mark.parametrize("max_order", (None, 1, 2, 3))
+def test_top_k_minimal_cutsets(max_order):
+    sg = get_sg_from_file("full_example_system.json")
+    p = provide_p_direct_from_data(sg, get_data_from_file("full_example_data_1.json"))
+    ranked = sorted((math.prod(p[x] for x in c) for c in bdd_minimal_cutsets(sg)
+                     if max_order is None or len(c) <= max_order), reverse=True)
+    top = top_k_minimal_cutsets(sg, p, 10, max_order)
+
+    assert [prob for _, prob in top] == pytest.approx(ranked[:10])
+    assert all(math.prod(p[x] for x in c) == pytest.approx(prob) for c, prob in top)
+
+
+@pytest.mark.parametrize("max_order", (1, 2, 3))
+def test_minimal_cutsets_up_to_order(max_order, full_example_system: SystemGraph):
+    expected = {c for c in bdd_minimal_cutsets(full_example_system) if len(c) <= max_order}
+    assert minimal_cutsets_up_to_order(full_example_system, max_order) == expected
+    assert minimal_cutsets_up_to_order(full_example_system, max_order, limit=len(expected)) == expected
+    if expected:
+        with pytest.raises(ValueError):
+            minimal_cutsets_up_to_order(full_example_system, max_order, limit=len(expected) - 1)
+
+
+def test_cutset_queries_large():
+    sg = get_sg_from_file("rand_system_graph_tree_500.json")
+    p = {n: 0.01 for n in sg.nodes}
+
+    assert len(top_k_minimal_cutsets(sg, p, 20)) == 20
+    assert all(len(c) == 1 for c in minimal_cutsets_up_to_order(sg, 1))
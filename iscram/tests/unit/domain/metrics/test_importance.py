@@ -2,8 +2,10 @@ from pytest import approx
 from typing import Dict
 from iscram.domain.model import SystemGraph
 from iscram.domain.metrics.importance import (
-    birnbaum_importance, birnbaum_structural_importance, fractional_importance_of_attributes
+    birnbaum_importance, birnbaum_structural_importance, fractional_importance_of_attributes,
+    edge_existence_importance
 )
+from iscram.domain.metrics.risk import risk_by_bdd, risk_by_bdd_with_uncertain_edges
 from iscram.domain.metrics.probability_providers import provide_p_direct_from_data
 
 
@@ -18,6 +20,18 @@ def test_birnbaum_structural_importance_minimal(minimal: SystemGraph):
     assert b_imps == {"x1": 0.25, "x2": 0.25, "x3": 0.75}
 
 
+def test_birnbaum_importance_matches_two_evaluations(full_example_system: SystemGraph, full_example_data_1: Dict):
+    p = provide_p_direct_from_data(full_example_system, full_example_data_1)
+    bdd_with_root = full_example_system.get_bdd_with_root()
+    b_imps = birnbaum_importance(full_example_system, p, bdd_with_root)
+
+    assert set(b_imps) == set(full_example_system.nodes) - {"indicator"}
+    for i, b_imp in b_imps.items():
+        risk_top = risk_by_bdd(full_example_system, {**p, i: 1.0}, bdd_with_root)
+        risk_bottom = risk_by_bdd(full_example_system, {**p, i: 0.0}, bdd_with_root)
+        assert b_imp == approx(risk_top - risk_bottom)
+
+
 def test_select_birnbaum_importance(minimal: SystemGraph):
     p = {"x1": 0, "x2": 0, "x3": 0, "indicator": 0}
     b_imps = birnbaum_importance(minimal, p, select=["x2", "x3"])
@@ -37,3 +51,14 @@ def test_fractional_importance_traits(full_example_system: SystemGraph, full_exa
     assert approx((9/28), f_imps["domestic"][True])
     assert approx((7/28), f_imps["certified"][False])
     assert approx((7/28), f_imps["certified"][True])
+
+
+def test_edge_existence_importance_matches_two_evaluations(canonical: SystemGraph):
+    p = {x: (i + 1) / (len(canonical.nodes) + 2) for i, x in enumerate(sorted(canonical.nodes))}
+    existence = {(e.src, e.dst): 0.5 for e in canonical.edges[:4]}
+    imps = edge_existence_importance(canonical, p, existence)
+
+    for edge in existence:
+        present = risk_by_bdd_with_uncertain_edges(canonical, p, {**existence, edge: 1.0})
+        absent = risk_by_bdd_with_uncertain_edges(canonical, p, {**existence, edge: 0.0})
+        assert imps[edge] == approx(present - absent)
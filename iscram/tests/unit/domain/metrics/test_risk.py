@@ -1,3 +1,6 @@
+from itertools import product
+
+import pytest
 from pytest import approx
 
 from iscram.domain.model import SystemGraph
@@ -7,8 +10,9 @@ from iscram.domain.metrics.probability_providers import (
 )
 
 from iscram.domain.metrics.risk import (
-    risk_by_cutsets, risk_by_bdd, probability_any_cutset
+    risk_by_cutsets, risk_by_bdd, probability_any_cutset, risk_bounds_by_cutsets, risk_by_bdd_with_uncertain_edges
 )
+from iscram.domain.metrics.cutset import RARE_EVENT, MIN_CUT_UPPER_BOUND, INCLUSION_EXCLUSION
 
 
 def test_risk_by_cutsets_minimal(minimal: SystemGraph):
@@ -65,3 +69,68 @@ def test_manual_risk_cutsets_canonical():
     p = {"x1": 0.5, "x2": 0.5, "x3": 0.5, "x4": 0.5, "x5": 0.5, "x6": 0.5, "x7": 0.5, "x8": 0.5, "x9": 0.5}
     assert approx(probability_any_cutset(cutsets, p) == 0.9748495630919933)
 
+
+
+@pytest.mark.parametrize("mode", (RARE_EVENT, MIN_CUT_UPPER_BOUND, INCLUSION_EXCLUSION))
+def test_risk_bounds_by_cutsets_contain_exact(mode, canonical: SystemGraph):
+    p = {n: 0.1 for n in canonical.nodes}
+    p["indicator"] = 0.0
+    exact = risk_by_bdd(canonical, p)
+    result = risk_bounds_by_cutsets(canonical, p, mode=mode, tolerance=1e-4)
+
+    assert result.lower <= exact + 1e-12
+    assert exact <= result.upper + 1e-12
+
+
+def test_risk_bounds_by_cutsets_inclusion_exclusion(canonical: SystemGraph):
+    p = {n: 0.1 for n in canonical.nodes}
+    p["indicator"] = 0.0
+    exact = risk_by_bdd(canonical, p)
+
+    tolerance = 1e-4
+    result = risk_bounds_by_cutsets(canonical, p, tolerance=tolerance)
+    assert result.upper - result.lower <= tolerance
+    assert result.risk == approx(exact, abs=tolerance)
+
+    complete = risk_bounds_by_cutsets(canonical, p, tolerance=0.0)
+    assert complete.lower == approx(exact)
+    assert complete.upper == approx(exact)
+
+
+def test_risk_bounds_by_cutsets_max_terms(full_example_system: SystemGraph):
+    p = {n: 0.1 for n in full_example_system.nodes}
+    result = risk_bounds_by_cutsets(full_example_system, p, max_terms=100)
+    assert result.order == 1
+    assert result.upper == approx(risk_by_cutsets(full_example_system, p))
+
+
+def test_risk_bounds_by_cutsets_unknown_mode(minimal: SystemGraph):
+    with pytest.raises(ValueError):
+        risk_bounds_by_cutsets(minimal, provide_p_unknown_data(minimal), mode="EXACT")
+
+
+def test_risk_with_certain_edges_is_risk(canonical: SystemGraph):
+    p = {x: (i + 1) / (len(canonical.nodes) + 2) for i, x in enumerate(sorted(canonical.nodes))}
+    existence = {(e.src, e.dst): 1.0 for e in canonical.edges}
+    assert risk_by_bdd_with_uncertain_edges(canonical, p, existence) == approx(risk_by_bdd(canonical, p))
+    assert risk_by_bdd_with_uncertain_edges(canonical, p, {}) == approx(risk_by_bdd(canonical, p))
+
+
+@pytest.mark.parametrize("n_uncertain", [1, 3, 5])
+def test_risk_with_uncertain_edges_matches_enumeration(n_uncertain, canonical: SystemGraph):
+    p = {x: (i + 1) / (len(canonical.nodes) + 2) for i, x in enumerate(sorted(canonical.nodes))}
+    uncertain = canonical.edges[:n_uncertain]
+    existence = {(e.src, e.dst): 0.2 + 0.15 * i for i, e in enumerate(uncertain)}
+
+    expected = 0.0
+    for present in product([True, False], repeat=n_uncertain):
+        weight = 1.0
+        edges = [e for e in canonical.edges if e not in uncertain]
+        for e, is_present in zip(uncertain, present):
+            q = existence[(e.src, e.dst)]
+            weight *= q if is_present else 1 - q
+            if is_present:
+                edges.append(e)
+        expected += weight * risk_by_bdd(SystemGraph(canonical.nodes, edges), p)
+
+    assert risk_by_bdd_with_uncertain_edges(canonical, p, existence) == approx(expected)
@@ -0,0 +1,81 @@
+import random
+
+import pytest
+
+from iscram.domain.model import SystemGraph
+from iscram.domain.metrics import simulation
+from iscram.domain.metrics.simulation import (
+    simulate_risk, wilson_interval, importance_sampling_risk, FAILURE_BIASING, CROSS_ENTROPY
+)
+from iscram.domain.metrics.risk import risk_by_bdd
+from iscram.domain.metrics.probability_providers import provide_p_direct_from_data, provide_p_unknown_data
+
+
+def test_simulate_risk_matches_bdd(full_example_system: SystemGraph, full_example_data_1):
+    p = provide_p_direct_from_data(full_example_system, full_example_data_1)
+    result = simulate_risk(full_example_system, p, trials=200000, seed=0, confidence=0.999)
+
+    assert result.lower <= risk_by_bdd(full_example_system, p) <= result.upper
+    assert result.trials == 200000
+
+
+def test_simulate_risk_supplier_logic(diamond_suppliers: SystemGraph):
+    p = provide_p_unknown_data(diamond_suppliers)
+    result = simulate_risk(diamond_suppliers, p, trials=100000, seed=0, confidence=0.999)
+
+    assert result.lower <= risk_by_bdd(diamond_suppliers, p) <= result.upper
+
+
+def test_simulate_risk_deterministic_nodes(minimal: SystemGraph):
+    p = {"indicator": 0.0, "x1": 1.0, "x2": 1.0, "x3": 0.0}
+    assert simulate_risk(minimal, p, trials=1000, seed=0).failures == 1000
+    p["x2"] = 0.0
+    assert simulate_risk(minimal, p, trials=1000, seed=0).failures == 0
+
+
+def test_simulate_risk_reproducible(canonical: SystemGraph, monkeypatch):
+    monkeypatch.setattr(simulation, "TASK_TRIALS", 4096)
+    p = {n: 0.02 for n in canonical.nodes}
+
+    one = simulate_risk(canonical, p, trials=20000 + 7, seed=42, processes=1)
+    two = simulate_risk(canonical, p, trials=20000 + 7, seed=42, processes=2)
+    assert one == two
+
+
+def test_wilson_interval():
+    lower, upper = wilson_interval(0, 1000, 0.95)
+    assert lower == pytest.approx(0.0)
+    assert 0.0 < upper < 0.01
+
+    lower, upper = wilson_interval(500, 1000, 0.95)
+    assert lower == pytest.approx(0.469, abs=1e-3)
+    assert upper == pytest.approx(0.531, abs=1e-3)
+
+
+@pytest.mark.parametrize("method", (FAILURE_BIASING, CROSS_ENTROPY))
+@pytest.mark.parametrize("condition_on_failure", (True, False))
+def test_importance_sampling_rare_risk(method, condition_on_failure, full_example_system: SystemGraph):
+    rng = random.Random(0)
+    p = {n: rng.uniform(0.0001, 0.01) for n in full_example_system.nodes}
+    exact = risk_by_bdd(full_example_system, p)
+    result = importance_sampling_risk(full_example_system, p, method, condition_on_failure, relative_error=0.02,
+                                      max_trials=2**18, seed=0)
+
+    assert result.risk == pytest.approx(exact, rel=0.1)
+    assert result.effective_sample_size > 100
+    assert result.lower <= result.risk <= result.upper
+
+
+def test_importance_sampling_adaptive_stopping(canonical: SystemGraph):
+    p = {n: 0.01 for n in canonical.nodes}
+    loose = importance_sampling_risk(canonical, p, relative_error=0.05, min_trials=0, batch_trials=1024, seed=0)
+    tight = importance_sampling_risk(canonical, p, relative_error=0.005, min_trials=0, batch_trials=1024, seed=0)
+
+    assert loose.trials < tight.trials
+    assert loose.relative_error <= 0.05
+    assert tight.relative_error <= 0.005
+
+
+def test_importance_sampling_unknown_method(minimal: SystemGraph):
+    with pytest.raises(ValueError):
+        importance_sampling_risk(minimal, provide_p_unknown_data(minimal), method="SPLITTING")
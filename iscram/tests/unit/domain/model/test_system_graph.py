@@ -2,7 +2,7 @@ import copy
 import pytest
 
 from iscram.domain.model import (
-    Node, Edge, SystemGraph, validate_data
+    Node, Edge, SystemGraph, validate_data, validate_risk_distribution, DataValidationError
 )
 
 
@@ -195,3 +195,23 @@ def test_dict_nested_success(canonical: SystemGraph):
     d = canonical.dict()
     assert "nodes" in d and "edges" in d
     assert "x1" in d["nodes"] and d["nodes"]["x1"]["tags"] is not None
+
+
+@pytest.mark.parametrize("distribution,valid", (
+                         ({"type": "beta", "alpha": 2, "beta": 50}, True),
+                         ({"type": "beta", "alpha": 0, "beta": 50}, False),
+                         ({"type": "uniform", "low": 0.01, "high": 0.05}, True),
+                         ({"type": "uniform", "low": 0.05, "high": 0.01}, False),
+                         ({"type": "triangular", "low": 0.01, "mode": 0.02, "high": 0.05}, True),
+                         ({"type": "triangular", "low": 0.01, "mode": 0.2, "high": 0.05}, False),
+                         ({"type": "triangular", "low": 0.01, "high": 0.05}, False),
+                         ({"type": "normal", "mean": 0.1}, False)
+                         ))
+def test_validate_risk_distribution(distribution, valid, minimal: SystemGraph):
+    assert validate_risk_distribution(distribution) == valid
+    data = {"nodes": {"x1": {"risk_distribution": distribution}}}
+    if valid:
+        validate_data(minimal, data)
+    else:
+        with pytest.raises(DataValidationError):
+            validate_data(minimal, data)
@@ -1,7 +1,12 @@
+import numpy as np
 import pytest
+import pyomo.environ as pyo
 
-from iscram.domain.model import SystemGraph, Edge
-from iscram.domain.optimization import SupplierChoiceProblem, OptimizationError
+from iscram.domain import optimization
+from iscram.domain.model import SystemGraph, Edge, DataValidationError
+from iscram.domain.optimization import (
+    SupplierChoiceProblem, OptimizationError, SweepPoint, pareto_frontier, sweep_supplier_choices, neighbour_choices
+)
 from iscram.domain.metrics.risk import risk_by_bdd
 from iscram.domain.metrics.probability_providers import provide_p_direct_from_data
 
@@ -11,6 +16,37 @@ def test_init_supplier_choice_problem(full_with_supplier_choices: SystemGraph, f
     assert prob is not None
 
 
+def test_supplier_choice_variables_only_for_valid_pairings(full_with_supplier_choices: SystemGraph,
+                                                          full_with_supplier_choices_data):
+    prob = SupplierChoiceProblem(full_with_supplier_choices, full_with_supplier_choices_data)
+    valid = {(e.src, e.dst) for e in full_with_supplier_choices.edges
+             if e.src in full_with_supplier_choices.suppliers and e.dst in full_with_supplier_choices.components}
+    valid |= {(e["src"], e["dst"]) for e in full_with_supplier_choices_data["edges"]}
+    pairs = {(prob.map_index_supplier[j], prob.map_index_component[i]) for i, j in prob.pairs}
+
+    assert pairs == valid
+    assert len(prob.model.x) == len(valid) < prob.N * prob.M
+    for i, pair_indices in enumerate(prob.pairs_of_component):
+        assert all(prob.pairs[p][0] == i for p in pair_indices)
+
+
+def test_supplier_choice_model_parameters_are_mutable(full_with_supplier_choices: SystemGraph,
+                                                      full_with_supplier_choices_data):
+    prob = SupplierChoiceProblem(full_with_supplier_choices, full_with_supplier_choices_data)
+    model = prob.model
+    for i in range(prob.N):
+        model.x[prob.pairs_of_component[i][0]] = 1
+
+    model.a = 0
+    assert pyo.value(model.Objective) == pytest.approx(pyo.value(model.apx_risk))
+    model.a = 2
+    assert pyo.value(model.Objective) == pytest.approx(
+        pyo.value(model.apx_risk) + 2 * pyo.value(model.s_group_penalty))
+    model.b = 500
+    assert pyo.value(model.BudgetConstraint.upper) == 500
+    assert prob.model is model
+
+
 def test_init_supplier_choice_solve(full_with_supplier_choices: SystemGraph, full_with_supplier_choices_data):
     prob = SupplierChoiceProblem(full_with_supplier_choices, full_with_supplier_choices_data)
     results = prob.solve({"alpha": 0.01, "budget": 500})
@@ -49,3 +85,113 @@ def test_e2e_supplier_choice_solve_bad_supplier_risk(full_with_supplier_choices:
     assert Edge(src=bad["src"], dst=bad["dst"]) not in updated.edges
     after = risk_by_bdd(updated, provide_p_direct_from_data(updated, full_with_supplier_choices_data))
     assert before > after
+
+
+def test_pareto_frontier():
+    def point(cost, risk):
+        return SweepPoint(budget=cost, alpha=0.01, cost=cost, risk=risk, edges=[], metadata={})
+
+    points = [point(10, 0.5), point(5, 0.6), point(20, 0.5), point(30, 0.2), point(5, 0.7), point(25, 0.3)]
+    frontier = pareto_frontier(points)
+    assert [(pt.cost, pt.risk) for pt in frontier] == [(5, 0.6), (10, 0.5), (25, 0.3), (30, 0.2)]
+
+
+def test_heuristic_supplier_choice_solve(full_with_supplier_choices: SystemGraph, full_with_supplier_choices_data):
+    prob = SupplierChoiceProblem(full_with_supplier_choices, full_with_supplier_choices_data)
+    edges, metadata = prob.solve({"alpha": 0.01, "budget": 500, "solver": "heuristic"})
+    assert len(edges) == prob.N
+    assert metadata["cost"] <= 500
+    assert metadata["lower_bound"] <= metadata["objective"]
+    assert 0 <= metadata["gap"] <= 1
+
+
+def test_heuristic_supplier_choice_solve_bad_budget(full_with_supplier_choices: SystemGraph,
+                                                    full_with_supplier_choices_data):
+    prob = SupplierChoiceProblem(full_with_supplier_choices, full_with_supplier_choices_data)
+    with pytest.raises(OptimizationError):
+        prob.solve({"alpha": 0.01, "budget": 1, "solver": "heuristic"})
+
+
+def test_supplier_choice_solve_unknown_solver(full_with_supplier_choices: SystemGraph,
+                                              full_with_supplier_choices_data):
+    prob = SupplierChoiceProblem(full_with_supplier_choices, full_with_supplier_choices_data)
+    with pytest.raises(ValueError):
+        prob.solve({"alpha": 0.01, "budget": 500, "solver": "unknown"})
+
+
+def test_e2e_heuristic_supplier_choice_solve_bad_supplier_risk(full_with_supplier_choices: SystemGraph,
+                                                               full_with_supplier_choices_data):
+    bad = full_with_supplier_choices_data["edges"][0]
+    bad["risk"] = 0.99
+    before = risk_by_bdd(full_with_supplier_choices, provide_p_direct_from_data(full_with_supplier_choices, full_with_supplier_choices_data))
+    prob = SupplierChoiceProblem(full_with_supplier_choices, full_with_supplier_choices_data)
+    results = prob.solve({"alpha": 0.01, "budget": 500, "solver": "heuristic"})
+    updated = full_with_supplier_choices.with_suppliers(results[0])
+    assert Edge(src=bad["src"], dst=bad["dst"]) not in updated.edges
+    after = risk_by_bdd(updated, provide_p_direct_from_data(updated, full_with_supplier_choices_data))
+    assert before > after
+
+
+def test_heuristic_sweep_supplier_choices(full_with_supplier_choices: SystemGraph, full_with_supplier_choices_data):
+    frontier = sweep_supplier_choices(full_with_supplier_choices, full_with_supplier_choices_data,
+                                      range(0, 60, 10), [0.01, 1.0], params={"solver": "heuristic"})
+    assert len(frontier) > 0
+    assert all(point.cost <= point.budget for point in frontier)
+    assert [pt.cost for pt in frontier] == sorted(pt.cost for pt in frontier)
+    assert [pt.risk for pt in frontier] == sorted((pt.risk for pt in frontier), reverse=True)
+
+
+def test_neighbour_choices(full_with_supplier_choices: SystemGraph, full_with_supplier_choices_data):
+    prob = SupplierChoiceProblem(full_with_supplier_choices, full_with_supplier_choices_data)
+    arrays = prob.arrays
+    choice = np.array([pairs[0] for pairs in prob.pairs_of_component])
+    neighbours = neighbour_choices(arrays, choice)
+
+    assert len(neighbours) >= len(prob.pairs) - prob.N
+    for neighbour in neighbours:
+        assert np.array_equal(arrays.component[neighbour], np.arange(prob.N))
+        assert (neighbour != choice).any()
+
+
+@pytest.mark.parametrize("processes", [1, 2])
+def test_refine_on_exact_risk(processes, full_with_supplier_choices: SystemGraph, full_with_supplier_choices_data,
+                              monkeypatch):
+    # small chunks, so that the neighbours are spread over the processes
+    monkeypatch.setattr(optimization, "EVALUATION_CHUNK", 8)
+    prob = SupplierChoiceProblem(full_with_supplier_choices, full_with_supplier_choices_data)
+    params = {"alpha": 0.01, "budget": 500, "solver": "heuristic"}
+    edges, _ = prob.solve(params)
+    refined, metadata = prob.refine(edges, params, processes=processes)
+
+    def exact_risk(chosen):
+        updated = full_with_supplier_choices.with_suppliers(chosen)
+        return risk_by_bdd(updated, provide_p_direct_from_data(updated, full_with_supplier_choices_data))
+
+    assert metadata["initial_exact_risk"] == pytest.approx(exact_risk(edges))
+    assert metadata["exact_risk"] == pytest.approx(exact_risk(refined))
+    assert metadata["exact_risk"] <= metadata["initial_exact_risk"]
+    assert metadata["cost"] <= 500
+
+
+def test_evaluate_assignments(full_with_supplier_choices: SystemGraph, full_with_supplier_choices_data):
+    prob = SupplierChoiceProblem(full_with_supplier_choices, full_with_supplier_choices_data)
+    assignments = [[Edge(src=prob.pair_names[p][0], dst=prob.pair_names[p][1]) for p in pairs]
+                   for pairs in zip(*prob.pairs_of_component)]
+    risks, costs = prob.evaluate(assignments)
+
+    for edges, risk, cost in zip(assignments, risks, costs):
+        updated = full_with_supplier_choices.with_suppliers(edges)
+        assert risk == pytest.approx(risk_by_bdd(updated, provide_p_direct_from_data(updated, full_with_supplier_choices_data)))
+        assert cost == pytest.approx(sum(prob.pair_costs[prob.pair_names.index((e.src, e.dst))] for e in edges))
+
+
+def test_evaluate_invalid_assignments(full_with_supplier_choices: SystemGraph, full_with_supplier_choices_data):
+    prob = SupplierChoiceProblem(full_with_supplier_choices, full_with_supplier_choices_data)
+    complete = [Edge(src=prob.pair_names[pairs[0]][0], dst=prob.pair_names[pairs[0]][1])
+                for pairs in prob.pairs_of_component]
+    with pytest.raises(DataValidationError):
+        prob.evaluate([complete[1:]])
+    with pytest.raises(DataValidationError):
+        prob.evaluate([complete + [complete[0]]])
+    with pytest.raises(DataValidationError):
+        prob.evaluate([complete[1:] + [Edge(src="indicator", dst=complete[0].dst)]])
@@ -0,0 +1,90 @@
+import numpy as np
+import pytest
+
+from iscram.domain.optimization import SupplierChoiceProblem, validate_params
+from iscram.domain.supplier_choice_heuristic import SupplierChoiceArrays
+from iscram.domain.supplier_choice_decomposition import independent_blocks, solve_decomposed
+from iscram.tests.conftest import brute_force_objective, random_problem
+
+
+def separable_problem(rng, parts=3):
+    """ Random problems side by side, with disjoint components, suppliers and groups. """
+    problems = [random_problem(rng) for _ in range(parts)]
+    n = m = 0
+    pairs, groups = [], []
+    for prob in problems:
+        pairs += [(i + n, j + m) for i, j in prob.pairs]
+        groups += [[j + m for j in group] for group in prob.supplier_groups]
+        n, m = n + prob.N, m + prob.M
+    combined = problems[0].__class__(
+        N=n, M=m, K=len(groups), pairs=pairs, supplier_groups=groups,
+        **{name: sum((getattr(prob, name) for prob in problems), [])
+           for name in ("pair_risks", "pair_costs", "component_importances", "supplier_risks", "group_risks")})
+    return combined, len(problems)
+
+
+def test_independent_blocks():
+    rng = np.random.default_rng(2)
+    for _ in range(20):
+        prob, parts = separable_problem(rng)
+        arrays = SupplierChoiceArrays(prob)
+        blocks = independent_blocks(arrays)
+
+        assert parts <= len(blocks) <= prob.N
+        assert np.array_equal(np.sort(np.concatenate(blocks)), np.arange(len(prob.pairs)))
+        for k in range(prob.K):
+            scored = set(np.flatnonzero(arrays.group_scores[k]).tolist())
+            assert sum(bool(scored & set(pairs.tolist())) for pairs in blocks) <= 1
+
+        choice = arrays.component_argmin(arrays.costs, -arrays.weights)
+        total = 0.0
+        for pairs in blocks:
+            block = arrays.block(pairs)
+            local = np.searchsorted(pairs, choice[np.isin(choice, pairs)])
+            total += block.terms(local, 0.7)[2]
+        assert total == pytest.approx(arrays.terms(choice, 0.7)[2])
+
+
+def test_solve_decomposed_against_brute_force():
+    rng = np.random.default_rng(3)
+    for _ in range(10):
+        prob, _ = separable_problem(rng, 2)
+        arrays = SupplierChoiceArrays(prob)
+        budget, alpha = float(rng.integers(0, 80)), float(rng.choice([0.0, 0.1, 1.0]))
+        best = brute_force_objective(arrays, budget, alpha)
+        solution = solve_decomposed(arrays, budget, alpha)
+        if best == np.inf:
+            assert solution is None
+            continue
+        assert solution.cost <= budget
+        assert solution.objective >= best - 1e-9
+        assert solution.objective == pytest.approx(arrays.terms(solution.choice, alpha)[2])
+        assert np.array_equal(arrays.component[solution.choice], np.arange(prob.N))
+
+
+def test_decomposed_solve_in_processes(full_with_supplier_choices, full_with_supplier_choices_data):
+    prob = SupplierChoiceProblem(full_with_supplier_choices, full_with_supplier_choices_data)
+    params = {"budget": 40, "alpha": 0.5, "solver": "heuristic", "decompose": True}
+    edges, metadata = prob.solve(params)
+    pooled_edges, pooled_metadata = prob.solve(params, processes=2)
+
+    assert metadata["cost"] <= 40
+    assert pooled_edges == edges
+    assert pooled_metadata["objective"] == pytest.approx(metadata["objective"])
+    with pytest.raises(ValueError):
+        prob.solve({**params, "solver": "couenne"})
+
+
+def test_validate_params_negative_alpha():
+    validate_params({"budget": 40, "alpha": 0.0, "solver": "heuristic"})
+    with pytest.raises(ValueError):
+        validate_params({"budget": 40, "alpha": -0.5, "solver": "heuristic"})
+
+
+def test_validate_params_decompose():
+    params = {"budget": 40, "alpha": 0.5, "decompose": True}
+    validate_params({**params, "solver": "heuristic"})
+    validate_params({**params, "solver": "exact", "fallback_solver": "heuristic"})
+    for solvers in ({}, {"solver": "couenne"}, {"solver": "exact"}, {"solver": "exact", "fallback_solver": "exact"}):
+        with pytest.raises(ValueError):
+            validate_params({**params, **solvers})
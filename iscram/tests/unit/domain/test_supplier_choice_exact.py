@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+import iscram.domain.supplier_choice_exact as exact
+from iscram.domain.optimization import SupplierChoiceProblem
+from iscram.domain.metrics.choice_bdd import provide_p_with_choices_from_data
+from iscram.domain.supplier_choice_exact import solve_exact
+from iscram.tests.conftest import all_choices, derived_risk
+
+
+def solve(problem, budget, costs=None):
+    p = provide_p_with_choices_from_data(problem._sg, problem._data, problem.pair_names)
+    costs = problem.pair_costs if costs is None else costs
+    return solve_exact(problem.choice_bdd, p, costs, problem.pairs_of_component, budget)
+
+
+def brute_force(problem, budget, costs=None):
+    """ Least exact risk within budget and the total cost of every choice, evaluated on the choice BDD. """
+    choices = all_choices(problem)
+    costs = np.asarray(problem.pair_costs if costs is None else costs)[choices].sum(axis=1)
+    selections = np.zeros((len(choices), len(problem.pairs)), dtype=bool)
+    selections[np.arange(len(choices))[:, np.newaxis], choices] = True
+    risks = problem.choice_bdd.risk_batch(problem._choice_p_vector(), selections)
+    return risks[costs <= budget].min() if (costs <= budget).any() else None, costs
+
+
+@pytest.mark.parametrize("budget", [0, 1, 2, 3, 5, 6, 11])
+def test_solve_exact_against_brute_force(supplier_chain, budget):
+    sg, data = supplier_chain
+    problem = SupplierChoiceProblem(sg, data)
+    solution = solve(problem, budget)
+
+    assert solution.cost <= budget
+    assert solution.risk == pytest.approx(brute_force(problem, budget)[0], abs=1e-12)
+    assert solution.risk == pytest.approx(derived_risk(sg, data, problem.pair_names, solution.choice), abs=1e-12)
+
+
+def test_solve_exact_full(full_with_supplier_choices, full_with_supplier_choices_data):
+    problem = SupplierChoiceProblem(full_with_supplier_choices, full_with_supplier_choices_data)
+    solution = solve(problem, 40)
+    assert solution.cost <= 40
+    assert solution.risk == pytest.approx(brute_force(problem, 40)[0], abs=1e-12)
+
+    rng = np.random.default_rng(0)
+    for _ in range(3):
+        costs = rng.integers(0, 10, len(problem.pairs)).astype(float)
+        for quantile in (1, 10, 50):
+            budget = np.percentile(brute_force(problem, 0, costs)[1], quantile)
+            solution = solve(problem, budget, costs)
+            assert solution.cost <= budget
+            assert solution.risk == pytest.approx(brute_force(problem, budget, costs)[0], abs=1e-12)
+
+
+def test_solve_exact_infeasible(supplier_chain):
+    sg, data = supplier_chain
+    assert solve(SupplierChoiceProblem(sg, data), -1) is None
+
+
+def test_exact_solver_falls_back(supplier_chain, monkeypatch):
+    sg, data = supplier_chain
+    problem = SupplierChoiceProblem(sg, data)
+    edges, metadata = problem.solve({"budget": 5, "alpha": 0.5, "solver": "exact"})
+    assert metadata["exact_risk"] == pytest.approx(brute_force(problem, 5)[0], abs=1e-12)
+
+    monkeypatch.setattr(exact, "EXACT_MAX_NODES", 1)
+    edges, metadata = problem.solve({"budget": 5, "alpha": 0.5, "solver": "exact", "fallback_solver": "heuristic"})
+    assert metadata["fallback_solver"] == "heuristic"
+    assert "too large" in metadata["fallback_reason"]
+    assert metadata["cost"] <= 5
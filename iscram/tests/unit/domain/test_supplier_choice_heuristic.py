@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from iscram.domain.optimization import SupplierChoiceProblem
+from iscram.domain.supplier_choice_heuristic import SupplierChoiceArrays, solve_heuristic
+from iscram.tests.conftest import brute_force_objective, random_problem
+
+
+def test_arrays_match_pyomo_objective(full_with_supplier_choices, full_with_supplier_choices_data):
+    prob = SupplierChoiceProblem(full_with_supplier_choices, full_with_supplier_choices_data)
+    arrays = SupplierChoiceArrays(prob)
+    choice = np.array([pairs[-1] for pairs in prob.pairs_of_component])
+    for p in range(len(prob.pairs)):
+        prob.model.x[p] = 1 if p in choice else 0
+    prob.model.a = 2.0
+
+    apx_risk, penalty, objective = arrays.terms(choice, 2.0)
+    assert apx_risk == pytest.approx(prob.model.apx_risk())
+    assert penalty == pytest.approx(prob.model.s_group_penalty())
+    assert objective == pytest.approx(prob.model.Objective())
+
+
+def test_move_deltas_match_terms():
+    rng = np.random.default_rng(0)
+    arrays = SupplierChoiceArrays(random_problem(rng))
+    choice = arrays.component_argmin(arrays.costs, arrays.weights)
+    d_objective, d_cost = arrays.move_deltas(choice, 1.5)
+    objective = arrays.terms(choice, 1.5)[2]
+    for p in range(len(arrays.costs)):
+        moved = choice.copy()
+        moved[arrays.component[p]] = p
+        assert d_objective[p] == pytest.approx(arrays.terms(moved, 1.5)[2] - objective)
+        assert d_cost[p] == pytest.approx(arrays.costs[moved].sum() - arrays.costs[choice].sum())
+
+
+def test_solve_heuristic_against_brute_force():
+    rng = np.random.default_rng(1)
+    for _ in range(50):
+        arrays = SupplierChoiceArrays(random_problem(rng))
+        budget, alpha = float(rng.integers(0, 60)), float(rng.choice([0.0, 0.1, 1.0, 10.0]))
+        best = brute_force_objective(arrays, budget, alpha)
+        solution = solve_heuristic(arrays, budget, alpha)
+        if best == np.inf:
+            assert solution is None
+            continue
+        assert solution.cost <= budget
+        assert solution.lower_bound <= best + 1e-9
+        assert solution.objective >= best - 1e-9
+        assert solution.objective == pytest.approx(arrays.terms(solution.choice, alpha)[2])
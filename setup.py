@@ -12,6 +12,7 @@ setup(
 		"uvicorn==0.11.7",
 		"fastapi==0.63.0",
 		"pytest==6.2.2",
-		"pyomo==5.7.3"
+		"pyomo==5.7.3",
+		"numpy==1.20.1"
 	],
 )